@@ -0,0 +1,143 @@
+"""
+QtPaint, пакетная отрисовка документов без окна.
+
+Скрипт берет документы Qt Paint (родной формат .qtp или JSON, который возвращает функция dumpDocument), заново
+рисует их объекты в картинку и сохраняет ее в PNG, JPG или BMP. Окно при этом не открывается: Qt работает на
+платформе offscreen, поэтому скрипт можно запускать на сервере сборки без экрана. Документы раскидываются по
+нескольким процессам, и в конце выводится, сколько документов в секунду получилось отрисовать.
+
+Пример запуска:
+    python batch.py drawings/ -o renders/ -f png -j 4
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtGui import QGuiApplication
+
+from main import DocumentReader, loadDocument, renderDocument
+
+"""
+Константы:
+    FORMATS - форматы, в которые умеет сохранять скрипт
+    DOCUMENT_EXTENSIONS - расширения файлов, которые считаются документами при обходе папки
+"""
+
+FORMATS = ('png', 'jpg', 'bmp')
+DOCUMENT_EXTENSIONS = ('.qtp', '.json')
+
+app = None
+
+"""
+Функция initWorker. Запускается один раз в каждом процессе-работнике и создает в нем QGuiApplication: без него Qt не
+подгружает плагины картинок (например, JPG).
+"""
+
+
+def initWorker():
+    global app
+    app = QGuiApplication.instance() or QGuiApplication(['qtpaint-batch'])
+
+
+"""
+Функция renderFile. Читает документ, рисует его объекты в плитки холста, собирает из них картинку и сохраняет ее в
+папку output под тем же именем, но с расширением формата fmt. Документ в родном формате читается потоком: объекты
+рисуются по мере чтения, списка объектов не создается. Возвращает путь к сохраненной картинке.
+"""
+
+
+def renderFile(path, output, fmt):
+    folder = os.path.dirname(os.path.abspath(path))
+    if path.lower().endswith('.qtp'):
+        with open(path, mode='rb') as file:
+            reader = DocumentReader(file, folder)
+            store = renderDocument(reader.size, reader, reader.base)
+    else:
+        with open(path, mode='r', encoding='utf-8') as file:
+            data = json.load(file)
+        size, objects = loadDocument(data, folder)
+        store = renderDocument(size, objects)
+    image = store.toImage()
+    target = os.path.join(output, os.path.splitext(os.path.basename(path))[0] + '.' + fmt)
+    if not image.save(target, fmt.upper()):
+        raise OSError(f'Не удалось сохранить {target}')
+    return target
+
+
+"""
+Функция renderJob. Обертка над renderFile для пула процессов: ошибка в одном документе не должна останавливать
+остальные, поэтому она не пробрасывается, а возвращается вместе с путем документа.
+"""
+
+
+def renderJob(job):
+    path, output, fmt = job
+    try:
+        renderFile(path, output, fmt)
+    except Exception as error:
+        return path, str(error)
+    return path, None
+
+
+"""
+Функция collectDocuments. Разворачивает переданные пути в список документов: файлы берутся как есть, из папок
+берутся все файлы с расширением из DOCUMENT_EXTENSIONS.
+"""
+
+
+def collectDocuments(paths):
+    documents = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(DOCUMENT_EXTENSIONS):
+                    documents.append(os.path.join(path, name))
+        else:
+            documents.append(path)
+    return documents
+
+
+"""
+Функция main. Разбирает аргументы командной строки, раздает документы процессам и выводит итог: сколько документов
+отрисовано, сколько с ошибкой и с какой скоростью. С одним процессом (-j 1) все рисуется прямо в текущем процессе.
+"""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Пакетная отрисовка документов Qt Paint без окна.')
+    parser.add_argument('inputs', nargs='+', help='документы или папки с документами')
+    parser.add_argument('-o', '--output', default='.', help='папка для готовых картинок')
+    parser.add_argument('-f', '--format', choices=FORMATS, default='png', help='формат картинок')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='число процессов')
+    args = parser.parse_args(argv)
+
+    documents = collectDocuments(args.inputs)
+    os.makedirs(args.output, exist_ok=True)
+    jobs = [(path, args.output, args.format) for path in documents]
+
+    start = time.perf_counter()
+    if args.jobs <= 1:
+        initWorker()
+        results = [renderJob(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs, initializer=initWorker) as pool:
+            results = list(pool.map(renderJob, jobs, chunksize=max(1, len(jobs) // (args.jobs * 4))))
+    elapsed = time.perf_counter() - start
+
+    failed = [(path, error) for path, error in results if error is not None]
+    for path, error in failed:
+        print(f'{path}: {error}', file=sys.stderr)
+    done = len(results) - len(failed)
+    rate = done / elapsed if elapsed > 0 else 0.0
+    print(f'Отрисовано {done} из {len(results)} документов за {elapsed:.2f} с ({rate:.1f} док/с)')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
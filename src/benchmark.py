@@ -0,0 +1,1018 @@
+"""
+QtPaint, замеры производительности.
+
+Скрипт прогоняет набор замеров на платформе Qt offscreen (окно не открывается) и выводит результаты в виде JSON,
+чтобы прогоны можно было сохранять и сравнивать между собой. Замеры разбиты на группы, по умолчанию запускаются
+все, а нужные можно перечислить через --suite.
+
+Группы замеров:
+    paint - время одного кадра Canvas.paintEvent в зависимости от числа объектов на холсте
+    save - время сохранения картинки (как в Window.saveFile) в каждом формате и размер файла
+    open - время открытия большой картинки в каждом формате: до уменьшенной копии, до первых плиток и до конца
+    фонового чтения
+    zoom - время кадра уменьшенного просмотра большой картинки: с пирамидой уменьшенных копий и прямо из плиток
+    input - мазок кистью от мыши с частотой INPUT_RATE: сколько кадров рисуется и сколько процессорного времени
+    уходит, когда движения собираются в кадры и когда каждое рисуется сразу
+    index - поиск фигуры под курсором по сетке SpatialIndex и перебором всех объектов, отмена с перерисовкой только
+    области отмененного объекта и с перерисовкой всего холста из истории
+    tools - цена передачи нажатия, движения и отпускания мыши инструменту: через реестр TOOLS и через прежнюю цепочку
+    сравнений имени инструмента (рисование при этом отключено)
+    objects - сколько памяти на отрезок занимает рисунок на --segments отрезков: списком объектов и в хранилище
+    PrimitiveStore (линии из двух точек и длинные мазки)
+    shapes - повтор рисунка из фигур: каждая фигура по отдельности и соседние фигуры с общими ручкой и кистью вместе
+    (см. TileStore.commitAll)
+    strokes - упрощение и сглаживание мазков, похожих на росчерки мышью: сколько точек остается, сколько занимает
+    документ и сколько длится его отрисовка до и после обработки
+    bucket - время заливки области на холсте 4K
+    filters - скорость каждого фильтра в мегапикселях в секунду и время предпросмотра
+    document - запись и чтение документа в JSON и в родном формате
+    profiler - во что обходятся замеры профилировщика (см. класс Profiler): повтор рисунка и кадры холста с
+    выключенным профилировщиком, с включенным (как при показанной панели показателей) и во время записи трассировки
+    startup - построение интерфейса окна из window.ui (uic.loadUi) и отдельно чтение иконок, на которые он ссылается
+    journal - журнал автосохранения: сколько стоит записать законченный объект (упаковка и очередь), за сколько
+    фоновый поток дописывает журнал и сколько раз вызывает fsync, размер журнала и время его чтения при восстановлении
+У каждой группы также записывается память: сколько занимают плитки холста и пиковый размер процесса.
+
+Пример запуска:
+    python benchmark.py --suite document --segments 1000000 -o results.json
+    python benchmark.py --suite paint --objects 100 1000 10000
+"""
+
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from xml.etree import ElementTree
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtCore import QEvent, QPoint, QPointF, QRect, QSize, Qt, QT_VERSION_STR, PYQT_VERSION_STR
+from PyQt5.QtGui import QColor, QImage, QMouseEvent, QPainter
+from PyQt5.QtTest import QTest
+from PyQt5.QtWidgets import QApplication, QMainWindow
+
+from main import (FILTER_KINDS, FILTER_PREVIEW, FILTER_THREADS, FILTER_TYPES, IMAGE_CACHE, TILE_SIZE, TOOLS, Brush,
+                  Bucket, STYLE_POOL, Canvas, Circle, DocumentReader, Eraser, Fill, Filter, Hexagon, Image, Journal,
+                  Line, LoadTask, Octagon, PROFILER, Pencil, Pentagon, PrimitiveStore, Rectangle, SaveTask,
+                  TilePyramid, TileStore, Triangle, dir_ui, dumpDocument, loadDocument, renderDocument,
+                  residentBytes, samplePixels, uic, writeDocument)
+
+"""
+Константы:
+    SUITES - зарегистрированные группы замеров, ключ - имя группы (см. декоратор suite)
+    CANVAS_SIZE - размер холста синтетических рисунков
+    STROKE_POINTS - сколько точек в одном синтетическом мазке
+    SESSION_STROKE_POINTS - сколько точек в мазке синтетического сеанса рисования (обычный росчерк мышью)
+    SHAPE_TYPES - фигуры, которые попадают в синтетический сеанс рисования
+    IMAGE_SIZE - размер большой картинки для замеров открытия
+    IMAGE_FORMATS - форматы, в которых замеряются сохранение и открытие
+    DIRTY_SIZE - сторона квадрата, который перерисовывается в кадре с грязным прямоугольником
+    SAVE_VARIANTS - форматы и настройки кодирования, с которыми замеряется сохранение (см. SAVE_OPTIONS)
+    BUCKET_SIZE - размер холста для замеров заливки области
+    BUCKET_TOLERANCES - допуски, с которыми замеряется заливка области
+    BUCKET_REPEATS - сколько раз повторяется каждая заливка
+    FILTER_SIZE - размер холста для замеров фильтров
+    ZOOM_SIZE - размер холста для замеров уменьшенного просмотра
+    ZOOM_LEVELS - масштабы, в которых замеряется кадр
+    INPUT_RATE - сколько движений мыши в секунду присылается в замере ввода
+    INPUT_EVENTS - сколько движений мыши в замере ввода
+    SHAPE_PALETTE - цвета, из которых выбираются цвета синтетических фигур
+    SHAPE_RUN - сколько фигур подряд самое большее рисуется одними и теми же настройками в замере shapes
+    MOUSE_STEP - средний шаг между точками синтетического росчерка мышью в пикселях
+    STROKE_TOLERANCES - допуски, с которыми замеряется упрощение мазков
+    HIT_POINTS - сколько точек проверяется в замере поиска фигуры под курсором
+    TOOL_EVENTS - сколько нажатий (и столько же движений и отпусканий) передается каждому инструменту в замере tools
+    STARTUP_REPEATS - сколько раз строится интерфейс окна в замере startup после первого построения
+"""
+
+SUITES = {}
+CANVAS_SIZE = QSize(1920, 1080)
+STROKE_POINTS = 500
+SESSION_STROKE_POINTS = 40
+SHAPE_TYPES = (Circle, Triangle, Rectangle, Pentagon, Hexagon, Octagon)
+IMAGE_SIZE = QSize(6000, 4000)
+IMAGE_FORMATS = ('png', 'jpg', 'bmp')
+DIRTY_SIZE = 64
+SAVE_VARIANTS = (('png', {'compression': 1}),
+                 ('png', {'compression': 6}),
+                 ('png', {'compression': 9}),
+                 ('jpg', {'quality': 75}),
+                 ('jpg', {'quality': 90}),
+                 ('jpg', {'quality': 100}),
+                 ('bmp', {}))
+BUCKET_SIZE = QSize(3840, 2160)
+BUCKET_TOLERANCES = (0, 32)
+BUCKET_REPEATS = 3
+FILTER_SIZE = QSize(3840, 2160)
+ZOOM_SIZE = QSize(16384, 16384)
+ZOOM_LEVELS = (1.0, 0.5, 0.25, 0.125, 1 / 32)
+INPUT_RATE = 1000
+INPUT_EVENTS = 2000
+SHAPE_PALETTE = (Qt.black, Qt.red, Qt.blue, Qt.darkGreen)
+SHAPE_RUN = 20
+MOUSE_STEP = 2.5
+STROKE_TOLERANCES = (0.5, 1.0, 2.0)
+HIT_POINTS = 200
+TOOL_EVENTS = 20000
+STARTUP_REPEATS = 5
+
+"""
+Декоратор suite. Регистрирует функцию как группу замеров под именем name. Функция получает разобранные аргументы
+командной строки и возвращает словарь с результатами.
+"""
+
+
+def suite(name):
+    def register(function):
+        SUITES[name] = function
+        return function
+    return register
+
+
+"""
+Функция timed. Вызывает function и возвращает ее результат вместе со временем выполнения в секундах.
+"""
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+"""
+Функция syntheticStrokes. Порождает мазки кисти случайным блужданием по холсту так, чтобы в сумме вышло segments
+отрезков. Генератор детерминирован: при одном и том же seed получаются одни и те же мазки.
+"""
+
+
+def syntheticStrokes(segments, seed=0):
+    rng = random.Random(seed)
+    width, height = CANVAS_SIZE.width(), CANVAS_SIZE.height()
+    while segments > 0:
+        x, y = rng.randrange(width), rng.randrange(height)
+        color = QColor(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        stroke = Brush(QPoint(x, y), rng.choice((2, 3, 5, 8)), color)
+        for _ in range(min(STROKE_POINTS, segments)):
+            x = min(max(x + rng.randint(-6, 6), 0), width - 1)
+            y = min(max(y + rng.randint(-6, 6), 0), height - 1)
+            stroke.points.append(QPoint(x, y))
+        segments -= stroke.points.size() - 1
+        yield stroke
+
+
+"""
+Функция mouseStrokes. Порождает мазки, похожие на росчерки мышью: точка идет с шагом около MOUSE_STEP пикселей и
+плавно меняет направление, а координаты, как у настоящей мыши, округляются до целых. В отличие от случайного блуждания
+syntheticStrokes, такие мазки есть что упрощать. Как и syntheticStrokes, детерминирована при одном и том же seed.
+"""
+
+
+def mouseStrokes(segments, seed=0):
+    rng = random.Random(seed)
+    width, height = CANVAS_SIZE.width(), CANVAS_SIZE.height()
+    while segments > 0:
+        x, y = rng.uniform(0, width), rng.uniform(0, height)
+        heading, turn = rng.uniform(-math.pi, math.pi), 0.0
+        color = QColor(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        stroke = Brush(QPoint(round(x), round(y)), rng.choice((2, 3, 5, 8)), color)
+        for _ in range(min(STROKE_POINTS, segments)):
+            turn = min(max(turn + rng.uniform(-0.02, 0.02), -0.1), 0.1)
+            heading += turn
+            step = MOUSE_STEP * rng.uniform(0.5, 1.5)
+            x = min(max(x + step * math.cos(heading), 0), width - 1)
+            y = min(max(y + step * math.sin(heading), 0), height - 1)
+            stroke.points.append(QPoint(round(x), round(y)))
+        segments -= stroke.points.size() - 1
+        yield stroke
+
+
+"""
+Функция syntheticLines. Порождает segments линий из двух точек со случайными концами, цветами и толщинами (самые
+"дорогие" по памяти объекты на отрезок). Детерминирована при одном и том же seed.
+"""
+
+
+def syntheticLines(segments, seed=0):
+    rng = random.Random(seed)
+    width, height = CANVAS_SIZE.width(), CANVAS_SIZE.height()
+    for _ in range(segments):
+        x, y = rng.randrange(width), rng.randrange(height)
+        color = QColor(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        yield Line(x, y, x + rng.randint(-50, 50), y + rng.randint(-50, 50), rng.choice((1, 2, 3, 5, 8)), color)
+
+
+"""
+Функция syntheticSession. Порождает count объектов, похожих на обычный сеанс рисования: в основном короткие мазки
+кисти, а также линии и фигуры с заливкой и без, на холсте размера size. Как и syntheticStrokes, детерминирована при
+одном и том же seed.
+"""
+
+
+def syntheticSession(count, seed=0, size=CANVAS_SIZE):
+    rng = random.Random(seed)
+    width, height = size.width(), size.height()
+    for _ in range(count):
+        x, y = rng.randrange(width), rng.randrange(height)
+        size = rng.choice((1, 2, 3, 5, 8))
+        color = QColor(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        kind = rng.random()
+        if kind < 0.7:
+            stroke = Brush(QPoint(x, y), size, color)
+            for _ in range(SESSION_STROKE_POINTS):
+                x = min(max(x + rng.randint(-8, 8), 0), width - 1)
+                y = min(max(y + rng.randint(-8, 8), 0), height - 1)
+                stroke.points.append(QPoint(x, y))
+            yield stroke
+        elif kind < 0.8:
+            yield Line(x, y, rng.randrange(width), rng.randrange(height), size, color)
+        else:
+            shape = rng.choice(SHAPE_TYPES)
+            fill = QColor(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+            yield shape(x, y, x + rng.randint(-200, 200), y + rng.randint(-200, 200), rng.random() < 0.5, size, color,
+                        fill)
+
+
+"""
+Функция syntheticShapes. Порождает count фигур и линий так, как их рисует человек: выбирает цвета из SHAPE_PALETTE,
+толщину и заливку и рисует ими от одной до SHAPE_RUN фигур подряд, а затем меняет настройки. Как и syntheticStrokes,
+детерминирована при одном и том же seed.
+"""
+
+
+def syntheticShapes(count, seed=0):
+    rng = random.Random(seed)
+    width, height = CANVAS_SIZE.width(), CANVAS_SIZE.height()
+    while count > 0:
+        color, fill = QColor(rng.choice(SHAPE_PALETTE)), QColor(rng.choice(SHAPE_PALETTE))
+        size, to_fill = rng.choice((1, 2, 3, 5, 8)), rng.random() < 0.5
+        shape = rng.choice(SHAPE_TYPES + (Line,))
+        for _ in range(min(rng.randint(1, SHAPE_RUN), count)):
+            x, y = rng.randrange(width), rng.randrange(height)
+            ex, ey = x + rng.randint(-100, 100), y + rng.randint(-100, 100)
+            if shape is Line:
+                yield Line(x, y, ex, ey, size, color)
+            else:
+                yield shape(x, y, ex, ey, to_fill, size, color, fill)
+            count -= 1
+
+
+"""
+Функция syntheticImage. Рисует картинку размера size из множества разноцветных эллипсов (чтобы сжатие работало
+примерно как на настоящем рисунке, а не на однотонной заливке) и сохраняет ее в path.
+"""
+
+
+def syntheticImage(path, size, seed=0):
+    rng = random.Random(seed)
+    image = QImage(size, QImage.Format_RGB32)
+    image.fill(Qt.white)
+    painter = QPainter(image)
+    for _ in range(2000):
+        painter.setPen(QColor(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        painter.setBrush(QColor(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        painter.drawEllipse(rng.randrange(size.width()), rng.randrange(size.height()), rng.randint(5, 300),
+                            rng.randint(5, 300))
+    painter.end()
+    if not image.save(path):
+        raise OSError(f'Не удалось сохранить {path}')
+
+
+"""
+Функция memory. Возвращает сведения о памяти: сколько байт занимают плитки store (если передан) и пиковый размер
+процесса. Пиковый размер доступен только там, где есть модуль resource (Linux, macOS).
+"""
+
+
+def memory(store=None):
+    result = {}
+    if store is not None:
+        result['tile_bytes'] = store.bytes()
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result['peak_rss_bytes'] = peak if sys.platform == 'darwin' else peak * 1024
+    return result
+
+
+"""
+Функция measured. Вызывает function и возвращает ее результат, время выполнения и на сколько байт после этого выросла
+память процесса (None, если residentBytes ничего не знает).
+"""
+
+
+def measured(function):
+    gc.collect()
+    before = residentBytes()
+    result, elapsed = timed(function)
+    gc.collect()
+    after = residentBytes()
+    return result, elapsed, None if before is None else after - before
+
+
+"""
+Функция frames. Перерисовывает прямоугольник rect холста canvas count раз подряд и возвращает среднее и худшее
+время кадра в миллисекундах. repaint вызывает paintEvent сразу, не дожидаясь цикла событий (но только если окно
+холста уже показано, поэтому перед замерами нужно дать циклу событий обработать показ).
+"""
+
+
+def frames(canvas, rect, count):
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        canvas.repaint(rect)
+        times.append(time.perf_counter() - start)
+    return {'mean_ms': sum(times) / len(times) * 1000, 'max_ms': max(times) * 1000}
+
+
+"""
+Группа замеров paint. Для каждого числа объектов из --objects рисует синтетический сеанс на холсте и замеряет кадры:
+    full - перерисовка всего холста (например, после того как окно развернули)
+    dirty - перерисовка маленького грязного прямоугольника (обычный кадр во время рисования кистью)
+    drag - кадр, в котором тянется еще не законченная фигура
+Кроме кадров записывается, сколько заняло "запекание" объектов в плитки. Время кадра не должно расти вместе с числом
+объектов.
+"""
+
+
+@suite('paint')
+def benchPaint(args):
+    canvas = Canvas()
+    canvas.resize(CANVAS_SIZE)
+    canvas.show()
+    QApplication.processEvents()
+    dirty = QRect(CANVAS_SIZE.width() // 2, CANVAS_SIZE.height() // 2, DIRTY_SIZE, DIRTY_SIZE)
+    results = {'frames': args.frames, 'runs': []}
+    for count in args.objects:
+        objects = list(syntheticSession(count, args.seed))
+        _, bake_time = timed(canvas.load, CANVAS_SIZE, None, objects)
+        run = {'objects': count,
+               'bake_s': bake_time,
+               'full': frames(canvas, canvas.rect(), args.frames),
+               'dirty': frames(canvas, dirty, args.frames)}
+        canvas.current = Rectangle(200, 200, 700, 600, True, 3, QColor(Qt.red), QColor(Qt.blue))
+        run['drag'] = frames(canvas, canvas.current.boundingRect(), args.frames)
+        canvas.current = None
+        run['memory'] = memory(canvas.store)
+        results['runs'].append(run)
+    canvas.close()
+    return results
+
+
+"""
+Группа замеров save. Рисует синтетический сеанс и сохраняет холст фоновой задачей SaveTask (здесь она выполняется
+прямо в текущем потоке) в каждом формате с разными настройками кодирования из SAVE_VARIANTS: время сборки картинки из
+плиток, полное время сохранения и размер файла.
+"""
+
+
+@suite('save')
+def benchSave(args):
+    count = max(args.objects)
+    store = renderDocument(CANVAS_SIZE, list(syntheticSession(count, args.seed)))
+    results = {'objects': count}
+    with tempfile.TemporaryDirectory() as folder:
+        for fmt, options in SAVE_VARIANTS:
+            path = os.path.join(folder, 'canvas.' + fmt)
+            name = '_'.join([fmt] + [f'{key}_{value}' for key, value in options.items()])
+            _, compose_time = timed(SaveTask(store, path).compose)
+            _, save_time = timed(SaveTask(store, path, {fmt: options}).run)
+            results[name] = {'compose_s': compose_time, 'save_s': save_time, 'bytes': os.path.getsize(path)}
+    results['memory'] = memory(store)
+    return results
+
+
+"""
+Группа замеров open. Сохраняет большую картинку в каждом формате и открывает ее так же, как Window.openFile (объект
+Image на чистом холсте): cold - с пустым кэшем картинок (чтение и раскодирование файла), warm - повторное открытие,
+когда картинка уже в кэше. Затем картинка читается по частям, как в Window.openFile (LoadTask выполняется прямо в
+этом потоке, поэтому сигналы приходят сразу): preview_ms - когда готова уменьшенная копия, first_tiles_ms - когда
+готовы первые плитки в полном размере, progressive_s - сколько заняло все чтение.
+"""
+
+
+@suite('open')
+def benchOpen(args):
+    results = {'width': IMAGE_SIZE.width(), 'height': IMAGE_SIZE.height()}
+    canvas = Canvas()
+    with tempfile.TemporaryDirectory() as folder:
+        for fmt in IMAGE_FORMATS:
+            path = os.path.join(folder, 'image.' + fmt)
+            syntheticImage(path, IMAGE_SIZE, args.seed)
+
+            def openImage():
+                canvas.clear()
+                canvas.store.resize(IMAGE_SIZE)
+                canvas.addObject(Image(path))
+
+            IMAGE_CACHE.clear()
+            _, cold_time = timed(openImage)
+            _, warm_time = timed(openImage)
+            results[fmt] = {'cold_s': cold_time, 'warm_s': warm_time, 'bytes': os.path.getsize(path)}
+
+            task = LoadTask(path, IMAGE_SIZE, QRect(QPoint(0, 0), CANVAS_SIZE), Qt.white)
+            marks = {}
+            start = time.perf_counter()
+            task.signals.preview.connect(lambda image: marks.setdefault('preview_ms', time.perf_counter() - start))
+            task.signals.tiles.connect(lambda tiles: marks.setdefault('first_tiles_ms', time.perf_counter() - start))
+            _, load_time = timed(task.run)
+            results[fmt].update({name: mark * 1000 for name, mark in marks.items()}, progressive_s=load_time)
+        results['memory'] = memory(canvas.store)
+    IMAGE_CACHE.clear()
+    return results
+
+
+"""
+Группа замеров zoom. Заполняет холст размера ZOOM_SIZE плитками большой картинки (повторяя одну и ту же картинку, чтобы
+не раскодировать гигантский файл) и для каждого масштаба из ZOOM_LEVELS замеряет кадр всего виджета: cold - первый
+кадр, когда уровень пирамиды еще строится, warm - следующие кадры, direct - кадр, нарисованный прямо из плиток
+хранилища с уменьшением, без пирамиды (так рисовал бы холст без нее).
+"""
+
+
+@suite('zoom')
+def benchZoom(args):
+    canvas = Canvas()
+    canvas.resize(CANVAS_SIZE)
+    canvas.show()
+    QApplication.processEvents()
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'image.bmp')
+        syntheticImage(path, IMAGE_SIZE, args.seed)
+        image = IMAGE_CACHE.get(path)
+    store = TileStore(ZOOM_SIZE.width(), ZOOM_SIZE.height())
+    columns, rows = -(-IMAGE_SIZE.width() // TILE_SIZE), -(-IMAGE_SIZE.height() // TILE_SIZE)
+    for tx, ty in store.keys(store.rect()):
+        store.tiles[(tx, ty)] = image.copy(tx % columns * TILE_SIZE, ty % rows * TILE_SIZE, TILE_SIZE, TILE_SIZE)
+    canvas.store = store
+    results = {'width': ZOOM_SIZE.width(), 'height': ZOOM_SIZE.height(), 'frames': args.frames, 'runs': []}
+    target = QImage(CANVAS_SIZE, QImage.Format_RGB32)
+    for zoom in ZOOM_LEVELS:
+        canvas.setZoom(zoom)
+        canvas.origin = QPointF(0, 0)
+        canvas.pyramid = TilePyramid()
+        cold = frames(canvas, canvas.rect(), 1)['max_ms']
+        run = {'zoom': zoom, 'level': TilePyramid.level(zoom), 'cold_ms': cold,
+               'warm': frames(canvas, canvas.rect(), args.frames)}
+
+        def direct():
+            painter = QPainter(target)
+            painter.setRenderHint(QPainter.SmoothPixmapTransform)
+            painter.scale(zoom, zoom)
+            store.blit(painter, QRect(0, 0, round(CANVAS_SIZE.width() / zoom), round(CANVAS_SIZE.height() / zoom)))
+            painter.end()
+
+        _, run['direct_ms'] = timed(direct)
+        run['direct_ms'] *= 1000
+        results['runs'].append(run)
+    results['memory'] = memory(store)
+    canvas.close()
+    IMAGE_CACHE.clear()
+    return results
+
+
+"""
+Группа замеров input. Ведет кистью по холсту случайной ломаной с мелким шагом: INPUT_EVENTS движений мыши приходят с
+частотой INPUT_RATE (как от игровой мыши или планшета), между ними отрабатывает цикл событий. В режиме coalesced
+движения собираются в кадры таймером холста, в режиме immediate каждое движение сразу рисуется (так холст работал
+раньше). Записывается, сколько раз мазок "запекался" в плитки, сколько точек в нем оказалось и сколько процессорного
+времени ушло (между движениями процесс спит, поэтому это время самой работы).
+"""
+
+
+@suite('input')
+def benchInput(args):
+    canvas = Canvas()
+    canvas.resize(CANVAS_SIZE)
+    canvas.show()
+    QApplication.processEvents()
+    results = {'rate': INPUT_RATE, 'events': INPUT_EVENTS}
+    rng = random.Random(args.seed)
+    path = [QPointF(CANVAS_SIZE.width() / 2, CANVAS_SIZE.height() / 2)]
+    for _ in range(INPUT_EVENTS - 1):
+        x = min(max(path[-1].x() + rng.uniform(-3, 3), 0), CANVAS_SIZE.width() - 1)
+        y = min(max(path[-1].y() + rng.uniform(-3, 3), 0), CANVAS_SIZE.height() - 1)
+        path.append(QPointF(x, y))
+    for mode in ('coalesced', 'immediate'):
+        canvas.load(CANVAS_SIZE, None, [])
+        canvas.setSimplify(0)
+        bakes = []
+        paint = canvas.store.paint
+        canvas.store.paint = lambda rect, draw: (bakes.append(rect), paint(rect, draw))
+        QTest.mousePress(canvas, Qt.LeftButton, Qt.NoModifier, path[0].toPoint())
+        start, cpu = time.perf_counter(), time.process_time()
+        for index, point in enumerate(path):
+            time.sleep(max(0.0, start + index / INPUT_RATE - time.perf_counter()))
+            QApplication.processEvents()
+            QApplication.sendEvent(canvas, QMouseEvent(QEvent.MouseMove, point, Qt.LeftButton, Qt.LeftButton,
+                                                       Qt.NoModifier))
+            if mode == 'immediate':
+                canvas.flushInput()
+        QTest.mouseRelease(canvas, Qt.LeftButton, Qt.NoModifier, path[-1].toPoint())
+        cpu, elapsed = time.process_time() - cpu, time.perf_counter() - start
+        results[mode] = {'bakes': len(bakes) - 1, 'bakes_per_s': (len(bakes) - 1) / elapsed,
+                         'points': canvas.objects[-1].points.size(), 'cpu_s': cpu, 'elapsed_s': elapsed}
+        del canvas.store.paint
+    canvas.close()
+    return results
+
+
+"""
+Функция scanObjectAt. Ищет верхнюю фигуру под точкой point перебором всех объектов холста сверху вниз, как пришлось
+бы без сетки SpatialIndex. Нужна только для сравнения с Canvas.objectAt в замере index.
+"""
+
+
+def scanObjectAt(canvas, point):
+    for index in reversed(range(len(canvas.objects))):
+        obj = canvas.objects[index]
+        if hasattr(obj, 'contains') and obj.boundingRect().contains(point) and obj.contains(point):
+            return index
+    return None
+
+
+"""
+Группа замеров index. Для каждого числа объектов из --objects рисует синтетический сеанс на холсте (как пользователь,
+с историей отмены и без "сплющивания") и записывает:
+    hit - время поиска фигуры под HIT_POINTS случайными точками по сетке (Canvas.objectAt) и перебором (scanObjectAt) и
+    совпали ли ответы
+    undo - среднее время --frames отмен подряд, когда перерисовывается только область отмененного объекта, и среднее
+    время перерисовки всего холста из истории (History.render) в тех же состояниях
+"""
+
+
+@suite('index')
+def benchIndex(args):
+    results = {'points': HIT_POINTS, 'runs': []}
+    rng = random.Random(args.seed)
+    for count in args.objects:
+        canvas = Canvas()
+        canvas.resize(CANVAS_SIZE)
+        canvas.load(CANVAS_SIZE, None, [])
+        canvas.history.reset(canvas.store)
+        canvas.compact_limit = count + 1
+        for obj in syntheticSession(count, args.seed):
+            canvas.addObject(obj)
+        points = [QPoint(rng.randrange(CANVAS_SIZE.width()), rng.randrange(CANVAS_SIZE.height()))
+                  for _ in range(HIT_POINTS)]
+        found, index_time = timed(lambda: [canvas.objectAt(point) for point in points])
+        scanned, scan_time = timed(lambda: [scanObjectAt(canvas, point) for point in points])
+        undo_time = render_time = 0.0
+        undos = min(args.frames, count)
+        for _ in range(undos):
+            undo_time += timed(canvas.undo)[1]
+            render_time += timed(canvas.history.render, CANVAS_SIZE)[1]
+        results['runs'].append({'objects': count,
+                                'hit': {'index_us': index_time / HIT_POINTS * 1e6,
+                                        'scan_us': scan_time / HIT_POINTS * 1e6, 'match': found == scanned},
+                                'undo': {'region_ms': undo_time / undos * 1000,
+                                         'full_ms': render_time / undos * 1000}})
+        canvas.close()
+    return results
+
+
+"""
+Функции legacyPress, legacyMove и legacyRelease. Прежняя передача событий мыши холсту (до реестра TOOLS): на каждое
+нажатие имя инструмента сравнивается со строками по очереди, а активный цвет выбирается заново. Нужны только для
+сравнения в замере tools.
+"""
+
+
+def legacyPress(canvas, point):
+    if canvas.default_color == 'color_1':
+        color, color_2 = canvas.pen_color, canvas.brush_color
+    else:
+        color, color_2 = canvas.brush_color, canvas.pen_color
+    x, y = point.x(), point.y()
+    if canvas.instrument == 'brush':
+        canvas.startStroke(Brush(point, canvas.lineSize, color))
+    elif canvas.instrument == 'pencil':
+        canvas.startStroke(Pencil(point, color))
+    elif canvas.instrument == 'eraser':
+        canvas.startStroke(Eraser(point, canvas.lineSize))
+    elif canvas.instrument == 'fill':
+        canvas.addObject(Fill(canvas.store.width, canvas.store.height, color))
+    elif canvas.instrument == 'bucket':
+        canvas.addObject(Bucket(x, y, color, canvas.tolerance))
+    elif canvas.instrument == 'line':
+        canvas.startObject(Line(x, y, x, y, canvas.lineSize, color))
+    elif canvas.instrument == 'circle':
+        canvas.startObject(Circle(x, y, x, y, canvas.fill, canvas.lineSize, color, color_2))
+    elif canvas.instrument == 'rectangle':
+        canvas.startObject(Rectangle(x, y, x, y, canvas.fill, canvas.lineSize, color, color_2))
+    elif canvas.instrument == 'triangle':
+        canvas.startObject(Triangle(x, y, x, y, canvas.fill, canvas.lineSize, color, color_2))
+    elif canvas.instrument == '5gon':
+        canvas.startObject(Pentagon(x, y, x, y, canvas.fill, canvas.lineSize, color, color_2))
+    elif canvas.instrument == '6gon':
+        canvas.startObject(Hexagon(x, y, x, y, canvas.fill, canvas.lineSize, color, color_2))
+    elif canvas.instrument == '8gon':
+        canvas.startObject(Octagon(x, y, x, y, canvas.fill, canvas.lineSize, color, color_2))
+
+
+def legacyMove(canvas, points):
+    if canvas.instrument in ('brush', 'pencil', 'eraser'):
+        canvas.extendStroke(points)
+    elif canvas.current is not None:
+        canvas.stretchObject(points[-1])
+
+
+def legacyRelease(canvas):
+    if canvas.current is not None:
+        canvas.endObject()
+    if canvas.stroke is not None:
+        canvas.endStroke()
+
+
+"""
+Группа замеров tools. Для каждого инструмента из TOOLS передает TOOL_EVENTS раз нажатие, движение и отпускание мыши
+через реестр (как это делает холст) и через прежнюю цепочку сравнений (legacyPress, legacyMove, legacyRelease).
+Методы холста, которые рисуют и записывают историю, подменены пустыми, поэтому в замер попадают только выбор
+инструмента и цвета и создание объекта. Записывается время на одно событие в наносекундах.
+"""
+
+
+@suite('tools')
+def benchTools(args):
+    canvas = Canvas()
+    canvas.resize(CANVAS_SIZE)
+    canvas.load(CANVAS_SIZE, None, [])
+    for name in ('startStroke', 'startObject', 'addObject'):
+        setattr(canvas, name, lambda obj: setattr(canvas, 'current', obj))
+    for name in ('extendStroke', 'stretchObject'):
+        setattr(canvas, name, lambda points: None)
+    for name in ('endStroke', 'endObject'):
+        setattr(canvas, name, lambda: setattr(canvas, 'current', None))
+    point = QPoint(CANVAS_SIZE.width() // 2, CANVAS_SIZE.height() // 2)
+    points = [point]
+
+    def registry():
+        for _ in range(TOOL_EVENTS):
+            tool = canvas.tool
+            tool.press(point)
+            tool.move(points)
+            tool.release()
+
+    def legacy():
+        for _ in range(TOOL_EVENTS):
+            legacyPress(canvas, point)
+            legacyMove(canvas, points)
+            legacyRelease(canvas)
+
+    results = {'events': TOOL_EVENTS * 3}
+    for name in TOOLS:
+        canvas.setTool(name)
+        result = {}
+        for mode, function in (('registry', registry), ('legacy', legacy)):
+            elapsed = min(timed(function)[1] for _ in range(BUCKET_REPEATS))
+            result[mode + '_ns_per_event'] = elapsed * 1e9 / (TOOL_EVENTS * 3)
+        results[name] = result
+    canvas.close()
+    return results
+
+
+"""
+Группа замеров objects. Для линий из двух точек (syntheticLines) и длинных мазков (syntheticStrokes) на --segments
+отрезков строит и хранилище PrimitiveStore, и обычный список объектов, как раньше хранили холст и история отмены.
+Все построенное держится до конца замера, чтобы следующая структура не заняла память, освобожденную предыдущей.
+Записывается рост памяти процесса на отрезок для обоих способов, размер массивов хранилища на отрезок, время
+построения и время перебора хранилища (каждый объект при этом собирается из массивов заново).
+"""
+
+
+@suite('objects')
+def benchObjects(args):
+    results = {'segments': args.segments}
+    kept = []
+    for name, generate in (('lines', syntheticLines), ('strokes', syntheticStrokes)):
+        store, store_time, store_bytes = measured(lambda: PrimitiveStore(generate(args.segments, args.seed)))
+        objects, list_time, list_bytes = measured(lambda: list(generate(args.segments, args.seed)))
+        count, iterate_time = timed(lambda: sum(1 for _ in store))
+        result = {'objects': count, 'store_columns_per_segment': store.bytes() / args.segments,
+                  'store_build_s': store_time, 'store_iterate_s': iterate_time, 'list_build_s': list_time}
+        if store_bytes is not None:
+            result['store_bytes_per_segment'] = store_bytes / args.segments
+            result['list_bytes_per_segment'] = list_bytes / args.segments
+        results[name] = result
+        kept += [store, objects]
+    results['memory'] = memory()
+    return results
+
+
+"""
+Группа замеров shapes. Для каждого числа объектов из --objects "запекает" рисунок syntheticShapes в плитки двумя
+способами: по одному объекту через TileStore.commit (так рисунок повторялся раньше) и группами через
+TileStore.commitAll. Записывается время обоих способов, сколько получилось групп с общими ручкой и кистью, совпали
+ли картинки и сколько пар ручки и кисти лежит в пуле STYLE_POOL.
+"""
+
+
+@suite('shapes')
+def benchShapes(args):
+    results = {}
+    for count in args.objects:
+        objects = list(syntheticShapes(count, args.seed))
+        single = TileStore(CANVAS_SIZE.width(), CANVAS_SIZE.height())
+        _, single_time = timed(lambda: [single.commit(obj) for obj in objects])
+        grouped = TileStore(CANVAS_SIZE.width(), CANVAS_SIZE.height())
+        _, grouped_time = timed(grouped.commitAll, objects)
+        groups = sum(1 for index, obj in enumerate(objects)
+                     if index == 0 or obj.style() is not objects[index - 1].style())
+        results[str(count)] = {'single_s': single_time, 'grouped_s': grouped_time, 'groups': groups,
+                               'identical': single.toImage() == grouped.toImage()}
+    results['styles'] = len(STYLE_POOL.styles)
+    results['memory'] = memory()
+    return results
+
+
+"""
+Группа замеров strokes. Берет мазки mouseStrokes на --segments отрезков и обрабатывает их так же, как холст
+обрабатывает законченный мазок (Stroke.simplify): с каждым допуском из STROKE_TOLERANCES, а с первым из них - еще и
+со сглаживанием. Для каждого варианта записывается, сколько точек осталось, сколько заняла обработка, размер
+документа в родном формате и время отрисовки документа. Вариант raw - мазки без обработки.
+"""
+
+
+@suite('strokes')
+def benchStrokes(args):
+    results = {'segments': args.segments}
+    variants = [('raw', None, False)]
+    variants += [(f'tolerance_{tolerance:g}', tolerance, False) for tolerance in STROKE_TOLERANCES]
+    variants.append((f'tolerance_{STROKE_TOLERANCES[0]:g}_smooth', STROKE_TOLERANCES[0], True))
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'document.qtp')
+        for name, tolerance, smooth in variants:
+            objects = list(mouseStrokes(args.segments, args.seed))
+            result = {}
+            if tolerance is not None:
+                result['removed'], result['simplify_s'] = timed(lambda: sum(stroke.simplify(tolerance, smooth)
+                                                                            for stroke in objects))
+            result['points'] = sum(stroke.points.size() for stroke in objects)
+            writeDocument(path, CANVAS_SIZE, objects)
+            result['bytes'] = os.path.getsize(path)
+            _, result['render_s'] = timed(renderDocument, CANVAS_SIZE, objects)
+            results[name] = result
+    results['memory'] = memory()
+    return results
+
+
+"""
+Группа замеров document. Сравнивает родной формат документа (со сжатием и без) с JSON на одном и том же рисунке:
+время записи, время чтения и размер файла. Родной формат читается потоком, объекты только пересчитываются, как это
+делает пакетная отрисовка.
+"""
+
+
+@suite('document')
+def benchDocument(args):
+    objects = list(syntheticStrokes(args.segments, args.seed))
+    results = {'segments': args.segments, 'objects': len(objects)}
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'document.json')
+
+        def saveJson():
+            with open(path, mode='w', encoding='utf-8') as file:
+                json.dump(dumpDocument(CANVAS_SIZE, objects), file)
+
+        def loadJson():
+            with open(path, mode='r', encoding='utf-8') as file:
+                return len(loadDocument(json.load(file))[1])
+
+        _, save_time = timed(saveJson)
+        count, load_time = timed(loadJson)
+        results['json'] = {'save_s': save_time, 'load_s': load_time, 'bytes': os.path.getsize(path),
+                           'objects_loaded': count}
+
+        for name, compress in (('native', False), ('native_zlib', True)):
+            path = os.path.join(folder, name + '.qtp')
+
+            def loadNative():
+                with open(path, mode='rb') as file:
+                    return sum(1 for _ in DocumentReader(file))
+
+            _, save_time = timed(writeDocument, path, CANVAS_SIZE, objects, None, compress)
+            count, load_time = timed(loadNative)
+            results[name] = {'save_s': save_time, 'load_s': load_time, 'bytes': os.path.getsize(path),
+                             'objects_loaded': count}
+    results['memory'] = memory()
+    return results
+
+
+"""
+Группа замеров journal. Для каждого числа объектов из --objects ведет журнал автосохранения во временной папке:
+снимок пустого холста, затем синтетический сеанс рисования по одному объекту, как их заканчивает холст. Записывается
+время на объект в основном потоке, время, за которое фоновый поток дописывает очередь после последнего объекта (с
+ожиданием пачки до JOURNAL_DELAY секунд), число вызовов fsync, размер журнала и время его чтения при восстановлении.
+"""
+
+
+@suite('journal')
+def benchJournal(args):
+    results = {'runs': []}
+    for count in args.objects:
+        objects = list(syntheticSession(count, args.seed))
+        with tempfile.TemporaryDirectory() as folder:
+            journal = Journal(folder)
+            journal.rollover(CANVAS_SIZE, None, [], 0)
+            _, append_time = timed(lambda: [journal.append(obj, CANVAS_SIZE) for obj in objects])
+            _, close_time = timed(journal.close, False)
+            size = os.path.getsize(journal.path('journal', journal.generation))
+            recovered, read_time = timed(journal.read)
+            results['runs'].append({'objects': count,
+                                    'append_us': append_time / count * 1e6,
+                                    'drain_s': close_time,
+                                    'syncs': journal.syncs,
+                                    'journal_bytes': size,
+                                    'read_s': read_time,
+                                    'entries': len(recovered[3])})
+    return results
+
+
+"""
+Группа замеров profiler. Для каждого числа объектов из --objects повторяет синтетический сеанс рисования в плитки
+(TileStore.commitAll) и перерисовывает весь холст --frames раз в трех режимах профилировщика:
+    off - выключен, замеры стоят одну проверку
+    on - включен, замеры копятся (так работает панель показателей)
+    trace - идет запись трассировки, каждый замер еще и запоминается
+Для записи трассировки также записывается, сколько событий набралось и сколько длится их сохранение в JSON.
+"""
+
+
+@suite('profiler')
+def benchProfiler(args):
+    canvas = Canvas()
+    canvas.resize(CANVAS_SIZE)
+    canvas.show()
+    QApplication.processEvents()
+    results = {'frames': args.frames, 'runs': []}
+    for count in args.objects:
+        objects = list(syntheticSession(count, args.seed))
+        canvas.load(CANVAS_SIZE, None, objects)
+        run = {'objects': count}
+        for mode in ('off', 'on', 'trace'):
+            if mode == 'trace':
+                PROFILER.startTrace()
+            else:
+                PROFILER.setEnabled(mode == 'on')
+            store = TileStore(CANVAS_SIZE.width(), CANVAS_SIZE.height())
+            _, commit_time = timed(store.commitAll, objects)
+            run[mode] = {'commit_s': commit_time, 'full': frames(canvas, canvas.rect(), args.frames)}
+        PROFILER.stopTrace()
+        PROFILER.setEnabled(False)
+        run['trace_events'] = len(PROFILER.events)
+        with tempfile.TemporaryDirectory() as folder:
+            _, run['trace_dump_s'] = timed(PROFILER.dump, os.path.join(folder, 'trace.json'))
+        results['runs'].append(run)
+    canvas.close()
+    return results
+
+
+"""
+Функция buildWindow. Создает пустое главное окно, строит в нем интерфейс функцией function и возвращает, сколько это
+заняло. Окно после замера удаляется.
+"""
+
+
+def buildWindow(function):
+    window = QMainWindow()
+    _, elapsed = timed(function, window)
+    window.deleteLater()
+    return elapsed
+
+
+"""
+Функция iconFiles. Возвращает пути к файлам иконок, на которые ссылается window.ui, без повторов.
+"""
+
+
+def iconFiles():
+    folder = os.path.dirname(dir_ui)
+    names = {node.text for node in ElementTree.parse(dir_ui).iter('normaloff') if node.text}
+    return sorted(os.path.join(folder, name) for name in names)
+
+
+"""
+Группа замеров startup. Строит главное окно приложения без холста и сигналов - только интерфейс из window.ui
+(uic.loadUi), и отдельно читает иконки интерфейса:
+    first_ms - первое построение окна
+    loadui_ms - лучшее время из STARTUP_REPEATS следующих построений
+    icons_ms - сколько длится чтение всех иконок (в QImage, чтобы не мешал кэш QPixmap)
+    largest_icon - сторона самой большой иконки в пикселях
+Иконки показываются размером 24-32 пикселя, но uic.loadUi читает каждый файл целиком, поэтому слишком большие файлы
+иконок сразу видны в icons_ms и first_ms.
+"""
+
+
+@suite('startup')
+def benchStartup(args):
+    first = buildWindow(lambda window: uic.loadUi(dir_ui, window))
+    loadui = [buildWindow(lambda window: uic.loadUi(dir_ui, window)) for _ in range(STARTUP_REPEATS)]
+    QApplication.processEvents()
+    icons, icons_time = timed(lambda: [QImage(path) for path in iconFiles()])
+    return {'first_ms': first * 1000,
+            'loadui_ms': min(loadui) * 1000,
+            'icons': len(icons),
+            'icons_ms': icons_time * 1000,
+            'largest_icon': max(max(icon.width(), icon.height()) for icon in icons)}
+
+
+"""
+Группа замеров bucket. Заливает область от левого верхнего угла холста размера BUCKET_SIZE: сначала чистого, затем
+изрисованного синтетическим сеансом из min(--objects) объектов (фон там изрезан мазками на множество отрезков). Каждая
+заливка делается на копии плиток, поэтому, как и в приложении, плитки отделяются от копии при записи. Записывается
+лучшее время из BUCKET_REPEATS попыток.
+"""
+
+
+@suite('bucket')
+def benchBucket(args):
+    count = min(args.objects)
+    results = {'width': BUCKET_SIZE.width(), 'height': BUCKET_SIZE.height(), 'objects': count}
+    busy = renderDocument(BUCKET_SIZE, list(syntheticSession(count, args.seed, BUCKET_SIZE)))
+    for name, store in (('blank', renderDocument(BUCKET_SIZE, [])), ('busy', busy)):
+        for tolerance in BUCKET_TOLERANCES:
+            best = None
+            for _ in range(BUCKET_REPEATS):
+                bucket = Bucket(0, 0, QColor(Qt.green), tolerance)
+                _, fill_time = timed(store.copy().commit, bucket)
+                best = fill_time if best is None else min(best, fill_time)
+            filled = bucket.rect.width() * bucket.rect.height()
+            results[f'{name}_tolerance_{tolerance}'] = {'fill_ms': best * 1000, 'bounding_megapixels': filled / 1e6}
+    results['memory'] = memory(busy)
+    return results
+
+
+"""
+Группа замеров filters. Накладывает каждый фильтр с параметрами по умолчанию на холст размера FILTER_SIZE, изрисованный
+синтетическим сеансом, и записывает лучшее из BUCKET_REPEATS время, скорость в мегапикселях в секунду и время
+предпросмотра на уменьшенном холсте (как в окне фильтров). Фильтры накладываются на копию плиток, как и в приложении.
+"""
+
+
+@suite('filters')
+def benchFilters(args):
+    store = renderDocument(FILTER_SIZE, list(syntheticSession(min(args.objects), args.seed, FILTER_SIZE)))
+    megapixels = FILTER_SIZE.width() * FILTER_SIZE.height() / 1e6
+    scale = max(1, -(-max(FILTER_SIZE.width(), FILTER_SIZE.height()) // FILTER_PREVIEW))
+    small = samplePixels(store, scale)
+    results = {'width': FILTER_SIZE.width(), 'height': FILTER_SIZE.height(), 'threads': FILTER_THREADS}
+    for kind in FILTER_KINDS:
+        params = [0 if param is None else param[3] for param in FILTER_TYPES[kind][2:]]
+        best = min(timed(store.copy().commit, Filter(kind, *params))[1] for _ in range(BUCKET_REPEATS))
+        _, preview_time = timed(Filter(kind, *params).preview, small, scale)
+        results[kind] = {'apply_ms': best * 1000, 'megapixels_per_s': megapixels / best,
+                         'preview_ms': preview_time * 1000}
+    results['memory'] = memory(store)
+    return results
+
+
+"""
+Функция main. Разбирает аргументы, запускает выбранные группы замеров и выводит результаты в JSON вместе со
+сведениями о среде (версии Python, Qt и PyQt, платформа Qt), чтобы прогоны на разных машинах можно было отличить.
+"""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Замеры производительности Qt Paint.')
+    parser.add_argument('--suite', action='append', choices=sorted(SUITES), help='группа замеров (можно несколько)')
+    parser.add_argument('--segments', type=int, default=1000000, help='число отрезков в синтетическом рисунке')
+    parser.add_argument('--objects', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='числа объектов в синтетических сеансах рисования')
+    parser.add_argument('--frames', type=int, default=50, help='сколько кадров перерисовывать в каждом замере')
+    parser.add_argument('--seed', type=int, default=0, help='зерно генератора синтетических рисунков')
+    parser.add_argument('-o', '--output', help='файл для результатов (по умолчанию - вывод в консоль)')
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication(['qtpaint-benchmark'])
+    report = {'python': platform.python_version(),
+              'qt': QT_VERSION_STR,
+              'pyqt': PYQT_VERSION_STR,
+              'platform': platform.platform(),
+              'qpa': app.platformName(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'suites': {}}
+    for name in args.suite or sorted(SUITES):
+        report['suites'][name] = SUITES[name](args)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, mode='w', encoding='utf-8') as file:
+            file.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,11 +5,33 @@ QtPaint, 2020-2022. Made by Pavel Savin A.K.A. "pashkev14".
 Сейчас эта библиотека неактуальна: Qt предоставляет для Python 2 решения - платный для коммерческих/закрытых проектов
 PyQt6 и бесплатный для любого типа проектов PySide6. Этот проект сделан в некоммерческих целях, поэтому вопрос его
 лицензии был предрешен еще в зачатке идеи. Библиотека sys открывает доступ к возможностям системы, здесь ее
-функционал сведен до открытия приложения в потоке и работы с файлами.
+функционал сведен до открытия приложения в потоке и работы с файлами. Из collections берется OrderedDict - словарь,
+помнящий порядок, на нем построен кэш картинок. Из array - компактный массив чисел для координат мазков. struct и
+zlib нужны для упаковки и сжатия родного формата документа, mmap - для чтения несжатых BMP прямо из файла, time -
+для замера частоты движений мыши и кадров. threading и queue нужны фоновому потоку, который пишет журнал
+автосохранения, а uuid дает имя папке журнала каждого сеанса. json и contextmanager нужны профилировщику:
+первый - чтобы сохранить трассировку, второй - для замеров блоком with, а deque хранит последние события трассировки.
+ctypes нужна, чтобы спросить у Windows, сколько памяти занимает процесс.
 """
 
 import sys
 import os
+import ctypes
+import json
+import mmap
+import queue
+import struct
+import threading
+import time
+import uuid
+import zlib
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
 
 from PyQt5 import uic
 from PyQt5.QtGui import *
@@ -19,9 +41,45 @@ from PyQt5.QtCore import *
 """
 Константы:
     MAINSIZE_KEYS - набор толщин объектов в приложении
-    HELP_TEXT - текст раздела "Помощь". Открывает файл help.txt в папке приложения src и считывает все строки с него
-    INFO_TEXT - текст раздела "О программе". Открывает файл about.txt в папке приложения src и считывает все строки
-    с него
+    TEXTS - прочитанные тексты разделов "Помощь" (help.txt) и "О программе" (about.txt). Файлы читаются при первом
+    открытии раздела, а не при запуске (см. функцию readText)
+    STARTUP_TIME - момент, когда модуль начал выполняться (уже после импорта библиотек). От него режим
+    --profile-startup отсчитывает фазы запуска (см. класс StartupProfile). Сколько занимает сам импорт numpy и PyQt5,
+    покажет python -X importtime main.py
+    STARTUP_PROFILE - замер запуска, если приложение запущено с ключом --profile-startup, иначе None
+    IMAGE_CACHE_BUDGET - сколько байт памяти могут занимать раскодированные картинки в кэше ImageCache
+    COMPACT_LIMIT - сколько объектов может накопиться в списке холста, прежде чем старые будут "сплющены" в картинку
+    TILE_SIZE - сторона квадратной плитки, из которых состоит картинка холста (см. класс TileStore)
+    CHECKPOINT_INTERVAL - через сколько действий история отмены делает новую контрольную точку (см. класс History)
+    HISTORY_BUDGET - сколько байт памяти могут занимать контрольные точки истории отмены
+    BUCKET_TOLERANCE - допуск заливки области по умолчанию: насколько (0-255 по каждому каналу) цвет пикселя может
+    отличаться от цвета под курсором, чтобы пиксель тоже залился (см. класс Bucket)
+    FILTER_THREADS - сколько потоков обрабатывают полосы картинки при наложении фильтров (см. функцию filterBands)
+    FILTER_BAND - наименьшая высота полосы, на которые режется картинка для фильтров
+    FILTER_PREVIEW - наибольшая сторона уменьшенной картинки для предпросмотра фильтра
+    LOAD_PREVIEW - наибольшая сторона уменьшенной картинки, которая показывается, пока открываемая картинка читается
+    в полном размере (см. класс LoadTask)
+    LOAD_PARTIAL_FORMATS - форматы, которые Qt действительно умеет читать уменьшенными или по частям, не раскодируя
+    картинку целиком (у JPG это делает сам libjpeg). Остальные форматы ради этого все равно читаются полностью, и
+    отдельное чтение только удвоило бы работу
+    ZOOM_MIN, ZOOM_MAX - наименьший и наибольший масштаб просмотра холста
+    ZOOM_STEP - во сколько раз меняется масштаб за один шаг колесика мыши или команды "Приблизить"/"Отдалить"
+    STROKE_TOLERANCE - допуск упрощения мазков по умолчанию в пикселях: точки мазка выбрасываются, если ломаная без них
+    отходит от исходной не дальше допуска (0 - не упрощать, см. функцию simplifyPoints)
+    SMOOTH_STEP - длина отрезков в пикселях, на которые режется кривая при сглаживании мазка (см. функцию smoothPoints)
+    STYLE_POOL_SIZE - сколько разных сочетаний ручки и кисти хранит пул STYLE_POOL (см. класс StylePool)
+    PRIMITIVE_VIEWS - сколько собранных объектов держит наготове каждое хранилище PrimitiveStore (см. метод build)
+    FRAME_RATE - частота кадров, с которой холст разбирает накопленные движения мыши, если частоту обновления экрана
+    узнать не удалось (см. метод Canvas.flushInput)
+    JOURNAL_DIR - папка журналов автосохранения: у каждого запущенного приложения в ней своя папка сеанса (см. класс
+    Journal)
+    JOURNAL_LIMIT - после скольких байт записей журнал начинает новое поколение со свежим снимком холста
+    JOURNAL_DELAY - сколько секунд фоновый поток журнала собирает записи в одну пачку перед записью и fsync
+    TRACE_LIMIT - сколько событий самое большее хранит запись трассировки (см. класс Profiler). Событие занимает около
+    двухсот байт, так что запись весит не больше пары десятков мегабайт - это несколько минут работы
+    HUD_INTERVAL - раз во сколько миллисекунд обновляется панель показателей производительности холста
+    SAVE_OPTIONS - настройки кодирования картинок по умолчанию: степень сжатия PNG (0 - быстро, но большой файл,
+    9 - медленно, но маленький) и качество JPG (0-100, чем выше, тем лучше картинка и больше файл)
 """
 
 MAINSIZE_KEYS = {'Маленькая': 2,
@@ -32,8 +90,35 @@ dir_help = os.path.join(os.path.dirname(__file__), 'help.txt')
 dir_info = os.path.join(os.path.dirname(__file__), 'about.txt')
 dir_ui = os.path.join(os.path.dirname(__file__), 'window.ui')
 dir_icon = os.path.join(os.path.dirname(__file__), 'window_icon.ico')
-HELP_TEXT = ''.join(open(dir_help, mode='r', encoding='utf-8').readlines())
-INFO_TEXT = ''.join(open(dir_info, mode='r', encoding='utf-8').readlines())
+TEXTS = {}
+STARTUP_TIME = time.perf_counter()
+STARTUP_PROFILE = None
+IMAGE_CACHE_BUDGET = 512 * 1024 * 1024
+COMPACT_LIMIT = 1000
+TILE_SIZE = 256
+CHECKPOINT_INTERVAL = 25
+HISTORY_BUDGET = 256 * 1024 * 1024
+BUCKET_TOLERANCE = 0
+FILTER_THREADS = os.cpu_count() or 1
+FILTER_BAND = 32
+FILTER_PREVIEW = 480
+LOAD_PREVIEW = 1024
+LOAD_PARTIAL_FORMATS = (b'jpeg', b'jpg')
+ZOOM_MIN = 1 / 64
+ZOOM_MAX = 32
+ZOOM_STEP = 1.25
+FRAME_RATE = 60
+STROKE_TOLERANCE = 0.5
+SMOOTH_STEP = 4
+STYLE_POOL_SIZE = 4096
+PRIMITIVE_VIEWS = 1024
+JOURNAL_DIR = os.path.join(os.path.expanduser('~'), '.qtpaint', 'journal')
+JOURNAL_LIMIT = 8 * 1024 * 1024
+JOURNAL_DELAY = 0.5
+TRACE_LIMIT = 100000
+HUD_INTERVAL = 500
+SAVE_OPTIONS = {'png': {'compression': 6},
+                'jpg': {'quality': 90}}
 
 """
 Функция setIcon. Задает иконку диалоговому окну. Функционал выведен в отдельный блок, потому что в приложении
@@ -46,6 +131,706 @@ def setIcon(msgbox):
     msgbox.setWindowIcon(QIcon(dir_icon))
 
 
+"""
+Функция readText. Возвращает текст файла path из папки приложения. Файл читается при первом обращении и запоминается
+в TEXTS: разделы "Помощь" и "О программе" открывают редко, и читать их при каждом запуске незачем.
+"""
+
+
+def readText(path):
+    if path not in TEXTS:
+        with open(path, mode='r', encoding='utf-8') as file:
+            TEXTS[path] = file.read()
+    return TEXTS[path]
+
+
+"""
+Функция strokeRect. Возвращает прямоугольник, в который гарантированно попадает контур, проведенный через точки
+(x1, y1) и (x2, y2) ручкой толщины width. Прямоугольник расширяется на всю толщину ручки, а не на ее половину, потому
+что квадратные концы и скошенные углы на диагоналях выступают дальше половины толщины. Нужна классам-инструментам для
+метода boundingRect.
+"""
+
+
+def strokeRect(x1, y1, x2, y2, width):
+    pad = width + 1
+    return QRect(QPoint(min(x1, x2), min(y1, y2)), QPoint(max(x1, x2), max(y1, y2))).adjusted(-pad, -pad, pad, pad)
+
+
+class ProcessMemoryCounters(ctypes.Structure):
+
+    """
+    Класс ProcessMemoryCounters. Структура PROCESS_MEMORY_COUNTERS из Windows API, которую заполняет функция
+    GetProcessMemoryInfo (см. функцию residentBytes). Нужно из нее только поле WorkingSetSize.
+    """
+
+    _fields_ = [('cb', ctypes.c_ulong),
+                ('PageFaultCount', ctypes.c_ulong),
+                ('PeakWorkingSetSize', ctypes.c_size_t),
+                ('WorkingSetSize', ctypes.c_size_t),
+                ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                ('PagefileUsage', ctypes.c_size_t),
+                ('PeakPagefileUsage', ctypes.c_size_t)]
+
+
+"""
+Функция residentBytes. Возвращает, сколько байт памяти процесса сейчас лежит в оперативной памяти, или None, если
+узнать это нельзя. На Windows это рабочий набор процесса (GetProcessMemoryInfo), на Linux - сведения из /proc.
+"""
+
+
+def residentBytes():
+    if sys.platform == 'win32':
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        try:
+            kernel32, psapi = ctypes.WinDLL('kernel32'), ctypes.WinDLL('psapi')
+            kernel32.GetCurrentProcess.restype = ctypes.c_void_p
+            psapi.GetProcessMemoryInfo.argtypes = [ctypes.c_void_p, ctypes.POINTER(ProcessMemoryCounters),
+                                                   ctypes.c_ulong]
+            if psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+                return counters.WorkingSetSize
+        except (OSError, AttributeError):
+            pass
+        return None
+    try:
+        with open('/proc/self/statm', mode='r') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class Profiler:
+
+    """
+    Класс Profiler, он же Профилировщик. Самодельный служебный класс, который замеряет, на что уходит время: кадры
+    холста, рисование объектов, чтение и сохранение. Замеры расставлены в коде парами start/stop (в частых местах,
+    вроде paintEvent) или блоками span (в редких, вроде сохранения). Пока профилировщик выключен, start возвращает
+    None, и замер ничего не стоит, кроме одной проверки. Включенный профилировщик копит по каждому замеру число
+    вызовов, суммарное и худшее время (их забирает и показывает панель показателей холста, см. Canvas.sampleProfile),
+    а если идет запись трассировки, еще и запоминает каждый вызов по отдельности. Трассировка сохраняется в формате
+    Chrome Trace Event (JSON), который открывают chrome://tracing и Perfetto: там видно каждый кадр и что в нем
+    происходило, в том числе в фоновых потоках сохранения и чтения. Запись ограничена limit событиями, самые старые
+    выбрасываются.
+
+    Параметры при инициализации экземпляра класса Profiler:
+        limit - сколько событий трассировки хранится самое большее
+        enabled - включен ли профилировщик
+        tracing - идет ли запись трассировки
+        timers - накопленные замеры: имя -> [число вызовов, суммарное время, худшее время]
+        ticks - когда в последний раз сработала каждая отметка (метод tick)
+        events - записанные события трассировки: (имя, категория, начало, длительность, поток, аргументы). У
+        счетчиков длительность None, а аргументы - значения счетчиков
+        threads - имена потоков, которые попали в трассировку
+        origin - момент, от которого отсчитывается время в трассировке
+        lock - блокировка замеров и трассировки: замеры приходят и из фоновых потоков сохранения и чтения, а забирает
+        их (collect, dump) поток интерфейса
+    """
+
+    def __init__(self, limit):
+        super(Profiler, self).__init__()
+        self.limit = limit
+        self.enabled = False
+        self.tracing = False
+        self.timers = {}
+        self.ticks = {}
+        self.events = deque(maxlen=limit)
+        self.threads = {}
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+
+    """
+    Методы замеров:
+        start - начинает замер: возвращает текущее время или None, если профилировщик выключен
+        stop - заканчивает замер name, начатый start. category - категория события в трассировке (по ней события
+        можно отфильтровать), args - словарь подробностей, которые попадут в трассировку
+        span - то же, что пара start/stop, для блока with
+        tick - отмечает событие name и записывает время с прошлой такой отметки (так считается время между кадрами)
+        counter - записывает в трассировку значения счетчиков values (словарь имя -> число) под именем name
+        collect - отдает накопленные замеры и начинает копить заново
+    """
+
+    def start(self):
+        return time.perf_counter() if self.enabled else None
+
+    def stop(self, name, start, category='paint', args=None):
+        if start is None:
+            return
+        end = time.perf_counter()
+        self.record(name, end - start)
+        if self.tracing:
+            self.trace(name, category, start, end - start, args)
+
+    @contextmanager
+    def span(self, name, category, args=None):
+        start = self.start()
+        try:
+            yield
+        finally:
+            self.stop(name, start, category, args)
+
+    def tick(self, name):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        last = self.ticks.get(name)
+        self.ticks[name] = now
+        if last is not None:
+            self.record(name, now - last)
+
+    def counter(self, name, values):
+        if self.tracing:
+            self.trace(name, 'counter', time.perf_counter(), None, values)
+
+    def collect(self):
+        with self.lock:
+            timers, self.timers = self.timers, {}
+        return timers
+
+    """
+    Служебные методы:
+        record - добавляет время seconds к замеру name
+        trace - запоминает событие трассировки вместе с потоком, в котором оно случилось
+    """
+
+    def record(self, name, seconds):
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                if seconds > timer[2]:
+                    timer[2] = seconds
+
+    def trace(self, name, category, start, duration, args):
+        thread = threading.get_ident()
+        with self.lock:
+            if thread not in self.threads:
+                main = thread == threading.main_thread().ident
+                self.threads[thread] = 'GUI' if main else threading.current_thread().name
+            self.events.append((name, category, start, duration, thread, args))
+
+    """
+    Методы записи трассировки:
+        setEnabled - включает и выключает замеры. Выключенный профилировщик забывает накопленные замеры
+        startTrace - начинает запись трассировки заново (замеры при этом включаются)
+        stopTrace - останавливает запись, записанные события остаются до следующего startTrace
+        dump - сохраняет записанные события в файл path в формате Chrome Trace Event: законченные замеры - это события
+        "X" с началом и длительностью в микросекундах, счетчики - события "C", а имена потоков - события "M"
+    """
+
+    def setEnabled(self, enabled):
+        self.enabled = enabled or self.tracing
+        if not self.enabled:
+            with self.lock:
+                self.timers.clear()
+            self.ticks.clear()
+
+    def startTrace(self):
+        with self.lock:
+            self.events.clear()
+            self.threads.clear()
+        self.origin = time.perf_counter()
+        self.tracing = True
+        self.enabled = True
+
+    def stopTrace(self):
+        self.tracing = False
+
+    def dump(self, path):
+        pid = os.getpid()
+        with self.lock:
+            threads, recorded = list(self.threads.items()), list(self.events)
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread, 'args': {'name': name}}
+                  for thread, name in threads]
+        for name, category, start, duration, thread, args in recorded:
+            event = {'name': name, 'cat': category, 'ph': 'X' if duration is not None else 'C',
+                     'ts': (start - self.origin) * 1e6, 'pid': pid, 'tid': thread}
+            if duration is not None:
+                event['dur'] = duration * 1e6
+            if args:
+                event['args'] = args
+            events.append(event)
+        with open(path, mode='w', encoding='utf-8') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file, ensure_ascii=False)
+
+
+PROFILER = Profiler(TRACE_LIMIT)
+
+
+class TileStore:
+
+    """
+    Класс TileStore, он же Хранилище плиток. Самодельный служебный класс, в котором хранятся пиксели холста. Вместо
+    одной большой картинки холст разбит на квадратные плитки TILE_SIZE x TILE_SIZE, и плитка создается только тогда,
+    когда на ней впервые что-то рисуют. Нетронутые плитки не занимают памяти и считаются залитыми фоном, поэтому
+    память зависит от закрашенной площади, а не от размера холста - даже холст 20000x20000 почти ничего не стоит, пока
+    на нем ничего не нарисовано. Плитки - обычные QImage, а они в Qt копируются "по требованию" (implicit sharing),
+    так что копия хранилища (метод copy) стоит только словаря, а пиксели дублируются лишь у тех плиток, на которых
+    потом рисуют.
+
+    Параметры при инициализации экземпляра класса TileStore:
+        width - ширина холста
+        height - высота холста
+        background - цвет фона, которым считаются залиты несозданные плитки (по умолчанию - белый)
+        tiles - словарь плиток, ключ - номер плитки по горизонтали и вертикали
+        dirty - номера плиток, измененных с последнего вызова takeDirty
+    """
+
+    def __init__(self, width, height):
+        super(TileStore, self).__init__()
+        self.width = width
+        self.height = height
+        self.background = QColor(Qt.white)
+        self.tiles = {}
+        self.dirty = set()
+
+    """
+    Методы размеров холста:
+        size - размер холста в виде QSize
+        rect - прямоугольник всего холста
+        resize - меняет размер холста. Плитки при этом не трогаются, поэтому нарисованное не пропадает
+        bytes - сколько памяти занимают созданные плитки
+    """
+
+    def size(self):
+        return QSize(self.width, self.height)
+
+    def rect(self):
+        return QRect(0, 0, self.width, self.height)
+
+    def resize(self, size):
+        self.width = size.width()
+        self.height = size.height()
+
+    def bytes(self):
+        return len(self.tiles) * TILE_SIZE * TILE_SIZE * 4
+
+    """
+    Метод keys. Возвращает номера всех плиток, которые пересекает прямоугольник rect (в пределах холста).
+    """
+
+    def keys(self, rect):
+        rect = rect.intersected(self.rect())
+        if rect.isEmpty():
+            return []
+        return [(tx, ty)
+                for ty in range(rect.top() // TILE_SIZE, rect.bottom() // TILE_SIZE + 1)
+                for tx in range(rect.left() // TILE_SIZE, rect.right() // TILE_SIZE + 1)]
+
+    """
+    Метод tile. Возвращает плитку по номеру, при необходимости создавая ее и заливая фоном.
+    """
+
+    def tile(self, key):
+        tile = self.tiles.get(key)
+        if tile is None:
+            tile = self.fillTile(key, self.background)
+        return tile
+
+    """
+    Метод fillTile. Заменяет плитку по номеру новой, залитой цветом color, и возвращает ее. Старая плитка не
+    копируется, даже если ее пиксели делит копия хранилища.
+    """
+
+    def fillTile(self, key, color):
+        tile = QImage(TILE_SIZE, TILE_SIZE, QImage.Format_RGB32)
+        tile.fill(color)
+        self.tiles[key] = tile
+        return tile
+
+    """
+    Метод paint. Рисует на всех плитках, которые пересекает прямоугольник rect, функцией draw (ей передается
+    "рисовальщик", сдвинутый так, чтобы рисовать в координатах холста). Рисование обрезается по краю холста, чтобы
+    ничего не появилось за ним, если холст потом увеличат. Все затронутые плитки помечаются измененными.
+    """
+
+    def paint(self, rect, draw):
+        for key in self.keys(rect):
+            painter = QPainter(self.tile(key))
+            painter.translate(-key[0] * TILE_SIZE, -key[1] * TILE_SIZE)
+            painter.setClipRect(self.rect())
+            draw(painter)
+            painter.end()
+            self.dirty.add(key)
+
+    """
+    Метод commit. "Запекает" объект в плитки. Заливка во весь холст плиток не создает, а просто меняет фон и
+    выбрасывает все плитки. Заливка области и фильтры рисуют не сами по себе, а по пикселям холста, поэтому им
+    передаются сами плитки. Если задан clip, объект рисуется только на плитках, которые задевает clip (так холст
+    перерисовывает область, см. Canvas.replay).
+    """
+
+    def commit(self, obj, clip=None):
+        start = PROFILER.start()
+        if isinstance(obj, Fill) and obj.covers(self.rect()):
+            self.clear(QColor(obj.color))
+        elif isinstance(obj, (Bucket, Filter)):
+            obj.apply(self)
+        else:
+            rect = obj.boundingRect()
+            self.paint(rect if clip is None else rect.intersected(clip), obj.draw)
+        if start is not None:
+            PROFILER.stop(type(obj).__name__ + '.draw', start, 'draw')
+
+    """
+    Метод commitAll. "Запекает" объекты по порядку, как commit, но соседние объекты с одинаковыми ручкой и кистью (см.
+    StylePool) рисуются вместе: на каждую плитку открывается один "рисовальщик", ручка и кисть задаются один раз, а
+    затем по очереди рисуются все объекты группы, которые задевают эту плитку. Порядок объектов не меняется, поэтому
+    результат тот же, что у commit по одному, но при повторе истории и отрисовке документа намного меньше раз
+    создаются "рисовальщики" и меняется их состояние. Объекты могут быть любым итерируемым объектом. clip - как у
+    commit.
+    """
+
+    def commitAll(self, objects, clip=None):
+        group, style = [], None
+        for obj in objects:
+            key = obj.style() if hasattr(obj, 'drawShape') else None
+            if group and key is not style:
+                self.paintGroup(group, style, clip)
+                group = []
+            if key is None:
+                self.commit(obj, clip)
+            else:
+                group.append(obj)
+                style = key
+        if group:
+            self.paintGroup(group, style, clip)
+
+    """
+    Метод paintGroup. Рисует группу объектов с общими ручкой и кистью style (см. метод commitAll).
+    """
+
+    def paintGroup(self, objects, style, clip=None):
+        if len(objects) == 1:
+            self.commit(objects[0], clip)
+            return
+        groups = {}
+        for obj in objects:
+            rect = obj.boundingRect()
+            for key in self.keys(rect if clip is None else rect.intersected(clip)):
+                groups.setdefault(key, []).append(obj)
+        pen, brush = style
+        start = PROFILER.start()
+        for key, group in groups.items():
+            painter = QPainter(self.tile(key))
+            painter.translate(-key[0] * TILE_SIZE, -key[1] * TILE_SIZE)
+            painter.setClipRect(self.rect())
+            painter.setPen(pen)
+            painter.setBrush(brush)
+            for obj in group:
+                obj.drawShape(painter)
+            painter.end()
+            self.dirty.add(key)
+        PROFILER.stop('paintGroup', start, 'draw', {'objects': len(objects), 'tiles': len(groups)})
+
+    """
+    Метод clear. Выбрасывает все плитки и задает новый цвет фона.
+    """
+
+    def clear(self, color):
+        self.dirty.update(self.tiles)
+        self.dirty.update(self.keys(self.rect()))
+        self.tiles.clear()
+        self.background = QColor(color)
+
+    """
+    Метод blit. Переносит на "рисовальщика" часть холста в прямоугольнике rect: созданные плитки рисуются, вместо
+    несозданных рисуется фон. С background=False несозданные плитки пропускаются, и под ними остается то, что уже
+    нарисовано (так поверх уменьшенной картинки рисуются уже прочитанные плитки, см. Canvas.paintEvent).
+    """
+
+    def blit(self, painter, rect, background=True):
+        for key in self.keys(rect):
+            x, y = key[0] * TILE_SIZE, key[1] * TILE_SIZE
+            part = QRect(x, y, TILE_SIZE, TILE_SIZE).intersected(rect)
+            tile = self.tiles.get(key)
+            if tile is None:
+                if background:
+                    painter.fillRect(part, self.background)
+            else:
+                painter.drawImage(part, tile, part.translated(-x, -y))
+
+    """
+    Метод revert. Возвращает плиткам в прямоугольнике rect тот вид, который они имеют в копии base (см. метод copy).
+    Так холст стирает только что нарисованный мазок, чтобы нарисовать его заново.
+    """
+
+    def revert(self, base, rect):
+        for key in self.keys(rect):
+            tile = base.tiles.get(key)
+            if tile is None:
+                self.tiles.pop(key, None)
+            else:
+                self.tiles[key] = QImage(tile)
+            self.dirty.add(key)
+
+    """
+    Метод takeDirty. Возвращает номера измененных плиток и забывает их.
+    """
+
+    def takeDirty(self):
+        dirty = self.dirty
+        self.dirty = set()
+        return dirty
+
+    """
+    Метод copy. Возвращает копию хранилища. Каждая плитка копируется конструктором QImage, поэтому копии делят
+    пиксели, но рисование на плитке одной копии не меняет другую: Qt сам отделит данные при первом рисовании.
+    """
+
+    def copy(self):
+        store = TileStore(self.width, self.height)
+        store.background = QColor(self.background)
+        store.tiles = {key: QImage(tile) for key, tile in self.tiles.items()}
+        return store
+
+    """
+    Метод toImage. Собирает из плиток одну картинку размером с холст.
+    """
+
+    def toImage(self, image_format=QImage.Format_RGB32):
+        image = QImage(self.size(), image_format)
+        painter = QPainter(image)
+        self.blit(painter, self.rect())
+        painter.end()
+        return image
+
+
+class TilePyramid:
+
+    """
+    Класс TilePyramid, он же Пирамида уменьшенных копий (mipmap). Самодельный служебный класс, который нужен для
+    просмотра холста в уменьшенном масштабе. Если рисовать уменьшенный холст прямо из плиток, то на огромной картинке
+    каждая перерисовка перебирает и уменьшает все ее плитки. Поэтому пирамида хранит уровни: уровень 0 - сами плитки
+    хранилища, а каждый следующий уровень вдвое меньше предыдущего, и его плитка того же размера TILE_SIZE собрана из
+    четырех плиток уровня ниже (каждый квадрат 2x2 пикселя усредняется). Холст рисуется с ближайшего уровня, который
+    еще не мельче экрана, так что перерисовка перебирает примерно столько же плиток, сколько при просмотре 1:1. Плитки
+    уровней строятся лениво, только когда их впервые нужно нарисовать, и выбрасываются, как только меняются плитки
+    хранилища под ними (см. TileStore.takeDirty).
+
+    Параметры при инициализации экземпляра класса TilePyramid:
+        store - хранилище, по которому построена пирамида. Если холст получил другое хранилище (например, после
+        отмены), пирамида строится заново
+        levels - плитки уровней начиная с первого: номер уровня -> словарь, как TileStore.tiles. None вместо плитки
+        значит, что она целиком залита фоном
+    """
+
+    def __init__(self):
+        super(TilePyramid, self).__init__()
+        self.store = None
+        self.levels = {}
+
+    """
+    Метод sync. Сверяет пирамиду с хранилищем store: выбрасывает плитки уровней над измененными плитками хранилища,
+    а если хранилище другое - все плитки.
+    """
+
+    def sync(self, store):
+        dirty = store.takeDirty()
+        if store is not self.store:
+            self.store = store
+            self.levels.clear()
+            return
+        for level, tiles in self.levels.items():
+            if tiles:
+                for x, y in dirty:
+                    tiles.pop((x >> level, y >> level), None)
+
+    """
+    Метод level. Возвращает номер уровня для масштаба zoom: самый мелкий уровень, который все еще не мельче экрана.
+    """
+
+    @staticmethod
+    def level(zoom):
+        level = 0
+        while zoom <= 0.5:
+            zoom *= 2
+            level += 1
+        return level
+
+    """
+    Метод tile. Возвращает плитку уровня level по номеру key, при необходимости собирая ее из четырех плиток уровня
+    ниже (они собираются так же, вплоть до плиток хранилища). Четверть, под которой ничего не нарисовано, заливается
+    фоном, а плитка, под которой нет ни одной плитки, не создается вовсе.
+    """
+
+    def tile(self, level, key):
+        if level == 0:
+            return self.store.tiles.get(key)
+        tiles = self.levels.setdefault(level, {})
+        if key in tiles:
+            return tiles[key]
+        half = TILE_SIZE // 2
+        parts = [(QRect(dx * half, dy * half, half, half), self.tile(level - 1, (key[0] * 2 + dx, key[1] * 2 + dy)))
+                 for dy in (0, 1) for dx in (0, 1)]
+        tile = None
+        if any(part is not None for _, part in parts):
+            tile = QImage(TILE_SIZE, TILE_SIZE, QImage.Format_RGB32)
+            painter = QPainter(tile)
+            painter.setRenderHint(QPainter.SmoothPixmapTransform)
+            for rect, part in parts:
+                if part is None:
+                    painter.fillRect(rect, self.store.background)
+                else:
+                    painter.drawImage(rect, part)
+            painter.end()
+        tiles[key] = tile
+        return tile
+
+    """
+    Метод blit. Как TileStore.blit, но рисует часть холста rect (в координатах холста) с уровня level: "рисовальщик"
+    временно уменьшает масштаб в 2 ** level раз, и плитки уровня рисуются в своих координатах.
+    """
+
+    def blit(self, painter, rect, level, background=True):
+        scale = 2 ** level
+        painter.save()
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        painter.scale(scale, scale)
+        rect = QRect(rect.left() // scale, rect.top() // scale, rect.width() // scale + 2, rect.height() // scale + 2)
+        for tx in range(rect.left() // TILE_SIZE, rect.right() // TILE_SIZE + 1):
+            for ty in range(rect.top() // TILE_SIZE, rect.bottom() // TILE_SIZE + 1):
+                tile = self.tile(level, (tx, ty))
+                if tile is not None:
+                    painter.drawImage(tx * TILE_SIZE, ty * TILE_SIZE, tile)
+                elif background:
+                    painter.fillRect(tx * TILE_SIZE, ty * TILE_SIZE, TILE_SIZE, TILE_SIZE, self.store.background)
+        painter.restore()
+
+
+class History:
+
+    """
+    Класс History, он же История. Самодельный служебный класс, который отвечает за отмену и повтор действий. Хранить
+    историю как один список объектов и при отмене перерисовывать его целиком нельзя: отмена становилась бы тем
+    медленнее, чем дольше идет работа. Поэтому каждые interval действий история запоминает контрольную точку - копию
+    плиток холста (см. TileStore.copy, копия почти ничего не стоит, пока на холсте не начнут рисовать). Отмена
+    берет ближайшую контрольную точку не позже нужного момента и дорисовывает поверх нее не больше interval действий
+    (а холст обычно и того меньше - только объекты в прямоугольнике отмененного действия, см. Canvas.replay).
+    Контрольные точки ограничены по памяти: если они занимают больше budget, самые старые выбрасываются вместе с
+    действиями до них, то есть так далеко отменить уже нельзя.
+
+    Параметры при инициализации экземпляра класса History:
+        interval - через сколько действий делать контрольную точку
+        budget - сколько байт могут занимать контрольные точки
+        ops - законченные объекты (действия) начиная с самой старой контрольной точки (см. класс PrimitiveStore)
+        start - номер действия, с которого начинается ops
+        position - сколько действий сейчас применено (все, что дальше, можно повторить)
+        checkpoints - контрольные точки: пары из номера действия и копии плиток после него
+        used - сколько памяти занимают контрольные точки
+    """
+
+    def __init__(self, interval=CHECKPOINT_INTERVAL, budget=HISTORY_BUDGET):
+        super(History, self).__init__()
+        self.interval = interval
+        self.budget = budget
+        self.ops = PrimitiveStore()
+        self.start = 0
+        self.position = 0
+        self.checkpoints = []
+        self.used = 0
+
+    """
+    Метод reset. Начинает историю заново с текущего состояния холста (например, после открытия файла).
+    """
+
+    def reset(self, store):
+        self.ops = PrimitiveStore()
+        self.start = 0
+        self.position = 0
+        self.checkpoints = [(0, store.copy())]
+        self.measure()
+
+    """
+    Метод record. Запоминает законченный объект. Все отмененные действия после текущего при этом забываются. Если с
+    последней контрольной точки набралось interval действий, запоминается новая.
+    """
+
+    def record(self, obj, store):
+        del self.ops[self.position - self.start:]
+        self.checkpoints = [checkpoint for checkpoint in self.checkpoints if checkpoint[0] <= self.position]
+        self.ops.append(obj)
+        self.position += 1
+        if self.position - self.checkpoints[-1][0] >= self.interval:
+            self.checkpoints.append((self.position, store.copy()))
+            self.measure()
+            self.trim()
+
+    """
+    Методы учета памяти:
+        measure - пересчитывает, сколько памяти занимают контрольные точки. Плитки, общие у нескольких точек
+        (одинаковый cacheKey), считаются один раз
+        trim - выбрасывает самые старые контрольные точки и действия до них, пока не уложится в бюджет. Одна точка
+        остается всегда
+    """
+
+    def measure(self):
+        keys = set()
+        for _, store in self.checkpoints:
+            keys.update(tile.cacheKey() for tile in store.tiles.values())
+        self.used = len(keys) * TILE_SIZE * TILE_SIZE * 4
+
+    def trim(self):
+        while self.used > self.budget and len(self.checkpoints) > 1 and self.checkpoints[1][0] <= self.position:
+            del self.checkpoints[0]
+            del self.ops[:self.checkpoints[0][0] - self.start]
+            self.start = self.checkpoints[0][0]
+            self.measure()
+
+    """
+    Методы отмены и повтора:
+        canUndo - можно ли что-то отменить
+        canRedo - можно ли что-то повторить
+        undo - отменяет последнее действие
+        redo - повторяет последнее отмененное действие
+    undo и redo возвращают отмененное или повторенное действие (объект), или None, если делать нечего. Новое
+    состояние холста холст узнает методом state, а плитки перерисовывает сам: отмененный объект изменил только свой
+    прямоугольник, а повторенный достаточно "запечь" еще раз (см. Canvas.restore).
+    """
+
+    def canUndo(self):
+        return bool(self.checkpoints) and self.position > self.checkpoints[0][0]
+
+    def canRedo(self):
+        return self.position - self.start < len(self.ops)
+
+    def undo(self):
+        if not self.canUndo():
+            return None
+        self.position -= 1
+        return self.ops[self.position - self.start]
+
+    def redo(self):
+        if not self.canRedo():
+            return None
+        self.position += 1
+        return self.ops[self.position - 1 - self.start]
+
+    """
+    Методы state и render. state возвращает последнюю контрольную точку не позже текущего действия (она станет базовым
+    слоем холста) и действия после нее (их не больше interval). render дорисовывает эти действия поверх копии
+    контрольной точки и возвращает готовые плитки. Холст мог вырасти после контрольной точки, поэтому копия сначала
+    растягивается до размера size.
+    """
+
+    def state(self):
+        index, base = [checkpoint for checkpoint in self.checkpoints if checkpoint[0] <= self.position][-1]
+        return base, self.ops[index - self.start:self.position - self.start]
+
+    def render(self, size):
+        base, objects = self.state()
+        store = base.copy()
+        store.resize(store.size().expandedTo(size))
+        store.commitAll(objects)
+        return store
+
+
 class Canvas(QWidget):
 
     """
@@ -54,225 +839,746 @@ class Canvas(QWidget):
     базовый виджет со своими параметрами имеет место быть.
 
     Параметры при инициализации экземпляра класса Canvas:
-        objects - список рисуемых объектов
-        instrument - выбранный инструмент (по умолчанию - кисть)
+        objects - список рисуемых объектов с сеткой их прямоугольников (см. классы PrimitiveStore и SpatialIndex)
+        instrument - имя выбранного инструмента в реестре TOOLS (по умолчанию - кисть)
+        tool - выбранный инструмент (см. класс Tool). Цвета он узнает заранее, при выборе инструмента или цвета
+        active_tool - инструмент, который начал текущее движение мыши (None - мышь не зажата)
         default_color - активный цвет (по умолчанию - цвет 1)
         pen_color - текущий цвет 1 (по умолчанию - черный)
         brush_color - текущий цвет 2 (по умолчанию - белый)
         lineSize - текущая толщина рисуемой линии (по умолчанию - 3 пикселя)
         setCursor - унаследованный метод класса QWidget, задающий стиль курсора, когда он находится в области виджета
         Здесь - команда по смене обычного курсора на встроенный крест Qt.CrossCursor
-        currentPoint - координаты текущей позиции курсора на холсте. Нужна для рисования, не отрывая руки
         fill - разрешение на заливку (по умолчанию - не заливать)
         saved - обновляемый "флажок" сохранения (по умолчанию холст сохранен, но стоит внести изменения в него, и холст
         перестает быть сохраненным)
         saved_objects - проверка на сохранение. При сохранении во время работы приложения записывает, сколько объектов
         было сохранено, и по этому числу проверяет изменения в холсте (по умолчанию - 1, заливка белым - тоже объект)
+        saving_objects - сколько объектов было на холсте, когда началось фоновое сохранение картинки (None, если
+        сохранения нет). Когда файл записан, это число становится saved_objects (см. Window.saveFinished)
         color_pix1 - визуальное представление текущего цвета 1 (сразу же метод setStyleSheet задает цвет 1 по умолчанию)
         color_pix2 - визуальное представление текущего цвета 2 (сразу же метод setStyleSheet задает цвет 2 по умолчанию)
+        store - "запеченные" пиксели холста, разбитые на плитки (см. класс TileStore). Каждый законченный объект
+        рисуется в плитки ровно один раз, поэтому перерисовка холста не зависит от того, сколько объектов уже
+        нарисовано
+        current - объект, который пользователь рисует прямо сейчас (например, тянущаяся фигура). Пока кнопка мыши
+        зажата, он рисуется поверх картинки при каждой перерисовке, а при отпускании кнопки "запекается" в картинку
+        base - базовый слой: плитки, в которые "сплющены" старые объекты, выброшенные из списка (None - белый холст).
+        Базовый слой и список objects вместе полностью описывают холст (см. метод render)
+        compact_limit - сколько объектов может накопиться в списке, прежде чем старые будут "сплющены" в базовый слой
+        stroke - мазок, который рисуется прямо сейчас (кнопка мыши еще зажата)
+        history - история отмены и повтора (см. класс History)
+        journal - журнал автосохранения (см. класс Journal) или None, если его не ведут (его задает окно)
+        tolerance - допуск заливки области (по умолчанию - BUCKET_TOLERANCE)
+        loading - читается ли сейчас открытая картинка в фоне (см. класс LoadTask). Пока она читается, рисовать и
+        отменять нельзя: на холсте еще не все плитки
+        preview - уменьшенная открытая картинка, которая растягивается на preview_rect и видна там, где плитки еще не
+        прочитаны (None - показывать нечего)
+        zoom - масштаб просмотра (1 - пиксель холста в пиксель экрана)
+        origin - точка холста, которая видна в левом верхнем углу виджета
+        pyramid - уменьшенные копии холста для просмотра в мелком масштабе (см. класс TilePyramid)
+        panning - где была мышь при прошлом сдвиге холста средней кнопкой (None - холст не двигают)
+        samples - движения мыши (точки в координатах холста), накопленные с прошлого кадра
+        frame_timer - таймер кадров, который раз в кадр экрана передает накопленные движения инструменту
+        input_events, input_frames - сколько движений мыши пришло и сколько кадров нарисовано с начала замера
+        input_start - когда начался замер частоты движений и кадров
+        simplify_tolerance - допуск упрощения законченных мазков (по умолчанию - STROKE_TOLERANCE, 0 - не упрощать)
+        smoothing - сглаживать ли законченные мазки (по умолчанию - нет)
+        stroke_base - копия плиток до начала текущего мазка: по ней мазок стирается, если после обработки его нужно
+        нарисовать заново
+        input_rate - последние сообщенные частоты движений мыши и кадров (см. метод reportRate)
+        hud - показывать ли поверх холста панель показателей производительности (см. метод drawHud)
+        hud_lines - строки панели показателей, собранные при последнем обновлении
+        hud_rect - где на виджете рисуется панель показателей
+        hud_font - моноширинный шрифт панели показателей
+        hud_timer - таймер, который раз в HUD_INTERVAL миллисекунд собирает замеры профилировщика (см. класс
+        Profiler), пока он включен
+        hud_time - когда замеры собирались в последний раз
+    Сигнал zoomChanged сообщает новый масштаб, сигнал inputRate - сколько движений мыши и кадров приходится на
+    секунду, а сигнал strokeSimplified - сколько точек было в законченном мазке и сколько осталось после обработки,
+    чтобы окно могло их показать.
     """
 
+    zoomChanged = pyqtSignal(float)
+    inputRate = pyqtSignal(float, float)
+    strokeSimplified = pyqtSignal(int, int)
+
     def __init__(self):
         super(Canvas, self).__init__()
-        self.objects = []
-        self.instrument = 'brush'
+        self.objects = PrimitiveStore(indexed=True)
         self.default_color = 'color_1'
         self.pen_color = QColor(0, 0, 0)
         self.brush_color = QColor(255, 255, 255)
+        self.tool = None
+        self.active_tool = None
+        self.setTool('brush')
         self.lineSize = 3
+        self.tolerance = BUCKET_TOLERANCE
         self.setCursor(Qt.CrossCursor)
-        self.currentPoint = QPoint()
         self.fill = False
         self.saved = True
         self.saved_objects = 1
+        self.saving_objects = None
         self.color_pix1 = QLabel()
         self.color_pix2 = QLabel()
         self.color_pix1.setStyleSheet('background-color: rgb(0, 0, 0)')
         self.color_pix2.setStyleSheet('background-color: rgb(255, 255, 255)')
+        self.store = TileStore(0, 0)
+        self.current = None
+        self.base = None
+        self.compact_limit = COMPACT_LIMIT
+        self.stroke = None
+        self.history = History()
+        self.history.reset(self.store)
+        self.journal = None
+        self.loading = False
+        self.preview = None
+        self.preview_rect = QRect()
+        self.zoom = 1.0
+        self.origin = QPointF(0, 0)
+        self.pyramid = TilePyramid()
+        self.panning = None
+        self.samples = []
+        self.frame_timer = QTimer(self)
+        self.frame_timer.setTimerType(Qt.PreciseTimer)
+        self.frame_timer.timeout.connect(self.flushInput)
+        self.input_events = 0
+        self.input_frames = 0
+        self.input_start = 0.0
+        self.simplify_tolerance = STROKE_TOLERANCE
+        self.smoothing = False
+        self.stroke_base = None
+        self.input_rate = (0.0, 0.0)
+        self.hud = False
+        self.hud_lines = []
+        self.hud_rect = QRect()
+        self.hud_font = QFontDatabase.systemFont(QFontDatabase.FixedFont)
+        self.hud_timer = QTimer(self)
+        self.hud_timer.timeout.connect(self.sampleProfile)
+        self.hud_time = 0.0
 
     """
     Встроенный метод класса QWidget. Срабатывает по отданной ядром библиотеки команде на рисование. Работает на
-    специальном объекте класса QPainter, который как раз и отвечает за рисование. А в самом методе заводится цикл,
-    в котором каждый рисуемый объект по очереди отдается соответствующему классу на 
-    рисование (метод draw, в каждом классе-инструменте он есть). Так как метод срабатывает постоянно, здесь также 
-    проверяется, соответствует ли кол-во отданных объектов кол-ву сохраненных или пуст ли холст вообще. Если нет, то 
-    холст автоматически становится несохраненным.
+    специальном объекте класса QPainter, который как раз и отвечает за рисование. Все законченные объекты уже
+    нарисованы в плитках store, поэтому метод просто переносит их на виджет и рисует поверх только текущий объект
+    (метод draw, в каждом классе-инструменте он есть). Причем переносится и рисуется только та область, которую
+    попросили перерисовать (event.rect()), остальное отсекается. Холст рисуется в масштабе zoom со сдвигом origin (см.
+    метод transform), а в мелком масштабе плитки берутся из пирамиды уменьшенных копий. Место вокруг холста, если
+    он меньше виджета, заливается темным. Пока открытая картинка читается, под плитками рисуется ее уменьшенная копия
+    (растягивается тоже только видимая часть). Если профилировщик включен, кадр и рисование текущего объекта
+    замеряются (см. класс Profiler), а поверх холста, если нужно, рисуется панель показателей (в замер кадра она не
+    входит). Так как метод срабатывает постоянно,
+    здесь также проверяется, соответствует ли кол-во отданных объектов кол-ву сохраненных или пуст ли холст вообще.
+    Если нет, то холст автоматически становится несохраненным.
     """
 
     def paintEvent(self, event):
+        start = PROFILER.start()
+        rect = event.rect()
+        transform = self.transform()
+        area = transform.inverted()[0].mapRect(rect).adjusted(-1, -1, 1, 1).intersected(self.store.rect())
+        level = TilePyramid.level(self.zoom)
+        self.pyramid.sync(self.store)
         painter = QPainter()
         painter.begin(self)
-        for obj in self.objects:
-            obj.draw(painter)
+        painter.setClipRect(rect)
+        if not transform.mapRect(self.store.rect()).contains(rect):
+            painter.fillRect(rect, self.palette().dark())
+        painter.setTransform(transform)
+        painter.setClipRect(self.store.rect(), Qt.IntersectClip)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, self.zoom < 1)
+        if self.preview is not None:
+            painter.fillRect(area, self.store.background)
+            painter.setRenderHint(QPainter.SmoothPixmapTransform)
+            painter.drawImage(self.preview_rect, self.preview)
+        if level:
+            self.pyramid.blit(painter, area, level, self.preview is None)
+        else:
+            self.store.blit(painter, area, self.preview is None)
+        if self.current is not None:
+            draw = PROFILER.start()
+            self.current.draw(painter)
+            if draw is not None:
+                PROFILER.stop(type(self.current).__name__ + '.draw', draw, 'draw')
+        if start is not None:
+            PROFILER.stop('paintEvent', start, 'paint', {'x': rect.x(), 'y': rect.y(), 'width': rect.width(),
+                                                         'height': rect.height()})
+            PROFILER.tick('Кадр')
+        if self.hud:
+            self.drawHud(painter, rect)
         painter.end()
         if len(self.objects) > self.saved_objects or self.saved_objects > len(self.objects) > 1:
             self.saved = False
 
     """
-    Встроенный метод класса QWidget. Срабатывает, если ядро библиотеки фиксирует нажатие мышью по области виджета.
-    Метод проверяет, какой инструмент и какой цвет выбран на момент вызова себя, и дает команду добавить в список
-    новый объект соответствующего инструмента с данными параметрами (координата, цвет, толщина). По окончании проверки
-    метод обновляет текущую точку и сам холст.
+    Методы панели показателей производительности:
+        setHud - показывает и прячет панель
+        updateProfiler - включает профилировщик, если показана панель или идет запись трассировки, и выключает, если
+        ни то ни другое. Пока профилировщик включен, работает таймер hud_timer
+        sampleProfile - срабатывает по таймеру: забирает у профилировщика накопленные замеры, записывает в трассировку
+        счетчики (объекты, память, частоту кадров), собирает строки панели и перерисовывает ее место (и старое, и
+        новое, если панель стала больше или меньше). Время кадра - это время между соседними
+        кадрами, поэтому, пока ничего не происходит, кадры идут только от обновления самой панели
+        hudLines - строки панели: время кадра и paintEvent, самые дорогие рисования объектов, число объектов, доля
+        попаданий в кэш картинок и пул ручек и кистей, частота движений мыши и кадров и память
+        drawHud - рисует панель в прямоугольнике hud_rect (левый верхний угол виджета), поверх холста и без масштаба
     """
 
-    def mousePressEvent(self, event):
-        if self.instrument == 'brush':
-            if self.default_color == 'color_1':
-                self.objects.append(Brush(event.pos(), event.pos(), self.lineSize, self.pen_color))
-            else:
-                self.objects.append(Brush(event.pos(), event.pos(), self.lineSize, self.brush_color))
-            self.currentPoint = event.pos()
-            self.update()
-        elif self.instrument == 'pencil':
-            if self.default_color == 'color_1':
-                self.objects.append(Pencil(event.pos(), event.pos(), self.pen_color))
-            else:
-                self.objects.append(Pencil(event.pos(), event.pos(), self.brush_color))
-            self.currentPoint = event.pos()
-            self.update()
-        elif self.instrument == 'eraser':
-            self.objects.append(Eraser(event.pos(), event.pos(), self.lineSize))
-            self.currentPoint = event.pos()
-            self.update()
-        elif self.instrument == 'fill':
-            if self.default_color == 'color_1':
-                self.objects.append(Fill(self.width(), self.height(), self.pen_color))
-            else:
-                self.objects.append(Fill(self.width(), self.height(), self.brush_color))
-            self.update()
-        elif self.instrument == 'line':
-            if self.default_color == 'color_1':
-                self.objects.append(Line(event.x(), event.y(), event.x(), event.y(), self.lineSize, self.pen_color))
-            else:
-                self.objects.append(Line(event.x(), event.y(), event.x(), event.y(), self.lineSize, self.brush_color))
-            self.update()
-        elif self.instrument == 'circle':
-            if self.default_color == 'color_1':
-                self.objects.append(
-                    Circle(event.x(), event.y(), event.x(), event.y(), self.fill, self.lineSize, self.pen_color,
-                           self.brush_color))
-            else:
-                self.objects.append(
-                    Circle(event.x(), event.y(), event.x(), event.y(), self.fill, self.lineSize, self.brush_color,
-                           self.pen_color))
-            self.update()
-        elif self.instrument == 'rectangle':
-            if self.default_color == 'color_1':
-                self.objects.append(
-                    Rectangle(event.x(), event.y(), event.x(), event.y(), self.fill, self.lineSize, self.pen_color,
-                              self.brush_color))
-            else:
-                self.objects.append(
-                    Rectangle(event.x(), event.y(), event.x(), event.y(), self.fill, self.lineSize, self.brush_color,
-                              self.pen_color))
-            self.update()
-        elif self.instrument == 'triangle':
-            if self.default_color == 'color_1':
-                self.objects.append(
-                    Triangle(event.x(), event.y(), event.x(), event.y(), self.fill, self.lineSize, self.pen_color,
-                             self.brush_color))
-            else:
-                self.objects.append(
-                    Triangle(event.x(), event.y(), event.x(), event.y(), self.fill, self.lineSize, self.brush_color,
-                             self.pen_color))
-            self.update()
-        elif self.instrument == '5gon':
-            if self.default_color == 'color_1':
-                self.objects.append(
-                    Pentagon(event.x(), event.y(), event.x(), event.y(), self.fill, self.lineSize, self.pen_color,
-                             self.brush_color))
-            else:
-                self.objects.append(
-                    Pentagon(event.x(), event.y(), event.x(), event.y(), self.fill, self.lineSize, self.brush_color,
-                             self.pen_color))
-            self.update()
-        elif self.instrument == '6gon':
-            if self.default_color == 'color_1':
-                self.objects.append(
-                    Hexagon(event.x(), event.y(), event.x(), event.y(), self.fill, self.lineSize, self.pen_color,
-                            self.brush_color))
-            else:
-                self.objects.append(
-                    Hexagon(event.x(), event.y(), event.x(), event.y(), self.fill, self.lineSize, self.brush_color,
-                            self.pen_color))
+    def setHud(self, hud):
+        self.hud = hud
+        self.updateProfiler()
+        if hud:
+            self.sampleProfile()
+        self.update()
+
+    def updateProfiler(self):
+        PROFILER.setEnabled(self.hud)
+        if PROFILER.enabled and not self.hud_timer.isActive():
+            PROFILER.collect()
+            self.hud_time = time.perf_counter()
+            self.hud_timer.start(HUD_INTERVAL)
+        elif not PROFILER.enabled:
+            self.hud_timer.stop()
+
+    def sampleProfile(self):
+        now = time.perf_counter()
+        elapsed = max(now - self.hud_time, 1e-6)
+        self.hud_time = now
+        timers = PROFILER.collect()
+        tiles, resident = self.store.bytes(), residentBytes()
+        frames = timers.get('Кадр', [0])[0]
+        PROFILER.counter('Холст', {'objects': len(self.objects), 'fps': frames / elapsed})
+        PROFILER.counter('Память, МБ', {'tiles': tiles / 2 ** 20, 'process': (resident or 0) / 2 ** 20})
+        if self.hud:
+            self.hud_lines = self.hudLines(timers, elapsed, tiles, resident)
+            metrics = QFontMetrics(self.hud_font)
+            width = max(metrics.horizontalAdvance(line) for line in self.hud_lines)
+            rect = QRect(8, 8, width + 16, metrics.height() * len(self.hud_lines) + 12)
+            self.update(rect.united(self.hud_rect))
+            self.hud_rect = rect
+
+    def hudLines(self, timers, elapsed, tiles, resident):
+        lines = []
+        count, total, worst = timers.get('Кадр', (0, 0.0, 0.0))
+        if count:
+            lines.append(f'Кадр: {total / count * 1000:.1f} мс, худший {worst * 1000:.1f} мс, '
+                         f'{count / elapsed:.0f} кадров/с')
+        else:
+            lines.append('Кадр: холст не перерисовывался')
+        count, total, worst = timers.get('paintEvent', (0, 0.0, 0.0))
+        if count:
+            lines.append(f'paintEvent: {total / count * 1000:.2f} мс, худший {worst * 1000:.2f} мс')
+        draws = sorted(((value[1], name, value[0]) for name, value in timers.items()
+                        if name.endswith(('.draw', '.drawTail')) or name == 'paintGroup'), reverse=True)[:3]
+        if draws:
+            lines.append('Рисование: ' + ', '.join(f'{name} {count}x {total * 1000:.1f} мс'
+                                                   for total, name, count in draws))
+        rates = [f'{stats["hit_rate"]:.0%}' if stats['hits'] + stats['misses'] else 'нет обращений'
+                 for stats in (IMAGE_CACHE.stats(), STYLE_POOL.stats())]
+        lines.append(f'Объекты: {len(self.objects)}')
+        lines.append(f'Попадания: кэш картинок {rates[0]}, ручки и кисти {rates[1]}')
+        lines.append(f'Мышь: {self.input_rate[0]:.0f} событий/с, {self.input_rate[1]:.0f} кадров/с')
+        memory = f'Память: плитки {tiles / 2 ** 20:.0f} МБ'
+        if resident is not None:
+            memory += f', процесс {resident / 2 ** 20:.0f} МБ'
+        lines.append(memory)
+        if PROFILER.tracing:
+            lines.append(f'Трассировка: {len(PROFILER.events)} событий')
+        return lines
+
+    def drawHud(self, painter, rect):
+        if not rect.intersects(self.hud_rect):
+            return
+        painter.resetTransform()
+        painter.setClipRect(rect)
+        painter.setFont(self.hud_font)
+        painter.fillRect(self.hud_rect, QColor(0, 0, 0, 180))
+        painter.setPen(Qt.white)
+        metrics = painter.fontMetrics()
+        for number, line in enumerate(self.hud_lines):
+            painter.drawText(16, 14 + metrics.ascent() + number * metrics.height(), line)
+
+    """
+    Встроенный метод класса QWidget. Срабатывает при изменении размера виджета. Холст должен покрывать весь виджет,
+    поэтому при увеличении виджета холст увеличивается (новые плитки появятся сами, когда на них начнут рисовать).
+    При уменьшении холст не обрезается, чтобы нарисованное не пропало, если окно снова развернут.
+    """
+
+    def resizeEvent(self, event):
+        self.store.resize(self.store.size().expandedTo(event.size()))
+        self.pan(0, 0)
+        super(Canvas, self).resizeEvent(event)
+
+    """
+    Методы просмотра холста:
+        transform - преобразование из координат холста в координаты виджета: сдвиг на origin и масштаб zoom
+        updateRect - перерисовывает прямоугольник, заданный в координатах холста
+        canvasEvent - возвращает копию события мыши, в которой координаты переведены в координаты холста. Так все
+        инструменты работают в координатах холста при любом масштабе и сдвиге
+        setZoom - задает масштаб так, чтобы точка холста под точкой виджета anchor (по умолчанию - центр виджета)
+        осталась на месте
+        zoomIn, zoomOut - приближают и отдаляют холст на ZOOM_STEP
+        zoomReset - возвращает масштаб 1:1 и левый верхний угол холста
+        zoomFit - подбирает масштаб так, чтобы весь холст поместился в виджет, и ставит холст посередине
+        pan - сдвигает холст на (dx, dy) пикселей виджета. Дальше края холст не уезжает: если холст больше виджета,
+        виджет всегда целиком на холсте, а если меньше - холст всегда целиком в виджете
+    """
+
+    def transform(self):
+        return QTransform().scale(self.zoom, self.zoom).translate(-self.origin.x(), -self.origin.y())
+
+    def updateRect(self, rect):
+        self.update(self.transform().mapRect(rect).adjusted(-1, -1, 1, 1))
+
+    def canvasEvent(self, event):
+        point = self.transform().inverted()[0].map(event.localPos())
+        return QMouseEvent(event.type(), point, event.button(), event.buttons(), event.modifiers())
+
+    def setZoom(self, zoom, anchor=None):
+        zoom = min(max(zoom, ZOOM_MIN), ZOOM_MAX)
+        if abs(zoom - 1) < 1e-6:
+            zoom = 1.0
+        if anchor is None:
+            anchor = QPointF(self.width() / 2, self.height() / 2)
+        point = self.origin + anchor / self.zoom
+        self.zoom = zoom
+        self.origin = point - anchor / zoom
+        self.pan(0, 0)
+        self.zoomChanged.emit(zoom)
+
+    def zoomIn(self):
+        self.setZoom(self.zoom * ZOOM_STEP)
+
+    def zoomOut(self):
+        self.setZoom(self.zoom / ZOOM_STEP)
+
+    def zoomReset(self):
+        self.zoom = 1.0
+        self.origin = QPointF(0, 0)
+        self.pan(0, 0)
+        self.zoomChanged.emit(self.zoom)
+
+    def zoomFit(self):
+        self.zoom = min(self.width() / self.store.width, self.height() / self.store.height, 1.0)
+        self.origin = QPointF((self.store.width - self.width() / self.zoom) / 2,
+                              (self.store.height - self.height() / self.zoom) / 2)
+        self.pan(0, 0)
+        self.zoomChanged.emit(self.zoom)
+
+    def pan(self, dx, dy):
+        x, y = self.origin.x() + dx / self.zoom, self.origin.y() + dy / self.zoom
+        width, height = self.store.width - self.width() / self.zoom, self.store.height - self.height() / self.zoom
+        x = min(max(x, min(width, 0)), max(width, 0))
+        y = min(max(y, min(height, 0)), max(height, 0))
+        if self.zoom == 1:
+            x, y = round(x), round(y)
+        self.origin = QPointF(x, y)
+        self.update()
+
+    """
+    Служебные методы работы с плитками холста:
+        commit - "запекает" объект в плитки, то есть рисует его на них один раз и навсегда
+        addObject - добавляет законченный объект в список и сразу же "запекает" его
+        startStroke - добавляет в список новый мазок и "запекает" его первую точку. Если мазки обрабатываются, сначала
+        запоминает копию плиток (она почти ничего не стоит, см. TileStore.copy)
+        extendStroke - добавляет точки в текущий мазок и "запекает" только новые отрезки
+        finishStroke - обрабатывает законченный мазок (упрощает и, если нужно, сглаживает, см. Stroke.simplify). Если
+        точки мазка изменились, его область возвращается к копии до мазка, и мазок "запекается" заново, чтобы плитки
+        в точности совпадали с тем, что потом нарисуют отмена и повтор
+        endStroke - заканчивает текущий мазок: обрабатывает его (finishStroke) и отдает истории отмены
+        startObject - добавляет объект в список и делает его текущим: "запекается" он только по отпусканию мыши
+        stretchObject - переносит конец текущего объекта в точку point (объект тянут мышью)
+        endObject - "запекает" текущий объект и отдает его истории отмены
+        finish - сообщает истории отмены и журналу автосохранения, что объект закончен
+        resetHistory - начинает историю отмены заново с текущего холста (например, после открытия документа)
+        snapshotJournal - начинает новое поколение журнала автосохранения со снимком текущего холста
+        clear - удаляет все объекты и заливает холст белым
+        startLoad - добавляет в список открываемую картинку, не "запекая" ее: ее плитки придут из фонового чтения
+        showPreview - показывает уменьшенную картинку image, растянутую на прямоугольник rect
+        loadTiles - кладет в хранилище готовые плитки картинки (словарь, как TileStore.tiles) и перерисовывает их
+        endLoad - картинка прочитана: уменьшенная копия больше не нужна, а история отмены начинается заново
+    Методы добавления перерисовывают не весь холст, а только прямоугольник, занимаемый объектом (метод boundingRect,
+    в каждом классе-инструменте он есть). На большом экране это в разы дешевле, чем перерисовка всего виджета.
+    """
+
+    def commit(self, obj):
+        self.store.commit(obj)
+
+    def addObject(self, obj):
+        self.commit(obj)
+        self.objects.append(obj)
+        self.finish(obj)
+        self.compact()
+        self.updateRect(obj.boundingRect())
+
+    def startStroke(self, obj):
+        if self.simplify_tolerance > 0 or self.smoothing:
+            self.stroke_base = self.store.copy()
+        self.objects.append(obj, live=True)
+        self.commit(obj)
+        self.stroke = obj
+        self.compact()
+        self.updateRect(obj.boundingRect())
+
+    def extendStroke(self, points):
+        rect = self.stroke.addPoints(points)
+        self.objects.touch()
+        start = PROFILER.start()
+        self.store.paint(rect, self.stroke.drawTail)
+        if start is not None:
+            PROFILER.stop(type(self.stroke).__name__ + '.drawTail', start, 'draw', {'points': len(points)})
+        self.updateRect(rect)
+
+    def finishStroke(self):
+        stroke, base = self.stroke, self.stroke_base
+        self.stroke_base = None
+        if base is None:
+            return
+        count = stroke.points.size()
+        rect = stroke.boundingRect()
+        if stroke.simplify(self.simplify_tolerance, self.smoothing) or self.smoothing:
+            rect = rect.united(stroke.boundingRect())
+            self.store.revert(base, rect)
+            self.store.paint(rect, stroke.draw)
+            self.updateRect(rect)
+        self.strokeSimplified.emit(count, stroke.points.size())
+
+    def endStroke(self):
+        if self.stroke is not None:
+            self.finishStroke()
+            self.finish(self.stroke)
+            self.stroke = None
+
+    def startObject(self, obj):
+        self.objects.append(obj, live=True)
+        self.current = obj
+        self.compact()
+        self.updateRect(obj.boundingRect())
+
+    def stretchObject(self, point):
+        rect = self.current.boundingRect()
+        self.current.setEnd(point.x(), point.y())
+        self.objects.touch()
+        self.updateRect(rect.united(self.current.boundingRect()))
+
+    def endObject(self):
+        if self.current is not None:
+            self.commit(self.current)
+            self.finish(self.current)
+            self.updateRect(self.current.boundingRect())
+            self.current = None
+
+    def finish(self, obj):
+        self.objects.seal()
+        self.history.record(obj, self.store)
+        if self.journal is not None and self.journal.append(obj, self.store.size()):
+            self.snapshotJournal()
+
+    def resetHistory(self):
+        self.history.reset(self.store)
+        self.snapshotJournal()
+
+    def snapshotJournal(self):
+        if self.journal is not None:
+            self.journal.rollover(self.store.size(), self.base, self.objects, self.history.position)
+
+    def clear(self):
+        self.objects.clear()
+        self.current = None
+        self.stroke = None
+        self.base = None
+        self.loading = False
+        self.preview = None
+        self.store.clear(Qt.white)
+
+    def startLoad(self, obj):
+        self.objects.append(obj)
+        self.loading = True
+
+    def showPreview(self, image, rect):
+        self.preview = image
+        self.preview_rect = rect
+        self.updateRect(rect)
+
+    def loadTiles(self, tiles):
+        self.store.tiles.update(tiles)
+        self.store.dirty.update(tiles)
+        rect = QRect()
+        for x, y in tiles:
+            rect = rect.united(QRect(x * TILE_SIZE, y * TILE_SIZE, TILE_SIZE, TILE_SIZE))
+        self.updateRect(rect)
+
+    def endLoad(self):
+        self.loading = False
+        self.preview = None
+        self.resetHistory()
+        self.update()
+
+    """
+    Методы undo и redo. Отменяют и повторяют последнее действие. Пока кнопка мыши зажата или открытая картинка еще
+    читается, ничего не делают. Контрольная точка истории становится базовым слоем холста, поверх которого лежат
+    оставшиеся объекты (см. History.state), а плитки меняются только там, где нужно: повторенный объект просто
+    "запекается" еще раз, а после отмены перерисовывается только прямоугольник отмененного объекта (метод replay).
+    Если так нельзя, плитки целиком берутся из истории (History.render). После отмены или повтора холст считается
+    несохраненным, а журнал автосохранения получает отмену или повторенный объект (см. класс Journal).
+    """
+
+    def undo(self):
+        self.restore(self.history.undo, True)
+
+    def redo(self):
+        self.restore(self.history.redo, False)
+
+    def restore(self, step, undo):
+        if self.current is not None or self.stroke is not None or self.loading:
+            return
+        obj = step()
+        if obj is None:
+            return
+        self.base, objects = self.history.state()
+        self.objects = PrimitiveStore(objects, indexed=True)
+        if not undo:
+            self.commit(obj)
+            self.updateRect(obj.boundingRect())
+        elif not self.replay(obj.boundingRect()):
+            self.store = self.history.render(self.store.size())
             self.update()
-        elif self.instrument == '8gon':
-            if self.default_color == 'color_1':
-                self.objects.append(
-                    Octagon(event.x(), event.y(), event.x(), event.y(), self.fill, self.lineSize, self.pen_color,
-                            self.brush_color))
+        self.saved = False
+        if self.journal is not None:
+            due = self.journal.undo(self.history.position) if undo else self.journal.append(obj, self.store.size())
+            if due:
+                self.snapshotJournal()
+
+    """
+    Метод replay. Перерисовывает плитки холста, которые задевает прямоугольник rect: берет их из базового слоя и
+    повторяет поверх только те объекты, которые задевают эти плитки (их находит сетка SpatialIndex), в порядке
+    рисования и только на этих плитках. Остальные плитки не трогаются. Заливка области и фильтры зависят от пикселей
+    за пределами области, а заливка во весь холст меняет фон, поэтому с ними перерисовать только область нельзя, и
+    метод возвращает False, ничего не меняя.
+    """
+
+    def replay(self, rect):
+        keys = self.store.keys(rect)
+        if not keys:
+            return True
+        area = QRect()
+        for x, y in keys:
+            area = area.united(QRect(x * TILE_SIZE, y * TILE_SIZE, TILE_SIZE, TILE_SIZE))
+        objects = [self.objects[index] for index in self.objects.query(area)]
+        if any(isinstance(obj, (Bucket, Filter)) for obj in objects):
+            return False
+        store = TileStore(self.store.width, self.store.height)
+        if self.base is not None:
+            store.background = QColor(self.base.background)
+            store.tiles = {key: QImage(self.base.tiles[key]) for key in keys if key in self.base.tiles}
+        store.commitAll(objects, area)
+        if store.background != self.store.background:
+            return False
+        self.store.revert(store, area)
+        self.updateRect(area)
+        return True
+
+    """
+    Метод objectAt. Возвращает номер верхней (последней нарисованной) фигуры или линии, на которую приходится точка
+    point в координатах холста, или None. Сетка SpatialIndex отдает только объекты из клетки под точкой, чьи
+    прямоугольники содержат точку, сверху вниз, и каждый проверяется точнее методом contains. Мазки, заливки и
+    картинки не выбираются.
+    """
+
+    def objectAt(self, point):
+        for index in self.objects.at(point):
+            obj = self.objects[index]
+            if hasattr(obj, 'contains') and obj.contains(point):
+                return index
+        return None
+
+    """
+    Методы ужатия списка объектов. Без них список растет всю сессию, хотя большая часть объектов давно закрашена или
+    просто не нужна по отдельности:
+        compact - если последний объект закрывает весь холст (заливка, непрозрачная картинка во весь холст), все, что
+        под ним, выбрасывается вместе с базовым слоем. Если же объектов накопилось больше compact_limit, все, кроме
+        последнего (он может еще рисоваться), "сплющиваются" в базовый слой
+        dropObjects - выбрасывает первые count объектов. Счетчики сохраненных объектов (и объектов идущего сохранения)
+        сдвигаются на столько же, чтобы проверка на сохранение в paintEvent продолжала работать
+        load - заменяет холст документом: размером, базовым слоем и объектами. Объекты могут приходить потоком
+        (например, из DocumentReader): поток читается один раз, без промежуточного списка, и каждый объект сразу
+        "запекается". Загруженный документ считается сохраненным
+        appended - отдает объекты по одному и добавляет каждый в список объектов, когда его уже "запекли"
+        render - рисует холст заново из базового слоя и списка объектов в новые плитки
+    Базовый слой - тоже плитки, и при "сплющивании" он не перерисовывается целиком: копия старого слоя делит с ним
+    пиксели, и дублируются только плитки, на которых рисуют выбрасываемые объекты.
+    """
+
+    def compact(self):
+        if len(self.objects) < 2:
+            return
+        if isinstance(self.objects[-1], (Fill, Image)) and self.objects[-1].covers(self.store.rect()):
+            self.base = None
+            self.dropObjects(len(self.objects) - 1)
+        elif len(self.objects) > self.compact_limit:
+            if self.base is None:
+                base = TileStore(self.store.width, self.store.height)
             else:
-                self.objects.append(
-                    Octagon(event.x(), event.y(), event.x(), event.y(), self.fill, self.lineSize, self.brush_color,
-                            self.pen_color))
-            self.update()
+                base = self.base.copy()
+                base.resize(self.store.size())
+            base.commitAll(self.objects[:-1])
+            self.base = base
+            self.dropObjects(len(self.objects) - 1)
+
+    def dropObjects(self, count):
+        del self.objects[:count]
+        self.saved_objects = max(self.saved_objects - count, 0)
+        if self.saving_objects is not None:
+            self.saving_objects = max(self.saving_objects - count, 0)
+
+    def load(self, size, base, objects):
+        self.clear()
+        size = self.store.size().expandedTo(size)
+        if base is not None:
+            self.base = base
+            self.store = base.copy()
+        self.store.resize(size)
+        self.store.commitAll(self.appended(objects))
+        self.saved_objects = len(self.objects)
+        self.saved = True
+        self.update()
+
+    def appended(self, objects):
+        for obj in objects:
+            yield obj
+            self.objects.append(obj)
+
+    def render(self):
+        if self.base is None:
+            store = TileStore(self.store.width, self.store.height)
+        else:
+            store = self.base.copy()
+            store.resize(self.store.size())
+        store.commitAll(self.objects)
+        return store
+
+    """
+    Встроенный метод класса QWidget. Срабатывает, если ядро библиотеки фиксирует нажатие мышью по области виджета.
+    Нажатие передается прямо выбранному инструменту (см. класс Tool): он сам добавляет в список новый объект с уже
+    известными ему цветами и текущей толщиной, и холст обновляет область, занятую новым объектом. Инструмент
+    запоминается как active_tool: движения и отпускание получит он, даже если инструмент сменят посреди движения.
+    Координаты мыши сначала переводятся в координаты холста (метод canvasEvent). Средняя кнопка ничего не рисует, а
+    начинает сдвиг холста. Пока открытая картинка читается, остальные нажатия не обрабатываются.
+    """
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.MiddleButton:
+            self.panning = event.pos()
+            return
+        if self.loading:
+            return
+        self.active_tool = self.tool
+        self.tool.press(self.canvasEvent(event).pos())
 
     """
     Встроенный метод класса QWidget. Срабатывает, если ядро библиотеки фиксирует движение мыши с зажатой
-    кнопкой в области виджета. Метод вновь проверяет, какой инструмент и какой цвет выбран, и дальше команды разнятся:
-    "кистепроизводные" инструменты работают как обычно, а фигуры меняют координату конца, вследствие чего фигура меняет
-    свои измерения. По окончании проверок метод обновляет текущую точку и сам холст.
+    кнопкой в области виджета. Само движение ничего не рисует: точка (в координатах холста) откладывается до
+    ближайшего кадра, а разбирает накопленные точки метод flushInput. Там точки получает инструмент, начавший
+    движение: "кистепроизводные" инструменты добавляют точки в текущий мазок, а фигуры меняют координату конца,
+    вследствие чего фигура меняет свои измерения. После этого обновляется измененная область холста. Если нажатие не
+    начало ни мазка, ни фигуры (например, оно пришлось на чтение картинки), двигать нечего. Если зажата средняя
+    кнопка, холст сдвигается вслед за мышью.
     """
 
     def mouseMoveEvent(self, event):
-        if self.instrument == 'brush':
-            if self.default_color == 'color_1':
-                self.objects.append(Brush(self.currentPoint, event.pos(), self.lineSize, self.pen_color))
-            else:
-                self.objects.append(Brush(self.currentPoint, event.pos(), self.lineSize, self.brush_color))
-            self.currentPoint = event.pos()
-            self.update()
-        elif self.instrument == 'pencil':
-            if self.default_color == 'color_1':
-                self.objects.append(Pencil(self.currentPoint, event.pos(), self.pen_color))
-            else:
-                self.objects.append(Pencil(self.currentPoint, event.pos(), self.brush_color))
-            self.currentPoint = event.pos()
-            self.update()
-        elif self.instrument == 'eraser':
-            self.objects.append(Eraser(self.currentPoint, event.pos(), self.lineSize))
-            self.currentPoint = event.pos()
-            self.update()
-        elif self.instrument == 'line':
-            self.objects[-1].ex = event.x()
-            self.objects[-1].ey = event.y()
-            self.update()
-        elif self.instrument == 'circle':
-            self.objects[-1].x = event.x()
-            self.objects[-1].y = event.y()
-            self.update()
-        elif self.instrument == 'rectangle':
-            self.objects[-1].x = event.x()
-            self.objects[-1].y = event.y()
-            self.update()
-        elif self.instrument == 'triangle':
-            self.objects[-1].x = event.x()
-            self.objects[-1].y = event.y()
-            self.update()
-        elif self.instrument == '5gon':
-            self.objects[-1].x = event.x()
-            self.objects[-1].y = event.y()
-            self.update()
-        elif self.instrument == '6gon':
-            self.objects[-1].x = event.x()
-            self.objects[-1].y = event.y()
-            self.update()
-        elif self.instrument == '8gon':
-            self.objects[-1].x = event.x()
-            self.objects[-1].y = event.y()
-            self.update()
+        if self.panning is not None:
+            delta = self.panning - event.pos()
+            self.panning = event.pos()
+            self.pan(delta.x(), delta.y())
+            return
+        if self.current is None and self.stroke is None:
+            return
+        self.samples.append(self.canvasEvent(event).pos())
+        self.input_events += 1
+        if not self.frame_timer.isActive():
+            rate = self.screen().refreshRate() if self.screen() is not None else 0
+            self.frame_timer.start(max(1, int(1000 / (rate if rate > 0 else FRAME_RATE))))
+            if not self.input_start:
+                self.input_start = time.perf_counter()
 
     """
-    Методы-"настройщики". Сделаны специально, чтобы в ключевых моментах кода не было произвольных действий.
-    Перечень методов и их функции:
-        setDefaultColor - сделать цвет 1 или цвет 2 активным (в зависимости от того, что выбрал пользователь)
-        setCustomColor - открыть диалоговое окно создания цвета и по закрытии окна задать созданный пользователем цвет
-        в качестве активного
-        setUpdateColor - обновить визуальное представление цвета
-        setRed - поставить красный
-        setOrange - поставить оранжевый
-        setYellow - поставить желтый
-        setGreen - поставить зеленый
+    Метод flushInput. Срабатывает по таймеру кадров и передает инструменту, начавшему движение, все движения мыши,
+    накопившиеся за кадр (метод Tool.move). Игровая мышь или планшет присылают сотни-тысячи движений в секунду, а экран
+    показывает 60-144 кадров, поэтому мазок получает сразу все новые точки (ни одна не теряется) и "запекается" одной
+    ломаной, а фигуре нужна только последняя точка. Перерисовка тоже одна на кадр. Если за кадр движений не было,
+    таймер останавливается до следующего движения. Раз в секунду (и по окончании движения) холст сообщает частоту
+    движений и кадров.
+    """
+
+    def flushInput(self):
+        points = self.samples
+        if not points:
+            self.frame_timer.stop()
+            self.reportRate()
+            return
+        self.samples = []
+        self.input_frames += 1
+        if time.perf_counter() - self.input_start >= 1:
+            self.reportRate()
+        if self.active_tool is not None:
+            start = PROFILER.start()
+            self.active_tool.move(points)
+            PROFILER.stop('flushInput', start, 'input', {'points': len(points)})
+
+    """
+    Метод reportRate. Посылает сигнал inputRate с частотой движений мыши и кадров с начала замера и начинает новый
+    замер.
+    """
+
+    def reportRate(self):
+        elapsed = time.perf_counter() - self.input_start
+        if self.input_start and elapsed > 0:
+            self.input_rate = (self.input_events / elapsed, self.input_frames / elapsed)
+            self.inputRate.emit(*self.input_rate)
+        self.input_events = 0
+        self.input_frames = 0
+        self.input_start = time.perf_counter() if self.frame_timer.isActive() else 0.0
+
+    """
+    Встроенный метод класса QWidget. Срабатывает, если ядро библиотеки фиксирует отпускание кнопки мыши. Инструмент,
+    начавший движение, сначала получает движения мыши, еще не разобранные таймером кадров, а затем заканчивает свой
+    объект (см. методы endObject и endStroke). Отпускание средней кнопки заканчивает сдвиг холста.
+    """
+
+    def mouseReleaseEvent(self, event):
+        if event.button() == Qt.MiddleButton:
+            self.panning = None
+            return
+        self.flushInput()
+        if self.active_tool is not None:
+            self.active_tool.release()
+            self.active_tool = None
+
+    """
+    Встроенный метод класса QWidget. Срабатывает при прокрутке колесика мыши. С зажатым Ctrl колесико меняет масштаб
+    вокруг точки под курсором, с зажатым Shift сдвигает холст по горизонтали, а без них - прокручивает его.
+    """
+
+    def wheelEvent(self, event):
+        delta = event.angleDelta()
+        if event.modifiers() & Qt.ControlModifier:
+            self.setZoom(self.zoom * ZOOM_STEP ** (delta.y() / 120), event.position())
+        elif event.modifiers() & Qt.ShiftModifier:
+            self.pan(-delta.y(), 0)
+        else:
+            self.pan(-delta.x(), -delta.y())
+
+    """
+    Методы-"настройщики". Сделаны специально, чтобы в ключевых моментах кода не было произвольных действий.
+    Перечень методов и их функции:
+        setDefaultColor - сделать цвет 1 или цвет 2 активным (в зависимости от того, что выбрал пользователь)
+        setCustomColor - открыть диалоговое окно создания цвета и по закрытии окна задать созданный пользователем цвет
+        в качестве активного
+        setUpdateColor - обновить визуальное представление цвета
+        setRed - поставить красный
+        setOrange - поставить оранжевый
+        setYellow - поставить желтый
+        setGreen - поставить зеленый
         setLightBlue - поставить голубой
         setBlue - поставить синий
         setPurple - поставить фиолетовый
@@ -285,10 +1591,18 @@ class Canvas(QWidget):
         setPink - поставить розовый
         setFigureFill - разрешить или запретить заливку
         setSize - установить толщину контура
+        updateColor - показать новый цвет в образце активного цвета
+        updateTool - передать выбранному инструменту активный и второй цвет. Вызывается при каждой смене цвета или
+        инструмента, поэтому при нажатии мыши цвета уже известны и не выясняются заново
+        setTool - сделать активным инструмент из реестра TOOLS по имени
         setBrush - сделать кисть активным инструментом
         setPencil - сделать карандаш активным инструментом
         setEraser - сделать ластик активным инструментом
         setFill - сделать заливку активным инструментом
+        setBucket - сделать заливку области активным инструментом
+        setTolerance - задать допуск заливки области
+        setSimplify - задать допуск упрощения законченных мазков (0 - не упрощать)
+        setSmoothing - включить или выключить сглаживание законченных мазков
         setLine - сделать линию активным инструментом
         setCircle - сделать эллипс активным инструментом
         setTriangle - сделать треугольник активным инструментом
@@ -305,6 +1619,7 @@ class Canvas(QWidget):
             self.default_color = 'color_1'
         else:
             self.default_color = 'color_2'
+        self.updateTool()
 
     def setCustomColor(self):
         custom = QColorDialog()
@@ -322,6 +1637,18 @@ class Canvas(QWidget):
             self.color_pix1.setStyleSheet(f'background-color: {fill_color}')
         else:
             self.color_pix2.setStyleSheet(f'background-color: {fill_color}')
+        self.updateTool()
+
+    def updateTool(self):
+        if self.default_color == 'color_1':
+            self.tool.setColors(self.pen_color, self.brush_color)
+        else:
+            self.tool.setColors(self.brush_color, self.pen_color)
+
+    def setTool(self, name):
+        self.instrument = name
+        self.tool = TOOLS[name](self)
+        self.updateTool()
 
     def setRed(self):
         if self.default_color == 'color_1':
@@ -379,616 +1706,3778 @@ class Canvas(QWidget):
             self.brush_color = QColor(139, 0, 255)
             self.updateColor(self.brush_color)
 
-    def setBlack(self):
-        if self.default_color == 'color_1':
-            self.pen_color = QColor(0, 0, 0)
-            self.updateColor(self.pen_color)
-        else:
-            self.brush_color = QColor(0, 0, 0)
-            self.updateColor(self.brush_color)
+    def setBlack(self):
+        if self.default_color == 'color_1':
+            self.pen_color = QColor(0, 0, 0)
+            self.updateColor(self.pen_color)
+        else:
+            self.brush_color = QColor(0, 0, 0)
+            self.updateColor(self.brush_color)
+
+    def setWhite(self):
+        if self.default_color == 'color_1':
+            self.pen_color = QColor(255, 255, 255)
+            self.updateColor(self.pen_color)
+        else:
+            self.brush_color = QColor(255, 255, 255)
+            self.updateColor(self.brush_color)
+
+    def setLightGrey(self):
+        if self.default_color == 'color_1':
+            self.pen_color = QColor(187, 187, 187)
+            self.updateColor(self.pen_color)
+        else:
+            self.brush_color = QColor(187, 187, 187)
+            self.updateColor(self.brush_color)
+
+    def setDarkGrey(self):
+        if self.default_color == 'color_1':
+            self.pen_color = QColor(73, 66, 61)
+            self.updateColor(self.pen_color)
+        else:
+            self.brush_color = QColor(73, 66, 61)
+            self.updateColor(self.brush_color)
+
+    def setBrown(self):
+        if self.default_color == 'color_1':
+            self.pen_color = QColor(150, 75, 0)
+            self.updateColor(self.pen_color)
+        else:
+            self.brush_color = QColor(150, 75, 0)
+            self.updateColor(self.brush_color)
+
+    def setDarkRed(self):
+        if self.default_color == 'color_1':
+            self.pen_color = QColor(139, 0, 0)
+            self.updateColor(self.pen_color)
+        else:
+            self.brush_color = QColor(139, 0, 0)
+            self.updateColor(self.brush_color)
+
+    def setPink(self):
+        if self.default_color == 'color_1':
+            self.pen_color = QColor(255, 192, 203)
+            self.updateColor(self.pen_color)
+        else:
+            self.brush_color = QColor(255, 192, 203)
+            self.updateColor(self.brush_color)
+
+    def setFigureFill(self):
+        if self.sender().isChecked():
+            self.fill = True
+        else:
+            self.fill = False
+
+    def setSize(self):
+        self.lineSize = MAINSIZE_KEYS[self.sender().currentText()]
+
+    def setBrush(self):
+        self.setTool('brush')
+
+    def setPencil(self):
+        self.setTool('pencil')
+
+    def setEraser(self):
+        self.setTool('eraser')
+
+    def setFill(self):
+        self.setTool('fill')
+
+    def setBucket(self):
+        self.setTool('bucket')
+
+    def setTolerance(self, tolerance):
+        self.tolerance = tolerance
+
+    def setSimplify(self, tolerance):
+        self.simplify_tolerance = tolerance
+
+    def setSmoothing(self, smoothing):
+        self.smoothing = smoothing
+
+    def setLine(self):
+        self.setTool('line')
+
+    def setCircle(self):
+        self.setTool('circle')
+
+    def setTriangle(self):
+        self.setTool('triangle')
+
+    def setRectangle(self):
+        self.setTool('rectangle')
+
+    def setPentagon(self):
+        self.setTool('5gon')
+
+    def setHexagon(self):
+        self.setTool('6gon')
+
+    def setOctagon(self):
+        self.setTool('8gon')
+
+
+"""
+Функции обработки мазков. Работают с точками мазка как с массивом NumPy (строки - точки, столбцы - x и y):
+    simplifyPoints - упрощает ломаную алгоритмом Рамера-Дугласа-Пекера: от отрезка между первой и последней точкой
+    ищется самая далекая точка, и если она дальше tolerance, отрезок делится в ней надвое и обе половины проверяются
+    так же, а иначе все точки между концами выбрасываются. Расстояние считается до отрезка, а не до прямой, чтобы не
+    пропали "возвраты" мазка назад по той же линии. Возвращает булеву маску оставленных точек. Любая точка исходной
+    ломаной лежит не дальше tolerance от упрощенной, поэтому с тем же допуском мазок выглядит так же
+    smoothPoints - проводит через точки кривую Катмулла-Рома (она проходит через каждую точку, в отличие от кривой
+    Безье по тем же точкам) и возвращает ее точки с шагом примерно step пикселей
+Отрезки simplifyPoints делит не по одному, а все сразу: за проход для каждой точки считается расстояние до отрезка
+между ближайшими оставленными точками, и в каждом отрезке оставляется самая далекая точка. Так проходов столько,
+сколько уровней деления, а не сколько оставленных точек, и длинный мазок упрощается за несколько операций NumPy.
+"""
+
+
+def simplifyPoints(points, tolerance):
+    keep = numpy.zeros(len(points), bool)
+    keep[[0, -1]] = True
+    while True:
+        kept = numpy.flatnonzero(keep)
+        segment = numpy.minimum(numpy.cumsum(keep) - 1, len(kept) - 2)
+        start = points[kept[segment]]
+        direction = points[kept[segment + 1]] - start
+        length = numpy.einsum('ij,ij->i', direction, direction)
+        offset = points - start
+        along = numpy.einsum('ij,ij->i', offset, direction) / numpy.where(length, length, 1)
+        offset -= numpy.clip(along, 0, 1)[:, None] * direction
+        distance = numpy.einsum('ij,ij->i', offset, offset)
+        farthest = numpy.maximum.reduceat(distance, kept[:-1])[segment]
+        split = numpy.flatnonzero((distance == farthest) & (distance > tolerance * tolerance))
+        if not len(split):
+            return keep
+        keep[split[numpy.unique(segment[split], return_index=True)[1]]] = True
+
+
+def smoothPoints(points, step):
+    padded = numpy.concatenate((points[:1], points, points[-1:]))
+    p0, p1, p2, p3 = padded[:-3], padded[1:-2], padded[2:-1], padded[3:]
+    counts = numpy.maximum(numpy.ceil(numpy.hypot(*(p2 - p1).T) / step), 1).astype(int)
+    segment = numpy.repeat(numpy.arange(len(counts)), counts)
+    t = (numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)) / counts[segment]
+    t = t[:, None]
+    p0, p1, p2, p3 = p0[segment], p1[segment], p2[segment], p3[segment]
+    curve = 0.5 * (2 * p1 + (p2 - p0) * t + (2 * p0 - 5 * p1 + 4 * p2 - p3) * t ** 2 +
+                   (3 * p1 - p0 - 3 * p2 + p3) * t ** 3)
+    return numpy.concatenate((curve, points[-1:]))
+
+
+class StylePool:
+
+    """
+    Класс StylePool, он же Пул ручек и кистей. Самодельный служебный класс, который раздает объектам общие QPen и
+    QBrush. Раньше каждый объект создавал новые ручку и кисть при каждом рисовании, то есть при каждой перерисовке и
+    каждом повторе истории. Теперь одинаковые по цвету, толщине и виду линии объекты получают одну и ту же пару
+    (ручка, кисть), поэтому пары можно сравнивать простым is (так TileStore.commitAll понимает, что соседним объектам
+    не нужно заново задавать ручку и кисть). Пул ограничен по числу пар: при переполнении выбрасываются пары, которые
+    дольше всех не запрашивались (LRU). Объекты, которые уже получили выброшенную пару, продолжают ею пользоваться.
+
+    Параметры при инициализации экземпляра класса StylePool:
+        size - сколько пар может храниться в пуле
+        styles - сами пары, упорядоченные от давно запрошенных к недавно запрошенным
+        hits - сколько раз пара нашлась в пуле
+        misses - сколько раз пару пришлось создавать
+    """
+
+    def __init__(self, size):
+        super(StylePool, self).__init__()
+        self.size = size
+        self.styles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    """
+    Метод get. Возвращает пару (ручка, кисть): ручка цвета color толщиной width с видом линии style, концами cap и
+    стыками join, кисть цвета fill (None - без заливки). Значения по умолчанию те же, что у QPen(color, width).
+    """
+
+    def get(self, color, width, fill=None, style=Qt.SolidLine, cap=Qt.SquareCap, join=Qt.BevelJoin):
+        key = (QColor(color).rgba(), width, None if fill is None else QColor(fill).rgba(), style, cap, join)
+        pair = self.styles.get(key)
+        if pair is not None:
+            self.hits += 1
+            self.styles.move_to_end(key)
+            return pair
+        self.misses += 1
+        pen = QPen(QBrush(QColor(color)), width, style, cap, join)
+        pair = (pen, QBrush(Qt.NoBrush) if fill is None else QBrush(QColor(fill)))
+        self.styles[key] = pair
+        if len(self.styles) > self.size:
+            self.styles.popitem(last=False)
+        return pair
+
+    """
+    Метод stats. Возвращает состояние пула: число пар, попадания, промахи и долю попаданий.
+    """
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'styles': len(self.styles),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0}
+
+
+STYLE_POOL = StylePool(STYLE_POOL_SIZE)
+
+
+class Stroke:
+
+    """
+    Класс Stroke, он же Мазок. Базовый класс для "кистепроизводных" инструментов. Весь мазок от нажатия до отпускания
+    мыши - это один объект, который хранит точки в QPolygon (компактный массив координат на стороне Qt, а не список
+    питоновских объектов) и рисует их одной ломаной через drawPolyline. Так мазок из тысяч точек остается одним
+    объектом и одним вызовом рисования, а скругленные стыки ломаной не оставляют "швов" между отрезками. Атрибуты
+    объявлены в __slots__, как и у остальных инструментов: у объекта нет словаря атрибутов, и он занимает меньше памяти.
+
+    Параметры при инициализации экземпляра класса Stroke:
+        point - координаты первой точки
+        size - толщина
+        color - цвет
+        points - точки мазка
+        tail - последний добавленный кусок мазка: последняя точка до добавления и новые точки (см. метод drawTail)
+        paint_style - ручка и кисть мазка из пула STYLE_POOL (берутся при первом рисовании, см. метод style)
+    """
+
+    __slots__ = ('size', 'color', 'points', 'tail', 'paint_style')
+
+    def __init__(self, point, size, color):
+        super(Stroke, self).__init__()
+        self.size = size
+        self.color = color
+        self.points = QPolygon()
+        self.points.append(point)
+        self.tail = QPolygon()
+        self.paint_style = None
+
+    """
+    Метод style. Возвращает ручку и кисть, которыми рисуется мазок (кисть мазку не нужна, она пустая). Пара берется из
+    пула STYLE_POOL один раз и запоминается. Переопределяется в наследниках.
+    """
+
+    def style(self):
+        if self.paint_style is None:
+            self.paint_style = STYLE_POOL.get(self.color, self.size, cap=Qt.RoundCap, join=Qt.RoundJoin)
+        return self.paint_style
+
+    """
+    Метод addPoints. Добавляет в мазок новые точки (все, что накопились за кадр, см. Canvas.flushInput) и возвращает
+    прямоугольник, который занимают новые отрезки, чтобы холст перерисовал только его.
+    """
+
+    def addPoints(self, points):
+        self.tail = QPolygon([self.points.last()] + points)
+        for point in points:
+            self.points.append(point)
+        rect = self.tail.boundingRect()
+        return strokeRect(rect.left(), rect.top(), rect.right(), rect.bottom(), self.size)
+
+    """
+    Ранее упомянутый метод draw. Задает ручку и кисть (см. метод style) и рисует мазок методом drawShape.
+    """
+
+    def draw(self, painter):
+        pen, brush = self.style()
+        painter.setPen(pen)
+        painter.setBrush(brush)
+        self.drawShape(painter)
+
+    """
+    Метод drawShape. Рисует весь мазок одной ломаной уже заданной ручкой. Мазок из одной точки (простой клик) рисуется
+    точкой, потому что ломаная из одной точки ничего не рисует.
+    """
+
+    def drawShape(self, painter):
+        if self.points.size() == 1:
+            painter.drawPoint(self.points.first())
+        else:
+            painter.drawPolyline(self.points)
+
+    """
+    Метод drawTail. Рисует только последний добавленный кусок мазка. Пока мышь зажата, холст "запекает" мазок по
+    кусочку этим методом, поэтому цена одного кадра не зависит от длины мазка. Ручка скругленная, поэтому результат
+    совпадает с тем, что нарисует draw.
+    """
+
+    def drawTail(self, painter):
+        painter.setPen(self.style()[0])
+        painter.drawPolyline(self.tail)
+
+    """
+    Метод boundingRect. Возвращает прямоугольник, который занимает мазок на холсте, с учетом толщины ручки. По нему
+    холст понимает, какую область перерисовать, вместо того чтобы перерисовывать весь виджет.
+    """
+
+    def boundingRect(self):
+        rect = self.points.boundingRect()
+        return strokeRect(rect.left(), rect.top(), rect.right(), rect.bottom(), self.size)
+
+    """
+    Метод coords. Возвращает координаты точек мазка плоским массивом x0, y0, x1, y1, ... Массив читается прямо из
+    памяти QPolygon, без создания QPoint на каждую точку.
+    """
+
+    def coords(self):
+        data = self.points.data()
+        data.setsize(self.points.size() * 8)
+        return array('i', bytes(data))
+
+    """
+    Метод setCoords. Обратная операция: заменяет точки мазка count точками из буфера coords (int32 x0, y0, ...).
+    Байты копируются прямо в память QPolygon.
+    """
+
+    def setCoords(self, coords, count):
+        self.points = QPolygon()
+        self.points.fill(QPoint(), count)
+        data = self.points.data()
+        data.setsize(count * 8)
+        memoryview(data)[:] = memoryview(coords).cast('B')
+
+    """
+    Метод simplify. Обработка законченного мазка: если smooth задан, мазок сглаживается кривой через точки, а затем
+    точки, без которых ломаная отходит от исходной не дальше tolerance, выбрасываются (с tolerance=0 - только точки,
+    лежащие ровно на ломаной). Возвращает, на сколько точек стало меньше (со сглаживанием может выйти и больше).
+    """
+
+    def simplify(self, tolerance, smooth=False):
+        count = self.points.size()
+        if count < 3:
+            return 0
+        points = numpy.frombuffer(self.coords(), numpy.int32).reshape(-1, 2).astype(float)
+        if smooth:
+            points = smoothPoints(points[simplifyPoints(points, tolerance)], SMOOTH_STEP)
+        points = numpy.rint(points[simplifyPoints(points, tolerance)]).astype(numpy.int32)
+        self.setCoords(points, len(points))
+        return count - len(points)
+
+    """
+    Метод toDict. Возвращает описание объекта в виде словаря, который можно записать в JSON (см. dumpDocument).
+    """
+
+    def toDict(self):
+        return {'type': type(self).__name__,
+                'points': self.coords().tolist(),
+                'size': self.size,
+                'color': QColor(self.color).name(QColor.HexArgb)}
+
+
+class Brush(Stroke):
+
+    """
+    Класс Brush, он же Кисть. Самодельный класс инструмента, призванный отвечать за правильную отрисовку кисти.
+    Плавные мазки - это ломаная, проведенная через все точки, по которым прошла мышь. Плавность кисти особо не
+    меняется, а вот скорость ее прорисовки уже зависит от толщины кисти и мощности компьютера.
+
+    Параметры при инициализации экземпляра класса Brush:
+        point - координаты первой точки
+        size - толщина
+        color - цвет
+    """
+
+    __slots__ = ()
+
+    def __init__(self, point, size, color):
+        super(Brush, self).__init__(point, size, color)
+
+
+class Pencil(Stroke):
+
+    """
+    Класс Pencil, он же Карандаш. Самодельный класс инструмента, призванный отвечать за прорисовку карандаша.
+    Принцип работы схож с кистью, поэтому и наследован от класса Stroke, за исключением одного момента: у карандаша
+    установлена стандартная ручка с неизменяемой толщиной в 1 пиксель.
+
+    Параметры при инициализации экземпляра класса Pencil:
+        point - координаты первой точки
+        color - цвет
+    """
+
+    __slots__ = ()
+
+    def __init__(self, point, color):
+        super(Pencil, self).__init__(point, 1, color)
+
+    """
+    Ранее упомянутый метод style. Параметров ручки всего два: цвет и толщина в 1 пиксель.
+    """
+
+    def style(self):
+        if self.paint_style is None:
+            self.paint_style = STYLE_POOL.get(self.color, 1)
+        return self.paint_style
+
+
+class Eraser(Stroke):
+
+    """
+    Class Eraser, он же Ластик. Самодельный класс инструмента, призванный отвечать за прорисовку ластика. Принцип
+    работы схож с кистью, поэтому и наследован от класса Stroke, за исключением одного момента: у ластика установлена
+    ручка с постоянным белым цветом и толщиной больше, чем текущая, на 2 пикселя.
+
+    Параметры при инициализации экземпляра класса Eraser:
+        point - координаты первой точки
+        size - толщина
+    """
+
+    __slots__ = ()
+
+    def __init__(self, point, size):
+        super(Eraser, self).__init__(point, size + 2, QColor(Qt.white))
+
+
+class Line:
+
+    """
+    Класс Line, он же Линия. Самодельный класс инструмента, призванный отвечать за прорисовку линии. Несмотря на то, что
+    кистеподобные классы тоже рисуют линию, делают они это постоянно, в отличии от Line, который рисует одну и ту же
+    линию, обновляя ее размер и координаты по мере перемещения пользователем мыши.
+
+    Параметры при инициализации экземпляра класса Line:
+        sx - x точки начала
+        sy - y точки начала
+        ex - x точки конца
+        ey - y точки конца
+        size - толщина
+        color - цвет
+        paint_style - ручка и кисть линии из пула STYLE_POOL (см. метод style)
+    """
+
+    __slots__ = ('sx', 'sy', 'ex', 'ey', 'size', 'color', 'paint_style')
+
+    def __init__(self, sx, sy, ex, ey, size, color):
+        super(Line, self).__init__()
+        self.sx = sx
+        self.sy = sy
+        self.ex = ex
+        self.ey = ey
+        self.size = size
+        self.color = color
+        self.paint_style = None
+
+    """
+    Метод setEnd. Переносит конечную точку линии, пока пользователь тянет мышь (см. Canvas.flushInput).
+    """
+
+    def setEnd(self, x, y):
+        self.ex = x
+        self.ey = y
+
+    """
+    Ранее упомянутый метод draw. Работает как кисть, но их конструктивные особенности прописаны не в классе, а в методе
+    mouseMoveEvent, где кисть и ей подобные начинают рисовать новую линию, а линия просто обновляет конечную точку.
+    """
+
+    def draw(self, painter):
+        pen, brush = self.style()
+        painter.setPen(pen)
+        painter.setBrush(brush)
+        self.drawShape(painter)
+
+    """
+    Методы для рисования, общие для линии и фигур (см. TileStore.commitAll):
+        style - возвращает ручку и кисть объекта из пула STYLE_POOL. Пара берется один раз и запоминается: цвет,
+        толщина и заливка объекта после создания не меняются
+        drawShape - рисует объект уже заданными ручкой и кистью
+    """
+
+    def style(self):
+        if self.paint_style is None:
+            self.paint_style = STYLE_POOL.get(self.color, self.size)
+        return self.paint_style
+
+    def drawShape(self, painter):
+        painter.drawLine(self.sx, self.sy, self.ex, self.ey)
+
+    """
+    Ранее упомянутый метод boundingRect. Прямоугольник между точками начала и конца линии, расширенный на толщину.
+    """
+
+    def boundingRect(self):
+        return strokeRect(self.sx, self.sy, self.ex, self.ey, self.size)
+
+    """
+    Метод contains. Проверяет, лежит ли точка point на фигуре (с учетом толщины контура). По нему холст находит
+    верхнюю фигуру под курсором (см. Canvas.objectAt). Линия "задета", если точка не дальше половины толщины от отрезка.
+    """
+
+    def contains(self, point):
+        dx, dy = self.ex - self.sx, self.ey - self.sy
+        px, py = point.x() - self.sx, point.y() - self.sy
+        length = dx * dx + dy * dy
+        t = min(max((px * dx + py * dy) / length, 0), 1) if length else 0
+        return (px - t * dx) ** 2 + (py - t * dy) ** 2 <= (self.size / 2 + 1) ** 2
+
+    """
+    Ранее упомянутый метод toDict.
+    """
+
+    def toDict(self):
+        return {'type': 'Line',
+                'sx': self.sx, 'sy': self.sy, 'ex': self.ex, 'ey': self.ey,
+                'size': self.size,
+                'color': QColor(self.color).name(QColor.HexArgb)}
+
+
+class Circle:
+
+    """
+    Класс Circle, он же Круг. Самодельный класс инструмента, призванный отвечать за прорисовку эллипса. Реализовано
+    через прямоугольник, внутри которого встроенным методом drawEllipse рисуется эллипс
+
+    Параметры при инициализации экземпляра класса Circle:
+        sx - x точки начала
+        sy - y точки начала
+        x - x точки конца
+        y - y точки конца
+        to_fill - разрешение на заливку
+        size - толщина контура
+        color - цвет контура
+        color_2 - цвет заливки
+        paint_style - ручка и кисть фигуры из пула STYLE_POOL (см. метод style)
+    """
+
+    __slots__ = ('sx', 'sy', 'x', 'y', 'to_fill', 'size', 'color', 'color_2', 'paint_style')
+
+    def __init__(self, sx, sy, x, y, fill, size, color, color_2):
+        super(Circle, self).__init__()
+        self.sx = sx
+        self.sy = sy
+        self.x = x
+        self.y = y
+        self.to_fill = fill
+        self.size = size
+        self.color = color
+        self.color_2 = color_2
+        self.paint_style = None
+
+    """
+    Метод setEnd. Переносит точку конца фигуры, пока пользователь тянет мышь (см. Canvas.flushInput).
+    """
+
+    def setEnd(self, x, y):
+        self.x = x
+        self.y = y
+
+    """
+    Ранее упомянутый метод draw. Задает ручку и кисть (см. метод style) и методом drawShape рисует эллипс в
+    прямоугольнике с точкой начала и длиной и шириной этого прямоугольника.
+    """
+
+    def draw(self, painter):
+        pen, brush = self.style()
+        painter.setPen(pen)
+        painter.setBrush(brush)
+        self.drawShape(painter)
+
+    """
+    Ранее упомянутые методы style и drawShape (см. класс Line). Кисть у фигуры есть, только если разрешена заливка.
+    """
+
+    def style(self):
+        if self.paint_style is None:
+            self.paint_style = STYLE_POOL.get(self.color, self.size, self.color_2 if self.to_fill else None)
+        return self.paint_style
+
+    def drawShape(self, painter):
+        painter.drawEllipse(self.sx, self.sy, self.x - self.sx, self.y - self.sy)
+
+    """
+    Ранее упомянутый метод boundingRect. Фигура вписана в прямоугольник между точками начала и конца, поэтому
+    достаточно расширить его на толщину контура.
+    """
+
+    def boundingRect(self):
+        return strokeRect(self.sx, self.sy, self.x, self.y, self.size)
+
+    """
+    Ранее упомянутый метод contains (см. класс Line). Точка проверяется уравнением эллипса, раздутого на половину
+    толщины контура.
+    """
+
+    def contains(self, point):
+        rx, ry = abs(self.x - self.sx) / 2 + self.size / 2, abs(self.y - self.sy) / 2 + self.size / 2
+        dx, dy = point.x() - (self.sx + self.x) / 2, point.y() - (self.sy + self.y) / 2
+        return (dx / rx) ** 2 + (dy / ry) ** 2 <= 1 if rx and ry else False
+
+    """
+    Ранее упомянутый метод toDict.
+    """
+
+    def toDict(self):
+        return {'type': 'Circle',
+                'sx': self.sx, 'sy': self.sy, 'x': self.x, 'y': self.y,
+                'fill': self.to_fill,
+                'size': self.size,
+                'color': QColor(self.color).name(QColor.HexArgb),
+                'color_2': QColor(self.color_2).name(QColor.HexArgb)}
+
+
+class Triangle:
+
+    """
+    Класс Triangle, он же Треугольник. Самодельный класс инструмента, призванный отвечать за прорисовку треугольника.
+    Реализовано через рисование многоугольника внутри области прямоугольника по следующему правилу: левый крайний,
+    правый крайний и середина верхнего (или нижнего, в зависимости от того, куда смещена мышь по y относительно начала)
+    основания.
+
+    Параметры при инициализации экземпляра класса Triangle:
+        sx - x точки начала
+        sy - y точки начала
+        x - x точки конца
+        y - y точки конца
+        to_fill - разрешение на заливку
+        size - толщина контура
+        color - цвет контура
+        color_2 - цвет заливки
+        paint_style - ручка и кисть фигуры из пула STYLE_POOL (см. метод style)
+        corners - вершины многоугольника, посчитанные для текущих координат (см. метод polygon)
+    """
+
+    __slots__ = ('sx', 'sy', 'x', 'y', 'to_fill', 'size', 'color', 'color_2', 'paint_style', 'corners')
+
+    def __init__(self, sx, sy, x, y, fill, size, color, color_2):
+        super(Triangle, self).__init__()
+        self.sx = sx
+        self.sy = sy
+        self.x = x
+        self.y = y
+        self.to_fill = fill
+        self.size = size
+        self.color = color
+        self.color_2 = color_2
+        self.paint_style = None
+        self.corners = None
+
+    """
+    Метод setEnd. Переносит точку конца фигуры, пока пользователь тянет мышь (см. Canvas.flushInput). Вершины
+    многоугольника после этого придется посчитать заново.
+    """
+
+    def setEnd(self, x, y):
+        self.x = x
+        self.y = y
+        self.corners = None
+
+    """
+    Ранее упомянутый метод draw. Задает ручку и кисть (см. метод style) и рисует многоугольник методом drawShape.
+    """
+
+    def draw(self, painter):
+        pen, brush = self.style()
+        painter.setPen(pen)
+        painter.setBrush(brush)
+        self.drawShape(painter)
+
+    """
+    Ранее упомянутые методы style и drawShape (см. класс Line). Кисть у фигуры есть, только если разрешена заливка.
+    """
+
+    def style(self):
+        if self.paint_style is None:
+            self.paint_style = STYLE_POOL.get(self.color, self.size, self.color_2 if self.to_fill else None)
+        return self.paint_style
+
+    def drawShape(self, painter):
+        painter.drawPolygon(self.polygon())
+
+    """
+    Метод polygon. Возвращает вершины многоугольника, построенные по правилу треугольника внутри прямоугольника. Они
+    считаются только при первом рисовании после создания фигуры или после переноса ее конца (см. метод setEnd), а при
+    остальных перерисовках и при повторе истории берутся готовые.
+    """
+
+    def polygon(self):
+        if self.corners is None:
+            corners = QPolygon()
+            dist = (self.x - self.sx) // 2
+            corners.append(QPoint(self.sx, self.sy))
+            corners.append(QPoint(self.sx + dist, self.y))
+            corners.append(QPoint(self.x, self.sy))
+            self.corners = corners
+        return self.corners
+
+    """
+    Ранее упомянутый метод boundingRect. Фигура вписана в прямоугольник между точками начала и конца, поэтому
+    достаточно расширить его на толщину контура.
+    """
+
+    def boundingRect(self):
+        return strokeRect(self.sx, self.sy, self.x, self.y, self.size)
+
+    """
+    Ранее упомянутый метод contains (см. класс Line). Точка проверяется по вершинам многоугольника (см. метод polygon).
+    """
+
+    def contains(self, point):
+        return self.polygon().containsPoint(point, Qt.OddEvenFill)
+
+    """
+    Ранее упомянутый метод toDict.
+    """
+
+    def toDict(self):
+        return {'type': 'Triangle',
+                'sx': self.sx, 'sy': self.sy, 'x': self.x, 'y': self.y,
+                'fill': self.to_fill,
+                'size': self.size,
+                'color': QColor(self.color).name(QColor.HexArgb),
+                'color_2': QColor(self.color_2).name(QColor.HexArgb)}
+
+
+class Rectangle:
+
+    """
+    Класс Rectangle, он же Прямоугольник. Самодельный класс инструмента, призванный за прорисовку прямоугольника.
+    Собственно, ничего тут не поменяешь - раз уж есть встроенный метод drawRect по рисованию прямоугольника, используй
+    его.
+
+    Параметры при инициализации экземпляра класса Rectangle:
+        sx - x точки начала
+        sy - y точки начала
+        x - x точки конца
+        y - y точки конца
+        to_fill - разрешение на заливку
+        size - толщина контура
+        color - цвет контура
+        color_2 - цвет заливки
+        paint_style - ручка и кисть фигуры из пула STYLE_POOL (см. метод style)
+    """
+
+    __slots__ = ('sx', 'sy', 'x', 'y', 'to_fill', 'size', 'color', 'color_2', 'paint_style')
+
+    def __init__(self, sx, sy, x, y, fill, size, color, color_2):
+        super(Rectangle, self).__init__()
+        self.sx = sx
+        self.sy = sy
+        self.x = x
+        self.y = y
+        self.to_fill = fill
+        self.size = size
+        self.color = color
+        self.color_2 = color_2
+        self.paint_style = None
+
+    """
+    Метод setEnd. Переносит точку конца фигуры, пока пользователь тянет мышь (см. Canvas.flushInput).
+    """
+
+    def setEnd(self, x, y):
+        self.x = x
+        self.y = y
+
+    """
+    Ранее упомянутый метод draw. Задает ручку и кисть (см. метод style) и методом drawShape рисует прямоугольник
+    встроенным методом drawRect.
+    """
+
+    def draw(self, painter):
+        pen, brush = self.style()
+        painter.setPen(pen)
+        painter.setBrush(brush)
+        self.drawShape(painter)
+
+    """
+    Ранее упомянутые методы style и drawShape (см. класс Line). Кисть у фигуры есть, только если разрешена заливка.
+    """
+
+    def style(self):
+        if self.paint_style is None:
+            self.paint_style = STYLE_POOL.get(self.color, self.size, self.color_2 if self.to_fill else None)
+        return self.paint_style
+
+    def drawShape(self, painter):
+        painter.drawRect(self.sx, self.sy, self.x - self.sx, self.y - self.sy)
+
+    """
+    Ранее упомянутый метод boundingRect. Фигура вписана в прямоугольник между точками начала и конца, поэтому
+    достаточно расширить его на толщину контура.
+    """
+
+    def boundingRect(self):
+        return strokeRect(self.sx, self.sy, self.x, self.y, self.size)
+
+    """
+    Ранее упомянутый метод contains (см. класс Line). Прямоугольник с контуром и есть его boundingRect.
+    """
+
+    def contains(self, point):
+        return self.boundingRect().contains(point)
+
+    """
+    Ранее упомянутый метод toDict.
+    """
+
+    def toDict(self):
+        return {'type': 'Rectangle',
+                'sx': self.sx, 'sy': self.sy, 'x': self.x, 'y': self.y,
+                'fill': self.to_fill,
+                'size': self.size,
+                'color': QColor(self.color).name(QColor.HexArgb),
+                'color_2': QColor(self.color_2).name(QColor.HexArgb)}
+
+
+class Pentagon:
+
+    """
+    Класс Pentagon, он же Пятиугольник. Самодельный класс инструмента, призванный отвечать за прорисовку пятиугольника.
+    Реализовано через рисование многоугольника внутри области прямоугольника по следующему правилу
+    (начиная с нижней левой точки, по часовой стрелке): 19% от длины нижнего основания, 61% от длины левого края,
+    половина верхнего основания, 61% от длины правого края и 81% от длины нижнего основания. Это может показаться
+    странным, но именно так рисуется пятиугольник в MS Paint, проверено лично.
+
+    Параметры при инициализации экземпляра класса Pentagon:
+        sx - x точки начала
+        sy - y точки начала
+        x - x точки конца
+        y - y точки конца
+        to_fill - разрешение на заливку
+        size - толщина контура
+        color - цвет контура
+        color_2 - цвет заливки
+        paint_style - ручка и кисть фигуры из пула STYLE_POOL (см. метод style)
+        corners - вершины многоугольника, посчитанные для текущих координат (см. метод polygon)
+    """
+
+    __slots__ = ('sx', 'sy', 'x', 'y', 'to_fill', 'size', 'color', 'color_2', 'paint_style', 'corners')
+
+    def __init__(self, sx, sy, x, y, fill, size, color, color_2):
+        super(Pentagon, self).__init__()
+        self.sx = sx
+        self.sy = sy
+        self.x = x
+        self.y = y
+        self.to_fill = fill
+        self.size = size
+        self.color = color
+        self.color_2 = color_2
+        self.paint_style = None
+        self.corners = None
+
+    """
+    Метод setEnd. Переносит точку конца фигуры, пока пользователь тянет мышь (см. Canvas.flushInput). Вершины
+    многоугольника после этого придется посчитать заново.
+    """
+
+    def setEnd(self, x, y):
+        self.x = x
+        self.y = y
+        self.corners = None
+
+    """
+    Ранее упомянутый метод draw. Задает ручку и кисть (см. метод style) и рисует многоугольник методом drawShape.
+    """
+
+    def draw(self, painter):
+        pen, brush = self.style()
+        painter.setPen(pen)
+        painter.setBrush(brush)
+        self.drawShape(painter)
+
+    """
+    Ранее упомянутые методы style и drawShape (см. класс Line). Кисть у фигуры есть, только если разрешена заливка.
+    """
+
+    def style(self):
+        if self.paint_style is None:
+            self.paint_style = STYLE_POOL.get(self.color, self.size, self.color_2 if self.to_fill else None)
+        return self.paint_style
+
+    def drawShape(self, painter):
+        painter.drawPolygon(self.polygon())
+
+    """
+    Ранее упомянутый метод polygon (см. класс Triangle). Вершины строятся по правилу пятиугольника внутри
+    прямоугольника.
+    """
+
+    def polygon(self):
+        if self.corners is None:
+            corners = QPolygon()
+            dist_x = self.x - self.sx
+            dist_y = self.y - self.sy
+            corners.append(QPoint(self.sx + int(dist_x * 0.19), self.sy))
+            corners.append(QPoint(self.sx, self.sy + int(dist_y * 0.61)))
+            corners.append(QPoint(self.sx + dist_x // 2, self.y))
+            corners.append(QPoint(self.x, self.sy + int(dist_y * 0.61)))
+            corners.append(QPoint(self.sx + int(dist_x * 0.81), self.sy))
+            self.corners = corners
+        return self.corners
+
+    """
+    Ранее упомянутый метод boundingRect. Фигура вписана в прямоугольник между точками начала и конца, поэтому
+    достаточно расширить его на толщину контура.
+    """
+
+    def boundingRect(self):
+        return strokeRect(self.sx, self.sy, self.x, self.y, self.size)
+
+    """
+    Ранее упомянутый метод contains (см. класс Line). Точка проверяется по вершинам многоугольника (см. метод polygon).
+    """
+
+    def contains(self, point):
+        return self.polygon().containsPoint(point, Qt.OddEvenFill)
+
+    """
+    Ранее упомянутый метод toDict.
+    """
+
+    def toDict(self):
+        return {'type': 'Pentagon',
+                'sx': self.sx, 'sy': self.sy, 'x': self.x, 'y': self.y,
+                'fill': self.to_fill,
+                'size': self.size,
+                'color': QColor(self.color).name(QColor.HexArgb),
+                'color_2': QColor(self.color_2).name(QColor.HexArgb)}
+
+
+class Hexagon:
+
+    """
+    Класс Hexagon, он же Шестиугольник. Самодельный класс инструмента, призванный отвечать за прорисовку шестиугольника.
+    Реализовано через рисование многоугольника внутри области прямоугольника по следующему правилу
+    (начиная с нижней точки, по часовой стрелке): середина нижнего основания, 25% от длины левого края,
+    75% от длины левого края, середина верхнего основания, 75% от длины правого края и 25% от длины правого края.
+    Это может показаться странным, но именно так рисуется шестиугольник в MS Paint, проверено лично.
+
+    Параметры при инициализации экземпляра класса Hexagon:
+        sx - x точки начала
+        sy - y точки начала
+        x - x точки конца
+        y - y точки конца
+        to_fill - разрешение на заливку
+        size - толщина контура
+        color - цвет контура
+        color_2 - цвет заливки
+        paint_style - ручка и кисть фигуры из пула STYLE_POOL (см. метод style)
+        corners - вершины многоугольника, посчитанные для текущих координат (см. метод polygon)
+    """
+
+    __slots__ = ('sx', 'sy', 'x', 'y', 'to_fill', 'size', 'color', 'color_2', 'paint_style', 'corners')
+
+    def __init__(self, sx, sy, x, y, fill, size, color, color_2):
+        super(Hexagon, self).__init__()
+        self.sx = sx
+        self.sy = sy
+        self.x = x
+        self.y = y
+        self.to_fill = fill
+        self.size = size
+        self.color = color
+        self.color_2 = color_2
+        self.paint_style = None
+        self.corners = None
+
+    """
+    Метод setEnd. Переносит точку конца фигуры, пока пользователь тянет мышь (см. Canvas.flushInput). Вершины
+    многоугольника после этого придется посчитать заново.
+    """
+
+    def setEnd(self, x, y):
+        self.x = x
+        self.y = y
+        self.corners = None
+
+    """
+    Ранее упомянутый метод draw. Задает ручку и кисть (см. метод style) и рисует многоугольник методом drawShape.
+    """
+
+    def draw(self, painter):
+        pen, brush = self.style()
+        painter.setPen(pen)
+        painter.setBrush(brush)
+        self.drawShape(painter)
+
+    """
+    Ранее упомянутые методы style и drawShape (см. класс Line). Кисть у фигуры есть, только если разрешена заливка.
+    """
+
+    def style(self):
+        if self.paint_style is None:
+            self.paint_style = STYLE_POOL.get(self.color, self.size, self.color_2 if self.to_fill else None)
+        return self.paint_style
+
+    def drawShape(self, painter):
+        painter.drawPolygon(self.polygon())
+
+    """
+    Ранее упомянутый метод polygon (см. класс Triangle). Вершины строятся по правилу шестиугольника внутри
+    прямоугольника.
+    """
+
+    def polygon(self):
+        if self.corners is None:
+            corners = QPolygon()
+            dist_x = self.x - self.sx
+            dist_y = self.y - self.sy
+            corners.append(QPoint(self.sx + dist_x // 2, self.sy))
+            corners.append(QPoint(self.sx, self.sy + int(dist_y * 0.25)))
+            corners.append(QPoint(self.sx, self.sy + int(dist_y * 0.75)))
+            corners.append(QPoint(self.sx + dist_x // 2, self.y))
+            corners.append(QPoint(self.x, self.sy + int(dist_y * 0.75)))
+            corners.append(QPoint(self.x, self.sy + int(dist_y * 0.25)))
+            self.corners = corners
+        return self.corners
+
+    """
+    Ранее упомянутый метод boundingRect. Фигура вписана в прямоугольник между точками начала и конца, поэтому
+    достаточно расширить его на толщину контура.
+    """
+
+    def boundingRect(self):
+        return strokeRect(self.sx, self.sy, self.x, self.y, self.size)
+
+    """
+    Ранее упомянутый метод contains (см. класс Line). Точка проверяется по вершинам многоугольника (см. метод polygon).
+    """
+
+    def contains(self, point):
+        return self.polygon().containsPoint(point, Qt.OddEvenFill)
+
+    """
+    Ранее упомянутый метод toDict.
+    """
+
+    def toDict(self):
+        return {'type': 'Hexagon',
+                'sx': self.sx, 'sy': self.sy, 'x': self.x, 'y': self.y,
+                'fill': self.to_fill,
+                'size': self.size,
+                'color': QColor(self.color).name(QColor.HexArgb),
+                'color_2': QColor(self.color_2).name(QColor.HexArgb)}
+
+
+class Octagon:
+
+    """
+    Класс Octagon, он же Восьмиугольник. Самодельный класс инструмента, призванный отвечать за прорисовку
+    восьмиугольника. Реализовано через рисование многоугольника внутри области прямоугольника по следующему правилу
+    (начиная с нижней левой точки, по часовой стрелке): 25% от длины нижнего основания, 25% от длины левого края,
+    75% от длины левого края, 25% от длины верхнего основания, 75% от длины верхнего основания,
+    75% от длины правого края, 25% от длины правого края и 75% от длины нижнего основания. Это может показаться
+    странным, но именно так рисуется восьмиугольник в MS Paint, проверено лично.
+
+    Параметры при инициализации экземпляра класса Octagon:
+        sx - x точки начала
+        sy - y точки начала
+        x - x точки конца
+        y - y точки конца
+        to_fill - разрешение на заливку
+        size - толщина контура
+        color - цвет контура
+        color_2 - цвет заливки
+        paint_style - ручка и кисть фигуры из пула STYLE_POOL (см. метод style)
+        corners - вершины многоугольника, посчитанные для текущих координат (см. метод polygon)
+    """
+
+    __slots__ = ('sx', 'sy', 'x', 'y', 'to_fill', 'size', 'color', 'color_2', 'paint_style', 'corners')
+
+    def __init__(self, sx, sy, x, y, fill, size, color, color_2):
+        super(Octagon, self).__init__()
+        self.sx = sx
+        self.sy = sy
+        self.x = x
+        self.y = y
+        self.to_fill = fill
+        self.size = size
+        self.color = color
+        self.color_2 = color_2
+        self.paint_style = None
+        self.corners = None
+
+    """
+    Метод setEnd. Переносит точку конца фигуры, пока пользователь тянет мышь (см. Canvas.flushInput). Вершины
+    многоугольника после этого придется посчитать заново.
+    """
+
+    def setEnd(self, x, y):
+        self.x = x
+        self.y = y
+        self.corners = None
+
+    """
+    Ранее упомянутый метод draw. Задает ручку и кисть (см. метод style) и рисует многоугольник методом drawShape.
+    """
+
+    def draw(self, painter):
+        pen, brush = self.style()
+        painter.setPen(pen)
+        painter.setBrush(brush)
+        self.drawShape(painter)
+
+    """
+    Ранее упомянутые методы style и drawShape (см. класс Line). Кисть у фигуры есть, только если разрешена заливка.
+    """
+
+    def style(self):
+        if self.paint_style is None:
+            self.paint_style = STYLE_POOL.get(self.color, self.size, self.color_2 if self.to_fill else None)
+        return self.paint_style
+
+    def drawShape(self, painter):
+        painter.drawPolygon(self.polygon())
+
+    """
+    Ранее упомянутый метод polygon (см. класс Triangle). Вершины строятся по правилу восьмиугольника внутри
+    прямоугольника.
+    """
+
+    def polygon(self):
+        if self.corners is None:
+            corners = QPolygon()
+            dist_x = self.x - self.sx
+            dist_y = self.y - self.sy
+            corners.append(QPoint(self.sx + int(dist_x * 0.25), self.sy))
+            corners.append(QPoint(self.sx, self.sy + int(dist_y * 0.25)))
+            corners.append(QPoint(self.sx, self.sy + int(dist_y * 0.75)))
+            corners.append(QPoint(self.sx + int(dist_x * 0.25), self.y))
+            corners.append(QPoint(self.sx + int(dist_x * 0.75), self.y))
+            corners.append(QPoint(self.x, self.sy + int(dist_y * 0.75)))
+            corners.append(QPoint(self.x, self.sy + int(dist_y * 0.25)))
+            corners.append(QPoint(self.sx + int(dist_x * 0.75), self.sy))
+            self.corners = corners
+        return self.corners
+
+    """
+    Ранее упомянутый метод boundingRect. Фигура вписана в прямоугольник между точками начала и конца, поэтому
+    достаточно расширить его на толщину контура.
+    """
+
+    def boundingRect(self):
+        return strokeRect(self.sx, self.sy, self.x, self.y, self.size)
+
+    """
+    Ранее упомянутый метод contains (см. класс Line). Точка проверяется по вершинам многоугольника (см. метод polygon).
+    """
+
+    def contains(self, point):
+        return self.polygon().containsPoint(point, Qt.OddEvenFill)
+
+    """
+    Ранее упомянутый метод toDict.
+    """
+
+    def toDict(self):
+        return {'type': 'Octagon',
+                'sx': self.sx, 'sy': self.sy, 'x': self.x, 'y': self.y,
+                'fill': self.to_fill,
+                'size': self.size,
+                'color': QColor(self.color).name(QColor.HexArgb),
+                'color_2': QColor(self.color_2).name(QColor.HexArgb)}
+
+
+class Fill:
+
+    """
+    Класс Fill, он же Заливка. Самодельный класс инструмента, призванный отвечать за заливку всего холста.
+    По сути, рисует прямоугольник с заливкой во весь холст.
+
+    Параметры при инициализации экземпляра класса Fill:
+        w - ширина
+        h - высота
+        color - цвет заливки
+    """
+
+    __slots__ = ('w', 'h', 'color')
+
+    def __init__(self, w, h, color):
+        super(Fill, self).__init__()
+        self.w = w
+        self.h = h
+        self.color = color
+
+    """
+    Ранее упомянутый метод draw. Задает ручку и кисть одного и того же цвета и рисует прямоугольник от начала холста
+    до его конца.
+    """
+
+    def draw(self, painter):
+        pen, brush = STYLE_POOL.get(self.color, 1, self.color)
+        painter.setPen(pen)
+        painter.setBrush(brush)
+        painter.drawRect(0, 0, self.w, self.h)
+
+    """
+    Ранее упомянутый метод boundingRect. Заливка занимает весь холст.
+    """
+
+    def boundingRect(self):
+        return QRect(0, 0, self.w + 1, self.h + 1)
+
+    """
+    Метод covers. Проверяет, закрывает ли заливка прямоугольник rect целиком. Заливка всегда непрозрачная, так что
+    если закрывает, все нарисованное под ней можно выбросить.
+    """
+
+    def covers(self, rect):
+        return QRect(0, 0, self.w, self.h).contains(rect)
+
+    """
+    Ранее упомянутый метод toDict.
+    """
+
+    def toDict(self):
+        return {'type': 'Fill', 'w': self.w, 'h': self.h, 'color': QColor(self.color).name(QColor.HexArgb)}
+
+
+"""
+Функции заливки области. Работают прямо с памятью плиток через NumPy, без копирования холста в один массив:
+    imagePixels - возвращает пиксели картинки формата RGB32 как двумерный массив uint32 (строки x столбцы), который
+    смотрит в память картинки. Если writable не задан, массив только для чтения: так плитка, общая с копией
+    хранилища (см. TileStore.copy), не отделяется и не копируется зря
+    tileShape - размер части плитки key, которая лежит в пределах холста store (у края холста часть меньше плитки):
+    строки и столбцы
+    tilePixels - возвращает пиксели плитки key хранилища store в пределах холста, или None, если плитка не создана
+    (тогда все ее пиксели - цвет фона)
+    similarPixels - возвращает булеву маску пикселей, цвет которых отличается от seed не больше чем на tolerance по
+    каждому каналу (альфа-канал не учитывается)
+    rangeIndices - для массивов начал lows и длин counts возвращает подряд все номера lows[i], lows[i] + 1, ...,
+    lows[i] + counts[i] - 1 (отрицательные длины считаются нулевыми)
+    floodSpans - заливает область от точки (x, y) по плиткам store (см. класс FloodTile): начинает с плитки под
+    точкой, а когда залитые отрезки доходят до края плитки, продолжает в соседней плитке с пикселей, которые к ним
+    прилегают. Маски считаются только для плиток, до которых дошла заливка. Возвращает словарь FloodTile по номерам
+    плиток
+"""
+
+
+def imagePixels(image, writable=False):
+    pointer = image.bits() if writable else image.constBits()
+    pointer.setsize(image.sizeInBytes())
+    return numpy.frombuffer(pointer, numpy.uint32).reshape(image.height(), image.bytesPerLine() // 4)
+
+
+def tileShape(store, key):
+    return min(TILE_SIZE, store.height - key[1] * TILE_SIZE), min(TILE_SIZE, store.width - key[0] * TILE_SIZE)
+
+
+def tilePixels(store, key):
+    tile = store.tiles.get(key)
+    if tile is None:
+        return None
+    height, width = tileShape(store, key)
+    return imagePixels(tile)[:height, :width]
+
+
+def similarPixels(pixels, seed, tolerance):
+    if tolerance <= 0:
+        return (pixels & 0xFFFFFF) == seed
+    channels = pixels.view(numpy.uint8).reshape(pixels.shape + (4,))
+    mask = None
+    shifted = numpy.empty(pixels.shape, numpy.uint8)
+    for channel in range(3):
+        value = (seed >> (8 * channel)) & 0xFF
+        low, high = max(value - tolerance, 0), min(value + tolerance, 0xFF)
+        if low == 0 and high == 0xFF:
+            continue
+        numpy.subtract(channels[..., channel], low, out=shifted, dtype=numpy.uint8)
+        if mask is None:
+            mask = shifted <= high - low
+        else:
+            mask &= shifted <= high - low
+    return numpy.ones(pixels.shape, bool) if mask is None else mask
+
+
+def rangeIndices(lows, counts):
+    counts = numpy.maximum(counts, 0)
+    return numpy.repeat(lows - numpy.cumsum(counts) + counts, counts) + numpy.arange(counts.sum())
+
+
+def floodSpans(store, x, y, tolerance):
+    key = (x // TILE_SIZE, y // TILE_SIZE)
+    pixels = tilePixels(store, key)
+    seed = (store.background.rgb() if pixels is None else int(pixels[y % TILE_SIZE, x % TILE_SIZE])) & 0xFFFFFF
+    background = bool(similarPixels(numpy.array([store.background.rgb()], numpy.uint32), seed, tolerance)[0])
+    floods = {}
+    work = {key: [numpy.array([(y % TILE_SIZE) * tileShape(store, key)[1] + x % TILE_SIZE])]}
+    while work:
+        key = next(iter(work))
+        entries = work.pop(key)
+        flood = floods.get(key)
+        if flood is None:
+            height, width = tileShape(store, key)
+            pixels = tilePixels(store, key)
+            if pixels is None:
+                mask = numpy.full(height * width, background)
+            else:
+                mask = similarPixels(pixels, seed, tolerance).reshape(-1)
+            flood = floods[key] = FloodTile(mask, width)
+        fresh = flood.spread(flood.enter(numpy.concatenate(entries)))
+        if not fresh.size:
+            continue
+        marked = numpy.zeros(flood.starts.size + 1, bool)
+        marked[fresh] = True
+        tx, ty = key
+        for near, ids in zip(((tx, ty - 1), (tx, ty + 1), (tx - 1, ty), (tx + 1, ty)), flood.sides):
+            if not (0 <= near[0] * TILE_SIZE < store.width and 0 <= near[1] * TILE_SIZE < store.height):
+                continue
+            edge = numpy.flatnonzero(marked[ids])
+            if not edge.size:
+                continue
+            height, width = tileShape(store, near)
+            if near[0] == tx:
+                work.setdefault(near, []).append(edge + (0 if near[1] > ty else (height - 1) * width))
+            else:
+                work.setdefault(near, []).append(edge * width + (0 if near[0] > tx else width - 1))
+    return floods
+
+
+class FloodTile:
+
+    """
+    Класс FloodTile, он же Заливка плитки. Самодельный служебный класс, который ведет заливку области в одной плитке
+    построчно (span-based scanline). Маска похожих пикселей плитки разбивается на отрезки подряд идущих похожих
+    пикселей в каждой строке, а отрезки, которые перекрываются с отрезками строки выше, объединяются в связные
+    области. Все это делается векторно, без обхода отрезков по одному в Python. Отрезки хранятся в "плоских" номерах
+    пикселей плитки (строка * ширина + столбец), конец не включительно. Заливка может заходить в плитку несколько раз
+    (с разных краев), поэтому залитые отрезки запоминаются. Если похожа вся плитка (например, несозданная плитка
+    фона), отрезки - это просто строки, а область одна на всю плитку.
+
+    Параметры при инициализации экземпляра класса FloodTile:
+        mask - "плоская" маска похожих пикселей плитки в пределах холста
+        width - ширина плитки в пределах холста
+        height - высота плитки в пределах холста
+        whole - похожа ли вся плитка
+        starts, ends - начала и концы отрезков похожих пикселей
+        runs, similar - длины всех отрезков строк плитки (и похожих, и непохожих пикселей) и какие из них похожи. Для
+        похожей целиком плитки - None
+        sides - номера отрезков под пикселями верхнего, нижнего, левого и правого края плитки (по порядку пикселей
+        края). Под непохожим пикселем - число отрезков
+        labels - номер связной области каждого отрезка (наименьший номер отрезка в ней) или None, пока области не
+        нужны (см. метод label)
+        seen - какие отрезки уже залиты (по байту на отрезок)
+        view - seen в виде массива NumPy (смотрит в ту же память)
+    """
+
+    def __init__(self, mask, width):
+        super(FloodTile, self).__init__()
+        self.mask = mask
+        self.width = width
+        self.height = mask.size // width
+        self.whole = bool(mask.all())
+        if self.whole:
+            self.starts = numpy.arange(0, mask.size, width)
+            self.ends = self.starts + width
+            self.runs = self.similar = None
+        else:
+            change = numpy.empty(mask.size, bool)
+            change[0] = True
+            numpy.not_equal(mask[1:], mask[:-1], out=change[1:])
+            change[::width] = True
+            bounds = numpy.flatnonzero(change)
+            self.similar = mask[bounds]
+            nexts = numpy.append(bounds[1:], mask.size)
+            self.runs = nexts - bounds
+            self.starts = bounds[self.similar]
+            self.ends = nexts[self.similar]
+        columns, rows = numpy.arange(width), numpy.arange(self.height) * width
+        edges = numpy.concatenate((columns, columns + rows[-1], rows, rows + width - 1))
+        ids = numpy.searchsorted(self.starts, edges, side='right') - 1
+        ids[~mask[edges]] = self.starts.size
+        self.sides = (ids[:width], ids[width:2 * width], ids[2 * width:-self.height], ids[-self.height:])
+        self.labels = None
+        self.seen = bytearray(self.starts.size)
+        self.view = numpy.frombuffer(self.seen, numpy.uint8)
+
+    """
+    Методы заливки:
+        enter - возвращает номера еще не залитых отрезков под пикселями positions ("плоские" номера): с этих пикселей
+        заливка заходит в плитку
+        spread - заливает отрезки indices и все связанные с ними отрезки плитки, которые еще не залиты. Возвращает
+        массив номеров отрезков, залитых только что
+        label - делит отрезки на связные области: каждый отрезок связывается с перекрывающимися отрезками строки выше,
+        а затем области сливаются (меньший номер области побеждает) и номера сокращаются до корня, пока связанные
+        отрезки не получат один номер. Обычно хватает нескольких проходов
+        filled - булев массив, какие отрезки залиты
+        painted - "плоская" маска залитых пикселей плитки
+    """
+
+    def enter(self, positions):
+        positions = positions[self.mask[positions]]
+        indices = numpy.searchsorted(self.starts, positions, side='right') - 1
+        return indices[self.view[indices] == 0]
+
+    def spread(self, indices):
+        if not indices.size:
+            return indices
+        if self.whole:
+            fresh = numpy.flatnonzero(self.view == 0)
+        else:
+            if self.labels is None:
+                self.label()
+            hit = numpy.zeros(self.starts.size, bool)
+            hit[self.labels[indices]] = True
+            fresh = numpy.flatnonzero(hit[self.labels] & (self.view == 0))
+        self.view[fresh] = 1
+        return fresh
+
+    def label(self):
+        lows = numpy.searchsorted(self.ends, self.starts - self.width, side='right')
+        counts = numpy.searchsorted(self.starts, self.ends - self.width, side='left') - lows
+        lower = numpy.repeat(numpy.arange(self.starts.size), counts)
+        upper = rangeIndices(lows, counts)
+        labels = numpy.arange(self.starts.size)
+        while True:
+            roots, near = labels[lower], labels[upper]
+            differ = roots != near
+            if not differ.any():
+                break
+            numpy.minimum.at(labels, numpy.maximum(roots, near)[differ], numpy.minimum(roots, near)[differ])
+            while True:
+                jumped = labels[labels]
+                if (jumped == labels).all():
+                    break
+                labels = jumped
+        self.labels = labels
+
+    def filled(self):
+        return numpy.frombuffer(self.seen, bool)
+
+    def painted(self):
+        filled = self.filled()
+        if filled.all():
+            return self.mask
+        runs = numpy.zeros(self.runs.size, bool)
+        runs[self.similar] = filled
+        return numpy.repeat(runs, self.runs)
+
+
+class Bucket:
+
+    """
+    Класс Bucket, он же Заливка области. Самодельный класс инструмента, призванный отвечать за заливку одноцветной
+    области, как "ведро с краской" в других редакторах. В отличие от остальных инструментов, результат зависит от того,
+    что уже нарисовано, поэтому рисует он не "рисовальщиком", а по пикселям холста (см. метод apply). Область ищется
+    по плиткам (см. функцию floodSpans), и каждая плитка, до которой дошла заливка, заливается прямо в своей памяти:
+    холст целиком никуда не копируется, а плитки, которых заливка не коснулась, не читаются вовсе. Плитка, похожая и
+    залитая целиком (например, несозданная плитка фона), просто заливается цветом. Остальные плитки заливаются по маске
+    залитых пикселей: если залиты все похожие пиксели плитки, это просто маска похожих, а иначе маска собирается из
+    длин отрезков (см. метод painted класса FloodTile), без обхода отрезков по одному.
+
+    Параметры при инициализации экземпляра класса Bucket:
+        x, y - точка, с которой начинается заливка
+        color - цвет заливки
+        tolerance - допуск: насколько цвет пикселя может отличаться от цвета в точке (x, y) по каждому каналу
+        rect - прямоугольник залитой области (пустой, пока заливка не применена)
+    """
+
+    def __init__(self, x, y, color, tolerance=BUCKET_TOLERANCE):
+        super(Bucket, self).__init__()
+        self.x = x
+        self.y = y
+        self.color = color
+        self.tolerance = tolerance
+        self.rect = QRect()
+
+    """
+    Метод apply. Заливает область в плитках store. Если точка за пределами холста, ничего не делает.
+    """
+
+    def apply(self, store):
+        self.rect = QRect()
+        if not store.rect().contains(self.x, self.y):
+            return
+        color = QColor(self.color)
+        for key, flood in floodSpans(store, self.x, self.y, self.tolerance).items():
+            filled = flood.filled()
+            count = numpy.count_nonzero(filled)
+            if not count:
+                continue
+            store.dirty.add(key)
+            rows, lefts = numpy.divmod(flood.starts, flood.width)
+            rights = lefts + (flood.ends - flood.starts)
+            if flood.whole and flood.height == flood.width == TILE_SIZE:
+                store.fillTile(key, color)
+            else:
+                pixels = imagePixels(store.tile(key), True)[:flood.height, :flood.width]
+                numpy.copyto(pixels, numpy.uint32(color.rgb()), where=flood.painted().reshape(pixels.shape))
+            rows, lefts, rights = rows[filled], lefts[filled], rights[filled]
+            x, y = key[0] * TILE_SIZE, key[1] * TILE_SIZE
+            self.rect |= QRect(QPoint(x + int(lefts.min()), y + int(rows.min())),
+                               QPoint(x + int(rights.max()) - 1, y + int(rows.max())))
+
+    """
+    Ранее упомянутый метод boundingRect. Область заливки известна только после того, как заливка применена.
+    """
+
+    def boundingRect(self):
+        return QRect(self.rect)
+
+    """
+    Ранее упомянутый метод toDict.
+    """
+
+    def toDict(self):
+        return {'type': 'Bucket', 'x': self.x, 'y': self.y, 'color': QColor(self.color).name(QColor.HexArgb),
+                'tolerance': self.tolerance}
+
+
+"""
+Реестр инструментов. Каждый инструмент - класс-наследник Tool, зарегистрированный декоратором registerTool под своим
+именем в словаре TOOLS. Холст создает выбранный инструмент по имени (см. Canvas.setTool) и передает ему нажатия,
+движения и отпускания мыши напрямую, без перебора имен. Чтобы добавить инструмент, достаточно объявить и
+зарегистрировать класс: обработчики мыши холста при этом не меняются.
+"""
+
+TOOLS = {}
+
+
+def registerTool(name):
+    def register(cls):
+        TOOLS[name] = cls
+        return cls
+    return register
+
+
+class Tool:
+
+    """
+    Класс Tool, он же Инструмент. Базовый класс инструментов холста. Методы press, move и release вызываются холстом
+    при нажатии, движении (раз в кадр, со всеми точками за кадр, см. Canvas.flushInput) и отпускании мыши. Координаты
+    уже переведены в координаты холста. По умолчанию инструмент ничего не делает.
+
+    Параметры при инициализации экземпляра класса Tool:
+        canvas - холст, на котором работает инструмент
+        color - активный цвет (цвет 1 или цвет 2, смотря что выбрано)
+        color_2 - второй цвет (например, цвет заливки фигур)
+    Цвета задает холст методом setColors при выборе инструмента и при каждой смене цвета.
+    """
+
+    def __init__(self, canvas):
+        super(Tool, self).__init__()
+        self.canvas = canvas
+        self.color = None
+        self.color_2 = None
+
+    """
+    Метод setColors. Запоминает активный цвет color и второй цвет color_2. Новые объекты инструмент создает уже с ними.
+    """
+
+    def setColors(self, color, color_2):
+        self.color = color
+        self.color_2 = color_2
+
+    """
+    Метод press. Срабатывает при нажатии мыши в точке point.
+    """
+
+    def press(self, point):
+        pass
+
+    """
+    Метод move. Срабатывает раз в кадр, пока мышь движется с зажатой кнопкой. points - все точки за кадр по порядку,
+    последняя - где мышь сейчас.
+    """
+
+    def move(self, points):
+        pass
+
+    """
+    Метод release. Срабатывает при отпускании мыши.
+    """
+
+    def release(self):
+        pass
+
+
+class StrokeTool(Tool):
+
+    """
+    Класс StrokeTool. Общий класс "кистепроизводных" инструментов: нажатие начинает мазок класса stroke, движения
+    добавляют в него точки, отпускание заканчивает его. Конструкторы мазков принимают разные параметры, поэтому
+    наследник перечисляет в arguments, что передать после начальной точки: 'size' - текущую толщину холста, 'color' -
+    активный цвет.
+    """
+
+    stroke = None
+    arguments = ('size', 'color')
+
+    """
+    Метод make. Создает мазок класса stroke, начатый в точке point.
+    """
+
+    def make(self, point):
+        values = {'size': self.canvas.lineSize, 'color': self.color}
+        return self.stroke(point, *(values[name] for name in self.arguments))
+
+    """
+    Ранее упомянутый метод press. Начинает на холсте новый мазок (см. Canvas.startStroke).
+    """
+
+    def press(self, point):
+        self.canvas.startStroke(self.make(point))
+
+    """
+    Ранее упомянутый метод move. Добавляет к мазку все точки за кадр разом (см. Canvas.extendStroke).
+    """
+
+    def move(self, points):
+        self.canvas.extendStroke(points)
+
+    """
+    Ранее упомянутый метод release. Заканчивает и "запекает" мазок (см. Canvas.endStroke).
+    """
+
+    def release(self):
+        self.canvas.endStroke()
+
+
+@registerTool('brush')
+class BrushTool(StrokeTool):
+
+    """
+    Класс BrushTool. Кисть: мазок текущей толщины активным цветом.
+    """
+
+    stroke = Brush
+
+
+@registerTool('pencil')
+class PencilTool(StrokeTool):
+
+    """
+    Класс PencilTool. Карандаш: мазок толщиной в 1 пиксель активным цветом, толщина холста не учитывается.
+    """
+
+    stroke = Pencil
+    arguments = ('color',)
+
+
+@registerTool('eraser')
+class EraserTool(StrokeTool):
+
+    """
+    Класс EraserTool. Ластик: белый мазок текущей толщины, цвета не учитываются.
+    """
+
+    stroke = Eraser
+    arguments = ('size',)
+
+
+"""
+Инструменты заливки. Работают одним нажатием: заливка закрашивает весь холст, заливка области - область под курсором
+(с допуском холста, см. Canvas.setTolerance).
+"""
+
+
+@registerTool('fill')
+class FillTool(Tool):
+
+    """
+    Класс FillTool. Заливка всего холста активным цветом.
+    """
+
+    """
+    Ранее упомянутый метод press. Добавляет заливку размером с холст, где бы ни нажали.
+    """
+
+    def press(self, point):
+        self.canvas.addObject(Fill(self.canvas.store.width, self.canvas.store.height, self.color))
+
+
+@registerTool('bucket')
+class BucketTool(Tool):
+
+    """
+    Класс BucketTool. Заливка области активным цветом.
+    """
+
+    """
+    Ранее упомянутый метод press. Добавляет заливку области, начатую в точке нажатия, с допуском холста.
+    """
+
+    def press(self, point):
+        self.canvas.addObject(Bucket(point.x(), point.y(), self.color, self.canvas.tolerance))
+
+
+class ShapeTool(Tool):
+
+    """
+    Класс ShapeTool. Общий класс фигур: нажатие создает фигуру класса shape нулевого размера с активным цветом контура и
+    вторым цветом заливки, движения тянут ее конец за мышью, отпускание "запекает" ее.
+    """
+
+    shape = None
+
+    """
+    Метод make. Создает фигуру класса shape нулевого размера в точке point с заливкой и толщиной холста.
+    """
+
+    def make(self, point):
+        return self.shape(point.x(), point.y(), point.x(), point.y(), self.canvas.fill, self.canvas.lineSize,
+                          self.color, self.color_2)
+
+    """
+    Ранее упомянутый метод press. Начинает на холсте новую фигуру (см. Canvas.startObject).
+    """
+
+    def press(self, point):
+        self.canvas.startObject(self.make(point))
+
+    """
+    Ранее упомянутый метод move. Тянет конец фигуры в последнюю точку кадра: промежуточные точки фигуре не нужны.
+    """
+
+    def move(self, points):
+        self.canvas.stretchObject(points[-1])
+
+    """
+    Ранее упомянутый метод release. Заканчивает и "запекает" фигуру (см. Canvas.endObject).
+    """
+
+    def release(self):
+        self.canvas.endObject()
+
+
+@registerTool('line')
+class LineTool(ShapeTool):
+
+    """
+    Класс LineTool. Линия: у нее нет заливки и второго цвета, поэтому make свой.
+    """
+
+    """
+    Ранее упомянутый метод make. Создает линию нулевой длины в точке point с толщиной холста и активным цветом.
+    """
+
+    def make(self, point):
+        return Line(point.x(), point.y(), point.x(), point.y(), self.canvas.lineSize, self.color)
+
+
+@registerTool('circle')
+class CircleTool(ShapeTool):
+
+    """
+    Класс CircleTool. Круг (эллипс), вписанный в прямоугольник от точки нажатия до мыши.
+    """
+
+    shape = Circle
+
+
+@registerTool('rectangle')
+class RectangleTool(ShapeTool):
+
+    """
+    Класс RectangleTool. Прямоугольник от точки нажатия до мыши.
+    """
+
+    shape = Rectangle
+
+
+@registerTool('triangle')
+class TriangleTool(ShapeTool):
+
+    """
+    Класс TriangleTool. Треугольник, вписанный в прямоугольник от точки нажатия до мыши.
+    """
+
+    shape = Triangle
+
+
+@registerTool('5gon')
+class PentagonTool(ShapeTool):
+
+    """
+    Класс PentagonTool. Пятиугольник, вписанный в прямоугольник от точки нажатия до мыши.
+    """
+
+    shape = Pentagon
+
+
+@registerTool('6gon')
+class HexagonTool(ShapeTool):
+
+    """
+    Класс HexagonTool. Шестиугольник, вписанный в прямоугольник от точки нажатия до мыши.
+    """
+
+    shape = Hexagon
+
+
+@registerTool('8gon')
+class OctagonTool(ShapeTool):
+
+    """
+    Класс OctagonTool. Восьмиугольник, вписанный в прямоугольник от точки нажатия до мыши.
+    """
+
+    shape = Octagon
+
+
+"""
+Фильтры холста. Каждый фильтр - функция, которая берет полосу пикселей source (массив uint32, строки x столбцы,
+формат RGB32) и записывает результат в полосу target. Фильтрам, которым нужны соседние пиксели (размытие, резкость),
+source передается шире target на halo строк сверху и снизу (см. метод Filter.halo). Остальные фильтры работают "по
+точкам" (halo = 0) и могут писать прямо в source. Параметры value и value_2 у каждого фильтра свои:
+    invertPixels - негатив, параметров нет
+    grayscalePixels - оттенки серого (яркость 0.299 R + 0.587 G + 0.114 B в целых числах), параметров нет
+    levelPixels - яркость value (-255..255) и контраст value_2 (в процентах, -100..100), через таблицу на 256 значений
+    blurPixels - размытие квадратным окном радиуса value
+    sharpenPixels - резкость: к пикселю добавляется его отличие от размытого с радиусом 1, умноженное на value процентов
+Служебные функции:
+    pixelChannels - смотрит на массив uint32 как на массив байтов B, G, R, A (последнее измерение - канал)
+    boxSums - суммы по квадратному окну радиуса radius для каждого канала R, G, B (плюс половина площади окна, чтобы
+    после деления на площадь среднее округлилось). Окно считается раздельно по столбцам и по строкам через накопленные
+    суммы, поэтому время не зависит от радиуса. Накопленные суммы по столбцам считаются построчным циклом: numpy.cumsum
+    вдоль первой оси в разы медленнее. Возвращает массив на radius строк короче source сверху и снизу
+    filterBands - режет картинку pixels на полосы по строкам и отдает их фильтру function в пуле потоков FILTER_POOL.
+    NumPy отпускает GIL на время вычислений, поэтому полосы действительно обрабатываются параллельно. У краев
+    картинки недостающие соседние строки повторяют крайнюю строку
+    rectPixels - копирует прямоугольник rect холста store из плиток в один массив (вместо несозданных плиток - цвет
+    фона)
+    writePixels - переписывает массив pixels в плитки store, начиная с точки point, и помечает их измененными.
+    Несозданная плитка, в которую пишется только цвет фона background, так и не создается
+    samplePixels - уменьшает холст store в scale раз, беря каждый scale-й пиксель каждой плитки (вместо несозданных
+    плиток - цвет фона). Холст целиком никуда не копируется
+"""
+
+FILTER_POOL = ThreadPoolExecutor(max_workers=FILTER_THREADS)
+
+
+def pixelChannels(pixels):
+    return pixels.view(numpy.uint8).reshape(pixels.shape + (4,))
+
+
+def invertPixels(source, target, value, value_2):
+    numpy.bitwise_xor(source, 0x00FFFFFF, out=target)
+
+
+def grayscalePixels(source, target, value, value_2):
+    rgb = pixelChannels(source)
+    luma = numpy.multiply(rgb[..., 2], 77, dtype=numpy.uint16)
+    luma += numpy.multiply(rgb[..., 1], 150, dtype=numpy.uint16)
+    luma += numpy.multiply(rgb[..., 0], 29, dtype=numpy.uint16)
+    luma >>= 8
+    numpy.multiply(luma, 0x010101, out=target, dtype=numpy.uint32)
+    target |= 0xFF000000
+
+
+def levelPixels(source, target, value, value_2):
+    table = (numpy.arange(256) - 128) * ((100 + value_2) / 100) + 128 + value
+    table = numpy.clip(table, 0, 255).astype(numpy.uint8)
+    numpy.take(table, pixelChannels(source), out=pixelChannels(target))
+    target |= 0xFF000000
+
+
+def boxSums(source, radius):
+    size = 2 * radius + 1
+    data = pixelChannels(source)[..., :3]
+    total = numpy.zeros((data.shape[0] + 1,) + data.shape[1:], numpy.int32)
+    for row in range(data.shape[0]):
+        numpy.add(total[row], data[row], out=total[row + 1])
+    data = numpy.pad(total[size:] - total[:-size], ((0, 0), (radius, radius), (0, 0)), mode='edge')
+    total = numpy.zeros((data.shape[0], data.shape[1] + 1, 3), numpy.int32)
+    numpy.cumsum(data, axis=1, out=total[:, 1:])
+    data = total[:, size:] - total[:, :-size]
+    data += size * size // 2
+    return data
+
+
+def blurPixels(source, target, value, value_2):
+    rgb = pixelChannels(target)
+    numpy.floor_divide(boxSums(source, value), (2 * value + 1) ** 2, out=rgb[..., :3], casting='unsafe')
+    rgb[..., 3] = 255
+
+
+def sharpenPixels(source, target, value, value_2):
+    center = pixelChannels(source)[1:-1, :, :3].astype(numpy.int32)
+    center += (center - boxSums(source, 1) // 9) * value // 100
+    rgb = pixelChannels(target)
+    rgb[..., :3] = numpy.clip(center, 0, 255)
+    rgb[..., 3] = 255
+
+
+def filterBands(pixels, target, function, halo, value, value_2):
+    height = pixels.shape[0]
+    band = max(-(-height // (FILTER_THREADS * 2)), FILTER_BAND)
+    jobs = []
+    for top in range(0, height, band):
+        bottom = min(top + band, height)
+        low, high = max(top - halo, 0), min(bottom + halo, height)
+        source = pixels[low:high]
+        if halo and (top - low < halo or high - bottom < halo):
+            source = numpy.pad(source, ((halo - top + low, halo - high + bottom), (0, 0)), mode='edge')
+        jobs.append(FILTER_POOL.submit(function, source, target[top:bottom], value, value_2))
+    for job in jobs:
+        job.result()
+
+
+def rectPixels(store, rect):
+    pixels = numpy.empty((rect.height(), rect.width()), numpy.uint32)
+    for key in store.keys(rect):
+        x, y = key[0] * TILE_SIZE, key[1] * TILE_SIZE
+        left, top = max(rect.left(), x), max(rect.top(), y)
+        right, bottom = min(rect.right() + 1, x + TILE_SIZE), min(rect.bottom() + 1, y + TILE_SIZE)
+        block = pixels[top - rect.top():bottom - rect.top(), left - rect.left():right - rect.left()]
+        tile = tilePixels(store, key)
+        if tile is None:
+            block[...] = store.background.rgb()
+        else:
+            block[...] = tile[top - y:bottom - y, left - x:right - x]
+    return pixels
+
+
+def writePixels(store, pixels, point, background):
+    rect = QRect(point, QSize(pixels.shape[1], pixels.shape[0]))
+    for key in store.keys(rect):
+        x, y = key[0] * TILE_SIZE, key[1] * TILE_SIZE
+        left, top = max(rect.left(), x), max(rect.top(), y)
+        right, bottom = min(rect.right() + 1, x + TILE_SIZE), min(rect.bottom() + 1, y + TILE_SIZE)
+        block = pixels[top - rect.top():bottom - rect.top(), left - rect.left():right - rect.left()]
+        if key not in store.tiles and (block == background).all():
+            continue
+        imagePixels(store.tile(key), True)[top - y:bottom - y, left - x:right - x] = block
+        store.dirty.add(key)
+
+
+def samplePixels(store, scale):
+    pixels = numpy.empty((-(-store.height // scale), -(-store.width // scale)), numpy.uint32)
+    for key in store.keys(store.rect()):
+        x, y = key[0] * TILE_SIZE, key[1] * TILE_SIZE
+        height, width = tileShape(store, key)
+        block = pixels[-(-y // scale):-(-(y + height) // scale), -(-x // scale):-(-(x + width) // scale)]
+        tile = tilePixels(store, key)
+        if tile is None:
+            block[...] = store.background.rgb()
+        else:
+            block[...] = tile[-y % scale::scale, -x % scale::scale]
+    return pixels
+
+
+"""
+Константы фильтров:
+    FILTER_TYPES - фильтры по названиям: название для пользователя, функция фильтра и описания параметров value и
+    value_2 (подпись, наименьшее, наибольшее значение и значение по умолчанию; None - параметра нет)
+    FILTER_KINDS - названия фильтров по порядку (номер фильтра пишется в родной формат документа)
+"""
+
+FILTER_TYPES = {'invert': ('Негатив', invertPixels, None, None),
+                'grayscale': ('Оттенки серого', grayscalePixels, None, None),
+                'level': ('Яркость и контраст', levelPixels, ('Яркость', -255, 255, 0), ('Контраст, %', -100, 100, 0)),
+                'blur': ('Размытие', blurPixels, ('Радиус', 1, 50, 2), None),
+                'sharpen': ('Резкость', sharpenPixels, ('Сила, %', 0, 500, 100), None)}
+FILTER_KINDS = tuple(FILTER_TYPES)
+
+
+class Filter:
+
+    """
+    Класс Filter, он же Фильтр. Самодельный класс, который накладывает на весь холст один из фильтров FILTER_TYPES.
+    Как и заливка области, работает по пикселям холста (см. метод apply), поэтому отменяется и сохраняется в документ
+    как обычный объект. Фильтры "по точкам" обрабатывают плитки прямо в их памяти, каждая плитка - отдельная задача в
+    пуле потоков, а несозданные плитки не создаются: фильтруется цвет фона. Фильтрам с соседними пикселями нужны
+    соседние строки, поэтому холст обрабатывается по рядам плиток: ряд вместе с halo строками соседних рядов
+    копируется в полосу, фильтр пишет результат во вторую, и из нее переписываются плитки ряда. Ряды обрабатываются
+    по FILTER_THREADS сразу в пуле потоков, а результат записывается только после того, как прочитаны соседние строки
+    следующих рядов. Ряды, рядом с которыми нет ни одной плитки, пропускаются, а в остальных берутся только столбцы от
+    первой до последней созданной плитки рядом (плюс halo). Так время и память зависят от нарисованного, а не от
+    размера холста.
+
+    Параметры при инициализации экземпляра класса Filter:
+        kind - название фильтра (ключ FILTER_TYPES)
+        value, value_2 - параметры фильтра
+        rect - прямоугольник, на который наложен фильтр (пустой, пока фильтр не применен)
+    """
+
+    def __init__(self, kind, value=0, value_2=0):
+        super(Filter, self).__init__()
+        self.kind = kind
+        self.value = value
+        self.value_2 = value_2
+        self.rect = QRect()
+
+    """
+    Метод halo. Сколько соседних строк сверху и снизу нужно фильтру с текущими параметрами.
+    """
+
+    def halo(self):
+        if self.kind == 'blur':
+            return self.value
+        elif self.kind == 'sharpen':
+            return 1
+        return 0
+
+    """
+    Метод apply. Накладывает фильтр на плитки store.
+    """
+
+    def apply(self, store):
+        self.rect = store.rect()
+        function = FILTER_TYPES[self.kind][1]
+        halo = self.halo()
+        if halo == 0:
+            background = numpy.array([[store.background.rgb()]], numpy.uint32)
+            function(background, background, self.value, self.value_2)
+            store.background = QColor.fromRgb(int(background[0, 0]))
+            tiles = [imagePixels(store.tiles[key], True) for key in store.keys(self.rect) if key in store.tiles]
+            jobs = [FILTER_POOL.submit(function, tile, tile, self.value, self.value_2) for tile in tiles]
+            for job in jobs:
+                job.result()
+            store.dirty.update(store.keys(self.rect))
+        else:
+            background = numpy.empty((1, 1), numpy.uint32)
+            function(numpy.full((2 * halo + 1, 1), store.background.rgb(), numpy.uint32), background, self.value,
+                     self.value_2)
+            background = background[0, 0]
+            if background != store.background.rgb():
+                store.dirty.update(store.keys(self.rect))
+            columns = {}
+            for tx, ty in store.tiles:
+                columns.setdefault(ty, []).append(tx)
+            pending = []
+            for start in range(0, -(-store.height // TILE_SIZE), FILTER_THREADS):
+                jobs = []
+                for ty in range(start, min(start + FILTER_THREADS, -(-store.height // TILE_SIZE))):
+                    near = columns.get(ty - 1, []) + columns.get(ty, []) + columns.get(ty + 1, [])
+                    if not near:
+                        continue
+                    band = QRect(QPoint(min(near) * TILE_SIZE, ty * TILE_SIZE),
+                                 QPoint((max(near) + 1) * TILE_SIZE - 1, (ty + 1) * TILE_SIZE - 1))
+                    band = band.intersected(self.rect)
+                    area = band.adjusted(-halo, -halo, halo, halo).intersected(self.rect)
+                    source = numpy.pad(rectPixels(store, area), ((halo - band.top() + area.top(),
+                                                                  halo - area.bottom() + band.bottom()), (0, 0)),
+                                       mode='edge')
+                    target = numpy.empty((band.height(), area.width()), numpy.uint32)
+                    job = FILTER_POOL.submit(function, source, target, self.value, self.value_2)
+                    jobs.append((band, target[:, band.left() - area.left():band.right() + 1 - area.left()], job))
+                for band, target, job in pending:
+                    job.result()
+                    writePixels(store, target, band.topLeft(), background)
+                pending = jobs
+            for band, target, job in pending:
+                job.result()
+                writePixels(store, target, band.topLeft(), background)
+            store.background = QColor.fromRgb(int(background))
+
+    """
+    Метод preview. Возвращает уменьшенную в scale раз картинку pixels с наложенным фильтром. Радиус размытия
+    уменьшается вместе с картинкой, чтобы предпросмотр был похож на результат.
+    """
+
+    def preview(self, pixels, scale):
+        value = self.value
+        if self.kind == 'blur':
+            value = max(1, round(value / scale))
+        result = numpy.empty_like(pixels)
+        preview = Filter(self.kind, value, self.value_2)
+        filterBands(pixels, result, FILTER_TYPES[self.kind][1], preview.halo(), value, self.value_2)
+        return result
+
+    """
+    Ранее упомянутый метод boundingRect. Фильтр накладывается на весь холст.
+    """
+
+    def boundingRect(self):
+        return QRect(self.rect)
+
+    """
+    Ранее упомянутый метод toDict.
+    """
+
+    def toDict(self):
+        return {'type': 'Filter', 'kind': self.kind, 'value': self.value, 'value_2': self.value_2}
+
+
+class FilterDialog(QDialog):
 
-    def setWhite(self):
-        if self.default_color == 'color_1':
-            self.pen_color = QColor(255, 255, 255)
-            self.updateColor(self.pen_color)
-        else:
-            self.brush_color = QColor(255, 255, 255)
-            self.updateColor(self.brush_color)
+    """
+    Класс FilterDialog, он же Окно фильтров. Диалоговое окно, в котором пользователь выбирает фильтр и его параметры.
+    Холст при открытии окна один раз уменьшается до FILTER_PREVIEW по большей стороне (каждый scale-й пиксель), и
+    при любом изменении фильтр накладывается только на эту маленькую картинку. На весь холст фильтр накладывается уже
+    после нажатия "Применить" (см. Window.showFilters).
+
+    Параметры при инициализации экземпляра класса FilterDialog:
+        scale - во сколько раз уменьшен холст для предпросмотра
+        pixels - уменьшенный холст
+        kind_box - список фильтров
+        value_box, value_2_box - параметры фильтра (скрываются, если у фильтра их нет)
+        preview - картинка предпросмотра
+    """
 
-    def setLightGrey(self):
-        if self.default_color == 'color_1':
-            self.pen_color = QColor(187, 187, 187)
-            self.updateColor(self.pen_color)
-        else:
-            self.brush_color = QColor(187, 187, 187)
-            self.updateColor(self.brush_color)
+    def __init__(self, store, parent=None):
+        super(FilterDialog, self).__init__(parent)
+        setIcon(self)
+        self.setWindowTitle('Фильтры')
+        self.scale = max(1, -(-max(store.width, store.height) // FILTER_PREVIEW))
+        self.pixels = samplePixels(store, self.scale)
+
+        self.kind_box = QComboBox()
+        for kind in FILTER_KINDS:
+            self.kind_box.addItem(FILTER_TYPES[kind][0], kind)
+        self.value_label, self.value_box = QLabel(), QSpinBox()
+        self.value_2_label, self.value_2_box = QLabel(), QSpinBox()
+        self.preview = QLabel()
+        self.preview.setAlignment(Qt.AlignCenter)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.button(QDialogButtonBox.Ok).setText('Применить')
+        buttons.button(QDialogButtonBox.Cancel).setText('Отмена')
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+
+        form = QFormLayout()
+        form.addRow('Фильтр', self.kind_box)
+        form.addRow(self.value_label, self.value_box)
+        form.addRow(self.value_2_label, self.value_2_box)
+        layout = QVBoxLayout(self)
+        layout.addLayout(form)
+        layout.addWidget(self.preview)
+        layout.addWidget(buttons)
+
+        self.kind_box.currentIndexChanged.connect(self.setKind)
+        self.value_box.valueChanged.connect(self.updatePreview)
+        self.value_2_box.valueChanged.connect(self.updatePreview)
+        self.setKind()
 
-    def setDarkGrey(self):
-        if self.default_color == 'color_1':
-            self.pen_color = QColor(73, 66, 61)
-            self.updateColor(self.pen_color)
-        else:
-            self.brush_color = QColor(73, 66, 61)
-            self.updateColor(self.brush_color)
+    """
+    Метод setKind. Настраивает поля параметров под выбранный фильтр и обновляет предпросмотр.
+    """
 
-    def setBrown(self):
-        if self.default_color == 'color_1':
-            self.pen_color = QColor(150, 75, 0)
-            self.updateColor(self.pen_color)
-        else:
-            self.brush_color = QColor(150, 75, 0)
-            self.updateColor(self.brush_color)
+    def setKind(self):
+        kind = self.kind_box.currentData()
+        for params, label, box in ((FILTER_TYPES[kind][2], self.value_label, self.value_box),
+                                   (FILTER_TYPES[kind][3], self.value_2_label, self.value_2_box)):
+            label.setVisible(params is not None)
+            box.setVisible(params is not None)
+            if params is not None:
+                box.blockSignals(True)
+                label.setText(params[0])
+                box.setRange(params[1], params[2])
+                box.setValue(params[3])
+                box.blockSignals(False)
+        self.updatePreview()
 
-    def setDarkRed(self):
-        if self.default_color == 'color_1':
-            self.pen_color = QColor(139, 0, 0)
-            self.updateColor(self.pen_color)
-        else:
-            self.brush_color = QColor(139, 0, 0)
-            self.updateColor(self.brush_color)
+    """
+    Метод filter. Возвращает фильтр с выбранными параметрами.
+    """
 
-    def setPink(self):
-        if self.default_color == 'color_1':
-            self.pen_color = QColor(255, 192, 203)
-            self.updateColor(self.pen_color)
-        else:
-            self.brush_color = QColor(255, 192, 203)
-            self.updateColor(self.brush_color)
+    def filter(self):
+        kind = self.kind_box.currentData()
+        value = self.value_box.value() if FILTER_TYPES[kind][2] is not None else 0
+        value_2 = self.value_2_box.value() if FILTER_TYPES[kind][3] is not None else 0
+        return Filter(kind, value, value_2)
 
-    def setFigureFill(self):
-        if self.sender().isChecked():
-            self.fill = True
-        else:
-            self.fill = False
+    """
+    Метод updatePreview. Накладывает выбранный фильтр на уменьшенный холст и показывает результат.
+    """
 
-    def setSize(self):
-        self.lineSize = MAINSIZE_KEYS[self.sender().currentText()]
+    def updatePreview(self):
+        result = self.filter().preview(self.pixels, self.scale)
+        height, width = result.shape
+        image = QImage(result.data, width, height, width * 4, QImage.Format_RGB32)
+        self.preview.setPixmap(QPixmap.fromImage(image))
 
-    def setBrush(self):
-        self.instrument = 'brush'
 
-    def setPencil(self):
-        self.instrument = 'pencil'
+class ImageCache:
 
-    def setEraser(self):
-        self.instrument = 'eraser'
+    """
+    Класс ImageCache, он же Кэш картинок. Самодельный служебный класс, который хранит уже раскодированные картинки,
+    чтобы один и тот же файл не читался и не раскодировался с диска при каждой перерисовке. Картинка сразу
+    переводится в формат, который QPainter рисует быстрее всего (RGB32 для непрозрачных, ARGB32_Premultiplied для
+    прозрачных). Ключ - путь, время изменения и размер файла, поэтому если файл перезаписали, он прочитается заново.
+    Кэш ограничен по памяти: при переполнении выбрасываются картинки, которые дольше всех не запрашивались (LRU).
+
+    Параметры при инициализации экземпляра класса ImageCache:
+        budget - сколько байт могут занимать картинки в кэше
+        images - сами картинки, упорядоченные от давно запрошенных к недавно запрошенным
+        used - сколько байт занято сейчас
+        hits - сколько раз картинка нашлась в кэше
+        misses - сколько раз картинку пришлось читать с диска
+    """
 
-    def setFill(self):
-        self.instrument = 'fill'
+    def __init__(self, budget):
+        super(ImageCache, self).__init__()
+        self.budget = budget
+        self.images = OrderedDict()
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
 
-    def setLine(self):
-        self.instrument = 'line'
+    """
+    Метод get. Возвращает картинку по пути к файлу: из кэша, если она там есть, иначе читает файл, переводит картинку в
+    нужный формат и кладет в кэш (метод put). Несжатый BMP читается через отображение файла в память (см. функцию
+    readBitmap). Если файла больше нет (картинку переместили или удалили после открытия) или его не прочитать,
+    возвращается пустая картинка: как и QImage(file), она просто ничего не рисует, а отмена, перерисовка и
+    "сплющивание" объектов не падают.
+    """
 
-    def setCircle(self):
-        self.instrument = 'circle'
+    def get(self, file):
+        try:
+            key = self.key(file)
+            image = self.images.get(key)
+            if image is not None:
+                self.hits += 1
+                self.images.move_to_end(key)
+                return image
+            self.misses += 1
+            pixels = readBitmap(file)
+            image = QImage(file) if pixels is None else bitmapImage(pixels)
+            return self.put(file, imageFormat(image))
+        except OSError:
+            return QImage()
 
-    def setTriangle(self):
-        self.instrument = 'triangle'
+    """
+    Методы заполнения кэша:
+        key - ключ картинки в кэше: путь, время изменения и размер файла
+        put - кладет уже прочитанную картинку в кэш, выбрасывая старые картинки, пока не хватит места, и возвращает
+        ее. Картинка больше всего бюджета в кэш не кладется. Так в кэш попадает картинка, которую прочитал LoadTask
+    """
 
-    def setRectangle(self):
-        self.instrument = 'rectangle'
+    def key(self, file):
+        stat = os.stat(file)
+        return os.path.abspath(file), stat.st_mtime_ns, stat.st_size
+
+    def put(self, file, image):
+        key = self.key(file)
+        if key in self.images:
+            self.used -= self.images.pop(key).sizeInBytes()
+        if image.sizeInBytes() <= self.budget:
+            while self.used + image.sizeInBytes() > self.budget:
+                self.used -= self.images.popitem(last=False)[1].sizeInBytes()
+            self.images[key] = image
+            self.used += image.sizeInBytes()
+        return image
 
-    def setPentagon(self):
-        self.instrument = '5gon'
+    """
+    Метод clear. Полностью очищает кэш, счетчики попаданий и промахов не трогает.
+    """
 
-    def setHexagon(self):
-        self.instrument = '6gon'
+    def clear(self):
+        self.images.clear()
+        self.used = 0
 
-    def setOctagon(self):
-        self.instrument = '8gon'
+    """
+    Метод stats. Возвращает состояние кэша: число картинок, занятую память, попадания, промахи и долю попаданий.
+    """
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'images': len(self.images),
+                'bytes': self.used,
+                'budget': self.budget,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0}
+
+
+IMAGE_CACHE = ImageCache(IMAGE_CACHE_BUDGET)
 
 
-class Brush:
+class Image:
 
     """
-    Класс Brush, он же Кисть. Самодельный класс инструмента, призванный отвечать за правильную отрисовку кисти.
-    На деле - постоянно рисует линию, обновляя точки начала и конца, поэтому плавные мазки - не что иное, как одна
-    большая ломанная, состоящая из огромного кол-ва маленьких линий. Плавность кисти особо не меняется, а вот
-    скорость ее прорисовки уже зависит от толщины кисти и мощности компьютера.
+    Класс Image, он же Картинка. Самодельный класс инструмента, призванный отвечать за прорисовку загруженной
+    пользователем картинки. Класс берет картинку из кэша IMAGE_CACHE (файл читается с диска только один раз) и рисует
+    ее на холст в исходном размере в верхний левый край.
 
-    Параметры при инициализации экземпляра класса Brush:
-        sp - координаты точки начала
-        ep - координаты точки конца
-        size - толщина
-        color - цвет
+    Параметры при инициализации экземпляра класса Image:
+        file - файл с картинкой
     """
 
-    def __init__(self, sp, ep, size, color):
-        super(Brush, self).__init__()
-        self.sp = sp
-        self.ep = ep
-        self.size = size
-        self.color = color
+    def __init__(self, file):
+        super(Image, self).__init__()
+        self.file = file
 
     """
-    Ранее упомянутый метод draw. Задает переданному "рисовальщику" ручку, которая будет рисовать сплошную линию 
-    определенного цвета, определенной толщины, со скругленными краями, и дает ему команду рисовать по координатам
-    начала и конца.
+    Ранее упомянутый метод draw. Берет картинку из кэша и передает ее "рисовальшику".
     """
 
     def draw(self, painter):
-        painter.setPen(QPen(self.color, self.size, Qt.SolidLine, Qt.RoundCap, Qt.BevelJoin))
-        painter.drawLine(self.sp, self.ep)
+        painter.drawImage(0, 0, IMAGE_CACHE.get(self.file))
 
+    """
+    Ранее упомянутый метод boundingRect. Картинка рисуется в исходном размере в верхний левый угол, а размер
+    QImageReader читает из заголовка файла, не декодируя саму картинку.
+    """
 
-class Pencil(Brush):
+    def boundingRect(self):
+        return QRect(QPoint(0, 0), QImageReader(self.file).size())
 
     """
-    Класс Pencil, он же Карандаш. Самодельный класс инструмента, призванный отвечать за прорисовку карандаша.
-    Принцип работы схож с кистью, поэтому и наследован от класса Brush, за исключением одного момента: у карандаша
-    установлена стандартная ручка с неизменяемой толщиной в 1 пиксель.
+    Метод covers. Проверяет, закрывает ли картинка прямоугольник rect целиком. Прозрачная картинка ничего не
+    закрывает, сквозь нее видно то, что под ней.
+    """
 
-    Параметры при инициализации экземпляра класса Pencil:
-        sp - координаты точки начала
-        ep - координаты точки конца
-        color - цвет
+    def covers(self, rect):
+        image = IMAGE_CACHE.get(self.file)
+        return not image.hasAlphaChannel() and image.rect().contains(rect)
+
+    """
+    Ранее упомянутый метод toDict.
     """
 
-    def __init__(self, sp, ep, color):
-        super(Brush, self).__init__()
-        self.sp = sp
-        self.ep = ep
-        self.color = color
+    def toDict(self):
+        return {'type': 'Image', 'file': self.file}
+
+
+"""
+Функции работы с документами. Документ - это размер холста и список объектов, то есть вся векторная история
+рисунка, а не сплющенная картинка. Используются для пакетной отрисовки без окна (см. batch.py).
+    objectFromDict - восстанавливает объект из словаря, который вернул его метод toDict. Относительные пути картинок
+    считаются от папки folder (обычно - папки документа)
+    dumpDocument - возвращает документ в виде словаря, пригодного для записи в JSON
+    loadDocument - обратная операция: возвращает размер холста и список объектов
+    renderDocument - рисует объекты в плитки холста заданного размера (поверх копии базового слоя, если он передан).
+    Объекты могут быть не списком, а любым итерируемым объектом, например DocumentReader
+"""
+
+SHAPE_TYPES = {'Circle': Circle,
+               'Triangle': Triangle,
+               'Rectangle': Rectangle,
+               'Pentagon': Pentagon,
+               'Hexagon': Hexagon,
+               'Octagon': Octagon}
+
+
+def objectFromDict(data, folder=''):
+    kind = data['type']
+    if kind in ('Brush', 'Pencil', 'Eraser'):
+        if kind == 'Brush':
+            obj = Brush(QPoint(), data['size'], QColor(data['color']))
+        elif kind == 'Pencil':
+            obj = Pencil(QPoint(), QColor(data['color']))
+        else:
+            obj = Eraser(QPoint(), data['size'] - 2)
+        obj.points = QPolygon(data['points'])
+        return obj
+    elif kind in SHAPE_TYPES:
+        return SHAPE_TYPES[kind](data['sx'], data['sy'], data['x'], data['y'], data['fill'], data['size'],
+                                 QColor(data['color']), QColor(data['color_2']))
+    elif kind == 'Line':
+        return Line(data['sx'], data['sy'], data['ex'], data['ey'], data['size'], QColor(data['color']))
+    elif kind == 'Fill':
+        return Fill(data['w'], data['h'], QColor(data['color']))
+    elif kind == 'Bucket':
+        return Bucket(data['x'], data['y'], QColor(data['color']), data['tolerance'])
+    elif kind == 'Filter':
+        return Filter(data['kind'], data['value'], data['value_2'])
+    elif kind == 'Image':
+        return Image(os.path.join(folder, data['file']))
+    raise ValueError(f'Неизвестный тип объекта: {kind}')
+
+
+def dumpDocument(size, objects):
+    return {'format': 'qtpaint',
+            'version': 1,
+            'width': size.width(),
+            'height': size.height(),
+            'objects': [obj.toDict() for obj in objects]}
+
+
+def loadDocument(data, folder=''):
+    if data.get('format') != 'qtpaint':
+        raise ValueError('Это не документ Qt Paint')
+    return QSize(data['width'], data['height']), [objectFromDict(obj, folder) for obj in data['objects']]
+
+
+def renderDocument(size, objects, base=None):
+    if base is None:
+        store = TileStore(size.width(), size.height())
+    else:
+        store = base.copy()
+    store.commitAll(objects)
+    return store
+
+
+"""
+Родной формат документа Qt Paint (.qtp). В отличие от JSON, объекты хранятся упакованными двоичными записями:
+тег типа (1 байт), цвет RGBA (4 байта), толщина, флажок заливки и координаты в int16 (если хоть одна координата не
+влезает в int16, у тега поднимается старший бит и координаты пишутся в int32). Точки мазка пишутся одним куском
+прямо из памяти QPolygon. Записи собираются в блоки примерно по DOCUMENT_BLOCK_SIZE байт, и каждый блок по желанию
+сжимается zlib. Файл пишется и читается потоком, блок за блоком: при чтении объекты отдаются по одному, поэтому
+документ на миллион отрезков можно сразу рисовать в плитки, не собирая промежуточных списков.
+
+Устройство файла:
+    заголовок - '<4sHHII': сигнатура DOCUMENT_MAGIC, версия, флажки (1 - есть базовый слой), ширина и высота
+    базовый слой (только если есть) - '<II': цвет фона и число плиток, затем для каждой плитки '<III' (номер по
+    горизонтали, по вертикали и длина) и сама плитка в PNG
+    блоки - '<BII': сжат ли блок, длина записей и длина блока в файле, затем сам блок. Блок с нулевыми длинами -
+    конец файла
+"""
+
+DOCUMENT_MAGIC = b'QTPD'
+DOCUMENT_VERSION = 1
+DOCUMENT_BLOCK_SIZE = 1 << 20
+RECORD_TAGS = {'Brush': 1,
+               'Pencil': 2,
+               'Eraser': 3,
+               'Line': 4,
+               'Circle': 5,
+               'Triangle': 6,
+               'Rectangle': 7,
+               'Pentagon': 8,
+               'Hexagon': 9,
+               'Octagon': 10,
+               'Fill': 11,
+               'Image': 12,
+               'Bucket': 13,
+               'Filter': 14}
+RECORD_TYPES = {tag: name for name, tag in RECORD_TAGS.items()}
+RECORD_WIDE = 0x80
+HEADER = struct.Struct('<4sHHII')
+BASE_HEADER = struct.Struct('<II')
+TILE_HEADER = struct.Struct('<III')
+BLOCK_HEADER = struct.Struct('<BII')
+STROKE_RECORD = struct.Struct('<BIHI')
+LINE_RECORD = (struct.Struct('<BIH4h'), struct.Struct('<BIH4i'))
+SHAPE_RECORD = (struct.Struct('<BIIHB4h'), struct.Struct('<BIIHB4i'))
+FILL_RECORD = struct.Struct('<BIII')
+IMAGE_RECORD = struct.Struct('<BH')
+BUCKET_RECORD = struct.Struct('<BIiiB')
+FILTER_RECORD = struct.Struct('<BBii')
+
+"""
+Функции упаковки записей:
+    fitsShort - проверяет, влезают ли все координаты в int16
+    packRecord - возвращает запись объекта в виде байтов
+    unpackRecord - читает запись из буфера view с позиции offset и возвращает объект и позицию следующей записи.
+    Пути картинок считаются от папки folder
+"""
+
+
+def fitsShort(*values):
+    return -32768 <= min(values) and max(values) <= 32767
+
+
+def packRecord(obj):
+    kind = type(obj).__name__
+    tag = RECORD_TAGS[kind]
+    if isinstance(obj, Stroke):
+        coords = obj.coords()
+        if not fitsShort(*coords):
+            tag |= RECORD_WIDE
+        else:
+            coords = array('h', coords)
+        return STROKE_RECORD.pack(tag, QColor(obj.color).rgba(), obj.size, obj.points.size()) + coords.tobytes()
+    elif kind == 'Line':
+        wide = not fitsShort(obj.sx, obj.sy, obj.ex, obj.ey)
+        return LINE_RECORD[wide].pack(tag | RECORD_WIDE * wide, QColor(obj.color).rgba(), obj.size,
+                                      obj.sx, obj.sy, obj.ex, obj.ey)
+    elif kind in SHAPE_TYPES:
+        wide = not fitsShort(obj.sx, obj.sy, obj.x, obj.y)
+        return SHAPE_RECORD[wide].pack(tag | RECORD_WIDE * wide, QColor(obj.color).rgba(),
+                                       QColor(obj.color_2).rgba(), obj.size, obj.to_fill,
+                                       obj.sx, obj.sy, obj.x, obj.y)
+    elif kind == 'Fill':
+        return FILL_RECORD.pack(tag, QColor(obj.color).rgba(), obj.w, obj.h)
+    elif kind == 'Bucket':
+        return BUCKET_RECORD.pack(tag, QColor(obj.color).rgba(), obj.x, obj.y, obj.tolerance)
+    elif kind == 'Filter':
+        return FILTER_RECORD.pack(tag, FILTER_KINDS.index(obj.kind), obj.value, obj.value_2)
+    else:
+        path = obj.file.encode('utf-8')
+        return IMAGE_RECORD.pack(tag, len(path)) + path
+
+
+def unpackRecord(view, offset, folder=''):
+    tag = view[offset]
+    wide = bool(tag & RECORD_WIDE)
+    kind = RECORD_TYPES.get(tag & ~RECORD_WIDE)
+    if kind in ('Brush', 'Pencil', 'Eraser'):
+        _, rgba, size, count = STROKE_RECORD.unpack_from(view, offset)
+        offset += STROKE_RECORD.size
+        length = count * (8 if wide else 4)
+        coords = view[offset:offset + length]
+        if not wide:
+            short = array('h')
+            short.frombytes(coords)
+            coords = array('i', short)
+        if kind == 'Brush':
+            obj = Brush(QPoint(), size, QColor.fromRgba(rgba))
+        elif kind == 'Pencil':
+            obj = Pencil(QPoint(), QColor.fromRgba(rgba))
+        else:
+            obj = Eraser(QPoint(), size - 2)
+        obj.setCoords(coords, count)
+        return obj, offset + length
+    elif kind == 'Line':
+        record = LINE_RECORD[wide]
+        _, rgba, size, sx, sy, ex, ey = record.unpack_from(view, offset)
+        return Line(sx, sy, ex, ey, size, QColor.fromRgba(rgba)), offset + record.size
+    elif kind in SHAPE_TYPES:
+        record = SHAPE_RECORD[wide]
+        _, rgba, rgba_2, size, fill, sx, sy, x, y = record.unpack_from(view, offset)
+        obj = SHAPE_TYPES[kind](sx, sy, x, y, bool(fill), size, QColor.fromRgba(rgba), QColor.fromRgba(rgba_2))
+        return obj, offset + record.size
+    elif kind == 'Fill':
+        _, rgba, w, h = FILL_RECORD.unpack_from(view, offset)
+        return Fill(w, h, QColor.fromRgba(rgba)), offset + FILL_RECORD.size
+    elif kind == 'Bucket':
+        _, rgba, x, y, tolerance = BUCKET_RECORD.unpack_from(view, offset)
+        return Bucket(x, y, QColor.fromRgba(rgba), tolerance), offset + BUCKET_RECORD.size
+    elif kind == 'Filter':
+        _, index, value, value_2 = FILTER_RECORD.unpack_from(view, offset)
+        return Filter(FILTER_KINDS[index], value, value_2), offset + FILTER_RECORD.size
+    elif kind == 'Image':
+        _, length = IMAGE_RECORD.unpack_from(view, offset)
+        offset += IMAGE_RECORD.size
+        path = bytes(view[offset:offset + length]).decode('utf-8')
+        return Image(os.path.join(folder, path)), offset + length
+    raise ValueError(f'Неизвестный тег записи: {tag}')
+
+
+PACKED_TYPES = ('Brush', 'Pencil', 'Eraser', 'Line', 'Fill') + tuple(SHAPE_TYPES)
+
+
+class SpatialIndex:
 
     """
-    Ранее упомянутый метод draw. Работает как кисть, разве что параметров ручки всего два: цвет и толщина в 1 пиксель.
+    Класс SpatialIndex, он же Сетка объектов. Самодельный служебный класс, пространственный индекс над прямоугольниками
+    объектов холста (см. PrimitiveStore). Холст делится на клетки TILE_SIZE x TILE_SIZE, совпадающие с плитками
+    TileStore, и для каждой клетки хранится список номеров объектов, чьи прямоугольники ее задевают, по возрастанию, то
+    есть в порядке рисования. Поэтому найти все объекты в области (метод query) или верхний объект под точкой (метод
+    at) можно, не перебирая весь список: смотрятся только клетки области или одна клетка под точкой. Номера внутри
+    индекса сквозные, а снаружи номер объекта считается от первого еще не удаленного (first), поэтому удаление старых
+    объектов с начала не требует перенумерации.
+
+    Параметры при инициализации экземпляра класса SpatialIndex:
+        first - сквозной номер объекта, который сейчас первый
+        bounds - прямоугольники объектов подряд (x1, y1, x2, y2, ...), у пустого прямоугольника x2 < x1
+        cells - списки сквозных номеров объектов по клеткам, ключ - номер клетки по горизонтали и вертикали
     """
 
-    def draw(self, painter):
-        painter.setPen(QPen(self.color, 1))
-        painter.drawLine(self.sp, self.ep)
+    __slots__ = ('first', 'bounds', 'cells')
 
+    def __init__(self):
+        super(SpatialIndex, self).__init__()
+        self.first = 0
+        self.bounds = array('i')
+        self.cells = {}
+
+    """
+    Методы изменения:
+        append - добавляет в конец прямоугольник нового объекта
+        move - меняет прямоугольник объекта номер index (например, фигуры, которую тянут мышью): номер убирается из
+        клеток, которые объект перестал задевать, и добавляется в новые, остальные клетки не трогаются
+        remove - удаляет объекты с номерами от start до stop (не включительно). С начала и с конца удаляется быстро, а
+        из середины - с перестройкой индекса
+        clear - удаляет все объекты
+    """
 
-class Eraser(Brush):
+    def append(self, rect):
+        number = self.first + len(self.bounds) // 4
+        self.bounds.extend((rect.left(), rect.top(), rect.right(), rect.bottom()) if not rect.isEmpty()
+                           else (0, 0, -1, -1))
+        for key in self.keys(number):
+            self.cells.setdefault(key, []).append(number)
+
+    def move(self, index, rect):
+        number = self.first + index
+        old = set(self.keys(number))
+        self.bounds[4 * index:4 * index + 4] = array('i', (rect.left(), rect.top(), rect.right(), rect.bottom())
+                                                     if not rect.isEmpty() else (0, 0, -1, -1))
+        new = set(self.keys(number))
+        for key in old - new:
+            cell = self.cells[key]
+            cell.remove(number)
+            if not cell:
+                del self.cells[key]
+        for key in new - old:
+            insort(self.cells.setdefault(key, []), number)
+
+    def remove(self, start, stop):
+        count = len(self.bounds) // 4
+        if start >= stop:
+            return
+        if 0 < start and stop < count:
+            bounds = self.bounds
+            del bounds[4 * start:4 * stop]
+            self.clear()
+            for index in range(0, len(bounds), 4):
+                self.append(QRect(QPoint(*bounds[index:index + 2]), QPoint(*bounds[index + 2:index + 4])))
+            return
+        low, high = self.first + start, self.first + stop
+        keys = set()
+        for number in range(low, high):
+            keys.update(self.keys(number))
+        for key in keys:
+            cell = self.cells[key]
+            del cell[bisect_left(cell, low):bisect_left(cell, high)]
+            if not cell:
+                del self.cells[key]
+        del self.bounds[4 * start:4 * stop]
+        if start == 0:
+            self.first = high
+
+    def clear(self):
+        self.first = 0
+        self.bounds = array('i')
+        self.cells = {}
 
     """
-    Class Eraser, он же Ластик. Самодельный класс инструмента, призванный отвечать за прорисовку ластика. Принцип
-    работы схож с кистью, поэтому и наследован от класса Brush, за исключением одного момента: у ластика установлена
-    стандартная ручка с постоянным белым цветом и толщиной больше, чем текущая, на 2 пикселя.
+    Метод keys. Возвращает номера клеток, которые задевает прямоугольник объекта со сквозным номером number.
+    """
 
-    Параметры при инициализации экземпляра класса Eraser:
-        sp - координаты точки начала
-        ep - координаты точки конца
-        size - толщина
+    def keys(self, number):
+        index = 4 * (number - self.first)
+        x1, y1, x2, y2 = self.bounds[index:index + 4]
+        if x2 < x1 or y2 < y1:
+            return []
+        return [(tx, ty)
+                for ty in range(y1 // TILE_SIZE, y2 // TILE_SIZE + 1)
+                for tx in range(x1 // TILE_SIZE, x2 // TILE_SIZE + 1)]
+
+    """
+    Методы поиска:
+        query - номера объектов, чьи прямоугольники пересекают прямоугольник rect, в порядке рисования
+        at - номера объектов, чьи прямоугольники содержат точку point, сверху вниз (последний нарисованный - первый)
     """
 
-    def __init__(self, sp, ep, size):
-        super(Brush, self).__init__()
-        self.sp = sp
-        self.ep = ep
-        self.size = size
+    def query(self, rect):
+        if rect.isEmpty():
+            return []
+        x1, y1, x2, y2 = rect.left(), rect.top(), rect.right(), rect.bottom()
+        found = set()
+        for ty in range(y1 // TILE_SIZE, y2 // TILE_SIZE + 1):
+            for tx in range(x1 // TILE_SIZE, x2 // TILE_SIZE + 1):
+                found.update(self.cells.get((tx, ty), ()))
+        bounds, first = self.bounds, self.first
+        result = []
+        for number in sorted(found):
+            index = 4 * (number - first)
+            if bounds[index] <= x2 and x1 <= bounds[index + 2] and bounds[index + 1] <= y2 and y1 <= bounds[index + 3]:
+                result.append(number - first)
+        return result
+
+    def at(self, point):
+        x, y = point.x(), point.y()
+        bounds, first = self.bounds, self.first
+        for number in reversed(self.cells.get((x // TILE_SIZE, y // TILE_SIZE), ())):
+            index = 4 * (number - first)
+            if bounds[index] <= x <= bounds[index + 2] and bounds[index + 1] <= y <= bounds[index + 3]:
+                yield number - first
+
+
+class PrimitiveStore:
 
     """
-    Ранее упомянутый метод draw. Работает как кисть, разве что параметров ручки всего два: белый цвет 
-    и толщина на 2 пикселя больше.
+    Класс PrimitiveStore, он же Хранилище объектов. Самодельный служебный класс, список объектов холста и истории
+    отмены, устроенный по столбцам. Обычный список держит на каждый объект питоновский объект с QColor-обертками, а это
+    сотни байт даже на линию из двух точек. Здесь законченные мазки, линии, фигуры и заливки хранятся в общих массивах:
+    теги типов (те же, что в родном формате документа, см. RECORD_TAGS), цвета RGBA, цвета заливки, толщины, флажки
+    заливки и координаты (у мазка - все его точки, у линии и фигур - начало и конец, у заливки - размер). Объекты
+    остальных типов (заливка области, фильтр, картинка) и объекты, которые еще рисуются, хранятся как есть.
+
+    Снаружи хранилище выглядит как список: по номеру или срезу возвращаются обычные объекты, собранные из массивов (это
+    тонкие объекты со __slots__, поэтому дешево), и их можно перебирать, добавлять, удалять с начала и с конца.
+    Последние PRIMITIVE_VIEWS добавленных или собранных по номеру объектов хранилище держит наготове (views, LRU), и то,
+    что объект запомнил у себя (углы фигуры, стиль рисования из пула), не пропадает между перерисовками, повторами
+    истории и отменами, а добавленный объект отдается тем же, каким его нарисовали. Менять отданный объект нельзя: в
+    массивах он от этого не изменится. Номера в views считаются от первого объекта, когда-либо лежавшего в хранилище
+    (см. offset), поэтому удаление с начала их не сбивает. Объект, который еще рисуется (мазок или фигура, которую тянут
+    мышью), добавляется последним с live=True и остается самим собой, пока холст не "запечатает" его методом seal.
+    Упаковываются только типы из PACKED_TYPES.
+
+    Хранилище холста еще и ведет сетку SpatialIndex над прямоугольниками объектов (indexed=True): по ней холст
+    перерисовывает область, повторяя только задевающие ее объекты, и находит верхнюю фигуру под курсором. Прямоугольник
+    кладется в сетку при добавлении объекта, поэтому заливку области и фильтр добавляют уже примененными. История
+    отмены сетку не ведет.
+
+    Параметры при инициализации экземпляра класса PrimitiveStore:
+        objects - объекты, которые нужно сразу положить в хранилище (по умолчанию - никаких)
+        tags - теги типов объектов (0 - объект хранится как есть, см. extras)
+        colors - цвета RGBA
+        fills - цвета заливки фигур
+        sizes - толщины
+        flags - флажки заливки фигур
+        starts - где в coords начинаются координаты каждого объекта (на одно число больше, чем объектов)
+        coords - координаты всех объектов подряд (x0, y0, x1, y1, ...)
+        extras - объекты, хранящиеся как есть (у упакованных - None)
+        live - хранится ли последний объект как есть только потому, что он еще рисуется
+        index - сетка прямоугольников объектов (None, если indexed не задан)
+        views - собранные упакованные объекты по номерам от offset, упорядоченные от давно запрошенных к недавним
+        offset - сколько объектов удалено с начала хранилища за все время
     """
 
-    def draw(self, painter):
-        painter.setPen(QPen(Qt.white, self.size + 2))
-        painter.drawLine(self.sp, self.ep)
+    __slots__ = ('tags', 'colors', 'fills', 'sizes', 'flags', 'starts', 'coords', 'extras', 'live', 'index', 'views',
+                 'offset')
+
+    def __init__(self, objects=(), indexed=False):
+        super(PrimitiveStore, self).__init__()
+        self.tags = array('B')
+        self.colors = array('I')
+        self.fills = array('I')
+        self.sizes = array('H')
+        self.flags = array('B')
+        self.starts = array('q', [0])
+        self.coords = array('i')
+        self.extras = []
+        self.live = False
+        self.index = SpatialIndex() if indexed else None
+        self.views = OrderedDict()
+        self.offset = 0
+        self.extend(objects)
 
+    """
+    Методы добавления:
+        append - добавляет объект в конец. Если live задан, объект хранится как есть до вызова seal (его еще рисуют).
+        Предыдущий такой объект при этом упаковывается
+        extend - добавляет объекты по порядку, все как законченные
+        seal - упаковывает последний объект, если он был добавлен с live=True. Холст вызывает его, когда объект закончен
+        touch - переносит в сетке прямоугольник последнего объекта, если тот еще рисуется и изменился (холст вызывает
+        его на каждом кадре движения мыши)
+        pack - дописывает объект в конец массивов. Объект, который не упаковывается, кладется в extras как есть. Если
+        keep задан, упакованный объект кладется и в views (так append и seal сохраняют объект, который только что
+        нарисовали, а extend при чтении документа не вытесняет из views все остальное)
+    """
 
-class Line:
+    def append(self, obj, live=False):
+        self.seal()
+        if live:
+            self.pack(None)
+            self.extras[-1] = obj
+            self.live = True
+            self.touch()
+        else:
+            self.pack(obj, True)
+
+    def extend(self, objects):
+        self.seal()
+        for obj in objects:
+            self.pack(obj)
+
+    def seal(self):
+        if self.live:
+            obj = self.extras[-1]
+            del self[-1]
+            self.pack(obj, True)
+
+    def touch(self):
+        if self.live and self.index is not None:
+            self.index.move(len(self.tags) - 1, self.extras[-1].boundingRect())
+
+    def pack(self, obj, keep=False):
+        name = type(obj).__name__
+        coords = ()
+        if name not in PACKED_TYPES:
+            self.tags.append(0)
+            self.colors.append(0)
+            self.fills.append(0)
+            self.sizes.append(0)
+            self.flags.append(0)
+            self.extras.append(obj)
+        else:
+            shape = name in SHAPE_TYPES
+            self.tags.append(RECORD_TAGS[name])
+            self.colors.append(QColor(obj.color).rgba())
+            self.fills.append(QColor(obj.color_2).rgba() if shape else 0)
+            self.sizes.append(0 if name == 'Fill' else obj.size)
+            self.flags.append(1 if shape and obj.to_fill else 0)
+            self.extras.append(None)
+            if keep:
+                self.remember(len(self.tags) - 1, obj)
+            if name in ('Brush', 'Pencil', 'Eraser'):
+                coords = obj.coords()
+            elif name == 'Line':
+                coords = (obj.sx, obj.sy, obj.ex, obj.ey)
+            elif name == 'Fill':
+                coords = (obj.w, obj.h)
+            else:
+                coords = (obj.sx, obj.sy, obj.x, obj.y)
+        self.coords.extend(coords)
+        self.starts.append(len(self.coords))
+        if self.index is not None:
+            self.index.append(QRect() if obj is None else obj.boundingRect())
 
     """
-    Класс Line, он же Линия. Самодельный класс инструмента, призванный отвечать за прорисовку линии. Несмотря на то, что
-    кистеподобные классы тоже рисуют линию, делают они это постоянно, в отличии от Line, который рисует одну и ту же
-    линию, обновляя ее размер и координаты по мере перемещения пользователем мыши.
+    Методы списка:
+        __len__ - число объектов
+        __getitem__ - объект по номеру (можно отрицательному) или список объектов по срезу
+        __iter__ - перебирает объекты по порядку
+        __delitem__ - удаляет объекты по номеру или срезу без шага (холст и история удаляют только с начала и с конца)
+        clear - удаляет все объекты
+        bytes - сколько байт занимают массивы хранилища и список extras (без самих объектов, хранящихся как есть)
+    """
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.build(i, False) for i in range(*index.indices(len(self.tags)))]
+        if index < 0:
+            index += len(self.tags)
+        if not 0 <= index < len(self.tags):
+            raise IndexError('Номер объекта вне хранилища')
+        return self.build(index)
+
+    def __iter__(self):
+        for index in range(len(self.tags)):
+            yield self.build(index, False)
+
+    def __delitem__(self, index):
+        count = len(self.tags)
+        if isinstance(index, slice):
+            start, stop, step = index.indices(count)
+            if step != 1:
+                raise ValueError('Из хранилища удаляются только объекты подряд')
+        else:
+            start = index + count if index < 0 else index
+            stop = start + 1
+        stop = max(start, stop)
+        if start == stop:
+            return
+        first, last = self.starts[start], self.starts[stop]
+        for column in (self.tags, self.colors, self.fills, self.sizes, self.flags, self.extras):
+            del column[start:stop]
+        del self.coords[first:last]
+        del self.starts[start + 1:stop + 1]
+        if start == 0:
+            stale = [key for key in self.views if key < self.offset + stop]
+            self.offset += stop
+        else:
+            stale = [key for key in self.views if key >= self.offset + start]
+        for key in stale:
+            del self.views[key]
+        if last > first:
+            numpy.frombuffer(self.starts, numpy.int64)[start + 1:] -= last - first
+        if self.index is not None:
+            self.index.remove(start, stop)
+        self.live = self.live and stop < count
+
+    def clear(self):
+        del self[:]
+
+    def bytes(self):
+        columns = (self.tags, self.colors, self.fills, self.sizes, self.flags, self.starts, self.coords)
+        return sum(column.itemsize * len(column) for column in columns) + 8 * len(self.extras)
 
-    Параметры при инициализации экземпляра класса Line:
-        sx - x точки начала
-        sy - y точки начала
-        ex - x точки конца
-        ey - y точки конца
-        size - толщина
-        color - цвет
+    """
+    Методы поиска по сетке (только у хранилища с indexed=True, см. SpatialIndex):
+        query - номера объектов, которые задевают прямоугольник rect, в порядке рисования
+        at - номера объектов, чьи прямоугольники содержат точку point, сверху вниз
     """
 
-    def __init__(self, sx, sy, ex, ey, size, color):
-        super(Line, self).__init__()
-        self.sx = sx
-        self.sy = sy
-        self.ex = ex
-        self.ey = ey
-        self.size = size
-        self.color = color
+    def query(self, rect):
+        return self.index.query(rect)
+
+    def at(self, point):
+        return self.index.at(point)
 
     """
-    Ранее упомянутый метод draw. Работает как кисть, но их конструктивные особенности прописаны не в классе, а в методе
-    mouseMoveEvent, где кисть и ей подобные начинают рисовать новую линию, а линия просто обновляет конечную точку.
+    Методы сборки:
+        build - возвращает объект номер index: готовый из views, собранный из массивов или его самого, если он хранится
+        как есть. Собранный объект кладется в views, только если keep задан: перебор и срезы проходят по всему
+        хранилищу, и их объекты только вытеснили бы из views те, что перерисовываются часто
+        remember - кладет собранный объект номер index в views, выбрасывая тот, что дольше всех не запрашивался
+        assemble - собирает объект номер index из массивов заново
     """
 
-    def draw(self, painter):
-        painter.setPen(QPen(self.color, self.size))
-        painter.drawLine(self.sx, self.sy, self.ex, self.ey)
+    def build(self, index, keep=True):
+        obj = self.extras[index]
+        if obj is not None:
+            return obj
+        obj = self.views.get(self.offset + index)
+        if obj is not None:
+            self.views.move_to_end(self.offset + index)
+            return obj
+        obj = self.assemble(index)
+        if keep:
+            self.remember(index, obj)
+        return obj
+
+    def remember(self, index, obj):
+        self.views[self.offset + index] = obj
+        if len(self.views) > PRIMITIVE_VIEWS:
+            self.views.popitem(last=False)
+
+    def assemble(self, index):
+        name = RECORD_TYPES[self.tags[index]]
+        color = QColor.fromRgba(self.colors[index])
+        size = self.sizes[index]
+        first, last = self.starts[index], self.starts[index + 1]
+        if name in ('Brush', 'Pencil', 'Eraser'):
+            if name == 'Brush':
+                obj = Brush(QPoint(), size, color)
+            elif name == 'Pencil':
+                obj = Pencil(QPoint(), color)
+            else:
+                obj = Eraser(QPoint(), size - 2)
+            obj.setCoords(self.coords[first:last], (last - first) // 2)
+            return obj
+        coords = self.coords[first:last]
+        if name == 'Line':
+            return Line(*coords, size, color)
+        if name == 'Fill':
+            return Fill(*coords, color)
+        return SHAPE_TYPES[name](*coords, bool(self.flags[index]), size, color, QColor.fromRgba(self.fills[index]))
 
 
-class Circle:
+class DocumentWriter:
 
     """
-    Класс Circle, он же Круг. Самодельный класс инструмента, призванный отвечать за прорисовку эллипса. Реализовано
-    через прямоугольник, внутри которого встроенным методом drawEllipse рисуется эллипс
+    Класс DocumentWriter, он же Писатель документа. Самодельный служебный класс, который потоком пишет документ в
+    родном формате в открытый на запись двоичный файл. Заголовок и базовый слой пишутся сразу, объекты - по одному
+    методом write, а в файл они уходят целыми блоками. В конце обязательно вызвать close.
+
+    Параметры при инициализации экземпляра класса DocumentWriter:
+        file - двоичный файл, открытый на запись
+        size - размер холста
+        base - базовый слой холста (плитки) или None
+        compress - сжимать ли блоки zlib
+        block_size - примерный размер блока в байтах
+        buffer - записи, еще не ушедшие в файл
+    """
+
+    def __init__(self, file, size, base=None, compress=True, block_size=DOCUMENT_BLOCK_SIZE):
+        super(DocumentWriter, self).__init__()
+        self.file = file
+        self.compress = compress
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.file.write(HEADER.pack(DOCUMENT_MAGIC, DOCUMENT_VERSION, int(base is not None),
+                                    size.width(), size.height()))
+        if base is not None:
+            self.file.write(BASE_HEADER.pack(base.background.rgba(), len(base.tiles)))
+            for (tx, ty), tile in base.tiles.items():
+                data = QByteArray()
+                buffer = QBuffer(data)
+                buffer.open(QIODevice.WriteOnly)
+                tile.save(buffer, 'PNG')
+                self.file.write(TILE_HEADER.pack(tx, ty, data.size()))
+                self.file.write(data.data())
 
-    Параметры при инициализации экземпляра класса Circle:
-        sx - x точки начала
-        sy - y точки начала
-        x - x точки конца
-        y - y точки конца
-        to_fill - разрешение на заливку
-        size - толщина контура
-        color - цвет контура
-        color_2 - цвет заливки
+    """
+    Метод write. Добавляет запись объекта в текущий блок и отправляет блок в файл, если он набрал нужный размер.
     """
 
-    def __init__(self, sx, sy, x, y, fill, size, color, color_2):
-        super(Circle, self).__init__()
-        self.sx = sx
-        self.sy = sy
-        self.x = x
-        self.y = y
-        self.to_fill = fill
-        self.size = size
-        self.color = color
-        self.color_2 = color_2
+    def write(self, obj):
+        self.buffer += packRecord(obj)
+        if len(self.buffer) >= self.block_size:
+            self.flush()
 
     """
-    Ранее упомянутый метод draw. Задает ручку, а если еще и заливка разрешена, задает кисть (в противном случае, кисть
-    отменяется) и рисует эллипс в прямоугольнике с точкой начала и длиной и шириной этого прямоугольника.
+    Метод flush. Отправляет накопленный блок в файл, при необходимости сжимая его.
     """
 
-    def draw(self, painter):
-        painter.setPen(QPen(self.color, self.size))
-        if self.to_fill:
-            painter.setBrush(QBrush(self.color_2))
-        else:
-            painter.setBrush(QBrush(Qt.NoBrush))
-        painter.drawEllipse(self.sx, self.sy, self.x - self.sx, self.y - self.sy)
+    def flush(self):
+        if not self.buffer:
+            return
+        data = zlib.compress(self.buffer, 1) if self.compress else self.buffer
+        self.file.write(BLOCK_HEADER.pack(int(self.compress), len(self.buffer), len(data)))
+        self.file.write(data)
+        self.buffer = bytearray()
+
+    """
+    Метод close. Дописывает последний блок и метку конца файла. Сам файл не закрывает.
+    """
 
+    def close(self):
+        self.flush()
+        self.file.write(BLOCK_HEADER.pack(0, 0, 0))
 
-class Triangle:
+
+class DocumentReader:
 
     """
-    Класс Triangle, он же Треугольник. Самодельный класс инструмента, призванный отвечать за прорисовку треугольника.
-    Реализовано через рисование многоугольника внутри области прямоугольника по следующему правилу: левый крайний,
-    правый крайний и середина верхнего (или нижнего, в зависимости от того, куда смещена мышь по y относительно начала)
-    основания.
+    Класс DocumentReader, он же Читатель документа. Самодельный служебный класс, который потоком читает документ в
+    родном формате из открытого на чтение двоичного файла. Заголовок и базовый слой читаются сразу, а объекты
+    отдаются по одному при обходе экземпляра в цикле for: в памяти одновременно находится только один блок.
+
+    Параметры при инициализации экземпляра класса DocumentReader:
+        file - двоичный файл, открытый на чтение
+        folder - папка, от которой считаются относительные пути картинок
+        size - размер холста
+        base - базовый слой холста (плитки) или None
+    """
 
-    Параметры при инициализации экземпляра класса Triangle:
-        sx - x точки начала
-        sy - y точки начала
-        x - x точки конца
-        y - y точки конца
-        to_fill - разрешение на заливку
-        size - толщина контура
-        color - цвет контура
-        color_2 - цвет заливки
+    def __init__(self, file, folder=''):
+        super(DocumentReader, self).__init__()
+        self.file = file
+        self.folder = folder
+        magic, version, flags, width, height = HEADER.unpack(self.read(HEADER.size))
+        if magic != DOCUMENT_MAGIC:
+            raise ValueError('Это не документ Qt Paint')
+        if version > DOCUMENT_VERSION:
+            raise ValueError(f'Документ сохранен более новой версией Qt Paint ({version})')
+        self.size = QSize(width, height)
+        self.base = None
+        if flags & 1:
+            self.base = TileStore(width, height)
+            rgba, count = BASE_HEADER.unpack(self.read(BASE_HEADER.size))
+            self.base.background = QColor.fromRgba(rgba)
+            for _ in range(count):
+                tx, ty, length = TILE_HEADER.unpack(self.read(TILE_HEADER.size))
+                tile = QImage.fromData(self.read(length), 'PNG')
+                self.base.tiles[(tx, ty)] = tile.convertToFormat(QImage.Format_RGB32)
+
+    """
+    Метод read. Читает из файла ровно count байт, иначе считает файл оборванным.
     """
 
-    def __init__(self, sx, sy, x, y, fill, size, color, color_2):
-        super(Triangle, self).__init__()
-        self.sx = sx
-        self.sy = sy
-        self.x = x
-        self.y = y
-        self.to_fill = fill
-        self.size = size
-        self.color = color
-        self.color_2 = color_2
+    def read(self, count):
+        data = self.file.read(count)
+        if len(data) != count:
+            raise ValueError('Документ оборван')
+        return data
 
     """
-    Ранее упомянутый метод draw. Задает ручку, а если еще и заливка разрешена, задает кисть (в противном случае, кисть
-    отменяется) и рисует многоугольник по точкам. Координаты точек задаются в соответствии с правилом построения
-    треугольника внутри прямоугольника.
+    Метод __iter__. Читает блоки по одному и отдает объекты из них по одному.
     """
 
-    def draw(self, painter):
-        painter.setPen(QPen(self.color, self.size))
-        if self.to_fill:
-            painter.setBrush(QBrush(self.color_2))
-        else:
-            painter.setBrush(QBrush(Qt.NoBrush))
-        dist = (self.x - self.sx) // 2
-        triangle = QPolygon()
-        triangle.append(QPoint(self.sx, self.sy))
-        triangle.append(QPoint(self.sx + dist, self.y))
-        triangle.append(QPoint(self.x, self.sy))
-        painter.drawPolygon(triangle)
+    def __iter__(self):
+        while True:
+            compressed, length, stored = BLOCK_HEADER.unpack(self.read(BLOCK_HEADER.size))
+            if not length:
+                return
+            data = self.read(stored)
+            if compressed:
+                data = zlib.decompress(data)
+            view = memoryview(data)
+            offset = 0
+            while offset < length:
+                obj, offset = unpackRecord(view, offset, self.folder)
+                yield obj
+
+
+"""
+Функции writeDocument и readDocument. Сохраняют холст (размер, базовый слой и объекты) в файл родного формата и
+читают его обратно. readDocument возвращает размер, базовый слой и список объектов; если объекты нужно сразу
+рисовать, не собирая списка, лучше напрямую обойти DocumentReader.
+"""
+
+
+def writeDocument(path, size, objects, base=None, compress=True):
+    with PROFILER.span('writeDocument', 'document'), open(path, mode='wb') as file:
+        writer = DocumentWriter(file, size, base, compress)
+        for obj in objects:
+            writer.write(obj)
+        writer.close()
+
+
+def readDocument(path):
+    with PROFILER.span('readDocument', 'document'), open(path, mode='rb') as file:
+        reader = DocumentReader(file, os.path.dirname(os.path.abspath(path)))
+        return reader.size, reader.base, list(reader)
+
+
+"""
+Журнал автосохранения. Чтобы после падения приложения или отключения питания не пропало все нарисованное после
+последнего сохранения, каждое законченное действие дописывается в журнал на диске. Весь холст при этом не
+сохраняется: журнал - это снимок холста (документ в родном формате) и дописываемые после него записи действий. Снимки
+и журналы нумеруются поколениями: снимок snapshot-N.qtp и журнал journal-N.bin после него. Новое поколение
+появляется при смене документа и когда журнал вырастает больше JOURNAL_LIMIT (так журнал не растет бесконечно), а
+старое удаляется только после того, как новый снимок целиком записан. При обычном закрытии приложения журнал удаляется,
+поэтому если при запуске он есть, прошлый сеанс завершился аварийно.
+
+Каждое запущенное приложение ведет журнал в своей папке сеанса session-<uuid> внутри JOURNAL_DIR, и папку сторожит
+файл блокировки QLockFile рядом с ней (session-<uuid>.lock). Блокировка со временем не устаревает: она считается
+брошенной, только если процесс, который ее взял, уже не работает. Поэтому второе запущенное приложение не трогает
+чужой журнал и не принимает его за аварийный, а восстановить предлагается только журнал сеанса, чья блокировка брошена
+(см. функцию orphanJournals).
+
+Устройство журнала:
+    заголовок - '<4sHI': сигнатура JOURNAL_MAGIC, версия и номер поколения
+    записи - '<BII': вид записи, длина и контрольная сумма CRC32 содержимого, затем само содержимое. Виды записей:
+        JOURNAL_OBJECT - законченный объект, содержимое - запись родного формата (см. packRecord)
+        JOURNAL_UNDO - отмена последнего действия, содержимого нет
+        JOURNAL_SIZE - холст вырос, содержимое - '<II' (ширина и высота)
+    Запись, оборванную на середине или с неверной контрольной суммой, и все после нее восстановление пропускает.
+"""
+
+JOURNAL_MAGIC = b'QTPJ'
+JOURNAL_VERSION = 1
+JOURNAL_OBJECT = 1
+JOURNAL_UNDO = 2
+JOURNAL_SIZE = 3
+JOURNAL_HEADER = struct.Struct('<4sHI')
+JOURNAL_ENTRY = struct.Struct('<BII')
+JOURNAL_SIZE_RECORD = struct.Struct('<II')
 
 
-class Rectangle:
+class Journal:
 
     """
-    Класс Rectangle, он же Прямоугольник. Самодельный класс инструмента, призванный за прорисовку прямоугольника.
-    Собственно, ничего тут не поменяешь - раз уж есть встроенный метод drawRect по рисованию прямоугольника, используй
-    его.
+    Класс Journal, он же Журнал. Самодельный служебный класс, который ведет журнал автосохранения в папке folder.
+    Холст сообщает ему о каждом законченном действии (метод append), об отмене (метод undo) и о смене документа
+    (метод rollover). Записи упаковываются сразу, а на диск их пишет фоновый поток (метод run): он собирает все
+    записи, накопившиеся за delay секунд, пишет их разом и вызывает fsync один раз на пачку, поэтому рисование не ждет
+    диска, а при падении теряется не больше delay секунд работы. Снимки тоже пишутся в фоновом потоке, с копии плиток
+    базового слоя (TileStore.copy почти ничего не стоит).
+
+    Отмена пишется в журнал отдельной записью, а повтор - как еще одно законченное действие (тот же объект): при
+    восстановлении история отмены начинается со снимка, и повторять ей нечего, а холст выходит тем же. Отменить
+    действие до снимка журнал не может, поэтому тогда холст делает новый снимок.
+
+    Параметры при инициализации экземпляра класса Journal:
+        folder - папка журнала (по умолчанию - новая папка сеанса в JOURNAL_DIR)
+        lock - блокировка папки, файл folder + '.lock'. Берется сразу
+        locked - удалось ли взять блокировку. Если нет, папкой владеет другое работающее приложение
+        replaced - журнал упавшего сеанса, из которого восстановлен холст, или None. Его удаляет фоновый поток, как
+        только записан первый снимок этого журнала
+        limit - после скольких байт записей делается новый снимок
+        delay - сколько секунд фоновый поток собирает записи в одну пачку
+        generation - номер текущего поколения
+        position - номер действия истории отмены, на котором сделан текущий снимок
+        size - размер холста, известный журналу (если холст вырос, перед следующим действием пишется JOURNAL_SIZE)
+        written - сколько байт записей добавлено после текущего снимка
+        syncs - сколько раз фоновый поток вызвал fsync
+        error - текст ошибки записи (после ошибки журнал больше не пишется) или None
+        queue - очередь для фонового потока: байты записей, снимки и None (конец работы)
+        thread - фоновый поток (создается при первом снимке)
+    """
 
-    Параметры при инициализации экземпляра класса Rectangle:
-        sx - x точки начала
-        sy - y точки начала
-        x - x точки конца
-        y - y точки конца
-        to_fill - разрешение на заливку
-        size - толщина контура
-        color - цвет контура
-        color_2 - цвет заливки
+    def __init__(self, folder=None, limit=JOURNAL_LIMIT, delay=JOURNAL_DELAY):
+        super(Journal, self).__init__()
+        if folder is None:
+            folder = os.path.join(JOURNAL_DIR, f'session-{uuid.uuid4().hex}')
+        self.folder = folder
+        self.lock = QLockFile(folder + '.lock')
+        self.lock.setStaleLockTime(0)
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(folder)), exist_ok=True)
+            self.locked = self.lock.tryLock(0)
+        except OSError:
+            self.locked = False
+        self.replaced = None
+        self.limit = limit
+        self.delay = delay
+        self.generation = self.latest() or 0
+        self.position = 0
+        self.size = None
+        self.written = 0
+        self.syncs = 0
+        self.error = None
+        self.queue = queue.Queue()
+        self.thread = None
+
+    """
+    Методы файлов журнала:
+        path - путь к файлу вида kind ('snapshot' или 'journal') поколения generation
+        generations - номера поколений, от которых в папке остались снимки, по возрастанию
+        latest - номер последнего поколения со снимком, или None, если журнала нет
+        discard - удаляет все снимки и журналы из папки, кроме поколения keep. Файл, который удалить не удалось
+        (например, его держит антивирус), остается до следующего раза
+        remove - удаляет весь журнал: файлы, саму папку и блокировку
     """
 
-    def __init__(self, sx, sy, x, y, fill, size, color, color_2):
-        super(Rectangle, self).__init__()
-        self.sx = sx
-        self.sy = sy
-        self.x = x
-        self.y = y
-        self.to_fill = fill
-        self.size = size
-        self.color = color
-        self.color_2 = color_2
+    def path(self, kind, generation):
+        return os.path.join(self.folder, f'{kind}-{generation}.{"qtp" if kind == "snapshot" else "bin"}')
+
+    def generations(self):
+        if not os.path.isdir(self.folder):
+            return []
+        numbers = []
+        for name in os.listdir(self.folder):
+            stem, ext = os.path.splitext(name)
+            if ext == '.qtp' and stem.startswith('snapshot-') and stem[9:].isdigit():
+                numbers.append(int(stem[9:]))
+        return sorted(numbers)
+
+    def latest(self):
+        generations = self.generations()
+        return generations[-1] if generations else None
+
+    def discard(self, keep=None):
+        for generation in self.generations():
+            if generation != keep:
+                for kind in ('snapshot', 'journal'):
+                    try:
+                        os.remove(self.path(kind, generation))
+                    except OSError:
+                        pass
+
+    def remove(self):
+        self.discard()
+        try:
+            os.rmdir(self.folder)
+        except OSError:
+            pass
+        self.lock.unlock()
 
     """
-    Ранее упомянутый метод draw. Задает ручку, а если еще и заливка разрешена, задает кисть (в противном случае, кисть
-    отменяется) и рисует прямоугольник встроенным методом drawRect.
+    Методы, которые вызывает холст:
+        rollover - начинает новое поколение: ставит в очередь снимок холста (размер, базовый слой и объекты) на
+        действии position истории отмены. Фоновый поток запускается при первом снимке
+        append - ставит в очередь законченный объект (перед ним - новый размер холста, если тот изменился). Возвращает
+        True, если журнал перерос limit и пора делать новый снимок
+        undo - ставит в очередь отмену, после которой в истории применено position действий. Возвращает True, если
+        отменено действие до снимка: тогда журнал бессилен, и нужен новый снимок
+        close - дожидается, пока фоновый поток допишет очередь, и останавливает его. С discard=True журнал после этого
+        удаляется (обычное закрытие приложения), иначе только отпускается блокировка
     """
 
-    def draw(self, painter):
-        painter.setPen(QPen(self.color, self.size))
-        if self.to_fill:
-            painter.setBrush(QBrush(self.color_2))
+    def rollover(self, size, base, objects, position):
+        self.generation += 1
+        self.position = position
+        self.size = QSize(size)
+        self.written = 0
+        self.queue.put((self.generation, QSize(size), None if base is None else base.copy(), list(objects)))
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='qtpaint-journal', daemon=True)
+            self.thread.start()
+
+    def append(self, obj, size):
+        if size != self.size:
+            self.size = QSize(size)
+            self.put(JOURNAL_SIZE, JOURNAL_SIZE_RECORD.pack(size.width(), size.height()))
+        self.put(JOURNAL_OBJECT, packRecord(obj))
+        return self.written > self.limit
+
+    def undo(self, position):
+        if position < self.position:
+            return True
+        self.put(JOURNAL_UNDO, b'')
+        return False
+
+    def close(self, discard=True):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        if discard:
+            self.remove()
         else:
-            painter.setBrush(QBrush(Qt.NoBrush))
-        painter.drawRect(self.sx, self.sy, self.x - self.sx, self.y - self.sy)
+            self.lock.unlock()
 
+    """
+    Метод put. Упаковывает запись вида kind с содержимым data и ставит ее в очередь фонового потока.
+    """
 
-class Pentagon:
+    def put(self, kind, data):
+        entry = JOURNAL_ENTRY.pack(kind, len(data), zlib.crc32(data)) + data
+        self.written += len(entry)
+        self.queue.put(entry)
 
     """
-    Класс Pentagon, он же Пятиугольник. Самодельный класс инструмента, призванный отвечать за прорисовку пятиугольника.
-    Реализовано через рисование многоугольника внутри области прямоугольника по следующему правилу
-    (начиная с нижней левой точки, по часовой стрелке): 19% от длины нижнего основания, 61% от длины левого края,
-    половина верхнего основания, 61% от длины правого края и 81% от длины нижнего основания. Это может показаться
-    странным, но именно так рисуется пятиугольник в MS Paint, проверено лично.
+    Метод run. Выполняется в фоновом потоке: ждет первую запись, добирает все, что придет за delay секунд, пишет пачку
+    в журнал и вызывает fsync. Снимок из очереди записывается во временный файл, который переименовывается в snapshot-N
+    только целиком, затем начинается пустой журнал journal-N, и лишь после этого удаляются старые поколения (и журнал
+    replaced, если холст восстановлен из него). None в
+    очереди - дописать все и остановиться. Если писать не удалось, ошибка запоминается, а остальные записи
+    выбрасываются.
+    """
 
-    Параметры при инициализации экземпляра класса Pentagon:
-        sx - x точки начала
-        sy - y точки начала
-        x - x точки конца
-        y - y точки конца
-        to_fill - разрешение на заливку
-        size - толщина контура
-        color - цвет контура
-        color_2 - цвет заливки
+    def run(self):
+        file = None
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.delay
+            while batch[-1] is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            for item in batch:
+                if item is None or self.error is not None:
+                    continue
+                try:
+                    if isinstance(item, tuple):
+                        file = self.writeSnapshot(file, *item)
+                    elif file is not None:
+                        file.write(item)
+                except Exception as error:
+                    self.error = str(error)
+            if file is not None and self.error is None:
+                try:
+                    file.flush()
+                    os.fsync(file.fileno())
+                    self.syncs += 1
+                except OSError as error:
+                    self.error = str(error)
+            if batch[-1] is None:
+                if file is not None:
+                    file.close()
+                return
+
+    """
+    Метод writeSnapshot. Закрывает журнал file прошлого поколения, записывает снимок поколения generation и открывает
+    для него новый журнал. Возвращает новый журнал.
     """
 
-    def __init__(self, sx, sy, x, y, fill, size, color, color_2):
-        super(Pentagon, self).__init__()
-        self.sx = sx
-        self.sy = sy
-        self.x = x
-        self.y = y
-        self.to_fill = fill
-        self.size = size
-        self.color = color
-        self.color_2 = color_2
+    def writeSnapshot(self, file, generation, size, base, objects):
+        if file is not None:
+            file.flush()
+            os.fsync(file.fileno())
+            file.close()
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.path('snapshot', generation)
+        with open(path + '.part', mode='wb') as snapshot:
+            writer = DocumentWriter(snapshot, size, base)
+            for obj in objects:
+                writer.write(obj)
+            writer.close()
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(path + '.part', path)
+        file = open(self.path('journal', generation), mode='wb')
+        file.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION, generation))
+        self.discard(keep=generation)
+        if self.replaced is not None:
+            self.replaced.remove()
+            self.replaced = None
+        return file
 
     """
-    Ранее упомянутый метод draw. Задает ручку, а если еще и заливка разрешена, задает кисть (в противном случае, кисть
-    отменяется) и рисует многоугольник по точкам. Координаты точек задаются в соответствии с правилом построения
-    пятиугольника внутри прямоугольника.
+    Метод read. Читает последнее поколение журнала: возвращает размер холста, базовый слой и объекты снимка и список
+    записей после него - пар из вида записи и объекта (JOURNAL_OBJECT), размера (JOURNAL_SIZE) или None (JOURNAL_UNDO).
+    Журнала поколения может не быть (приложение упало сразу после снимка) - тогда записей нет.
     """
 
-    def draw(self, painter):
-        painter.setPen(QPen(self.color, self.size))
-        if self.to_fill:
-            painter.setBrush(QBrush(self.color_2))
-        else:
-            painter.setBrush(QBrush(Qt.NoBrush))
-        pentagon = QPolygon()
-        dist_x = self.x - self.sx
-        dist_y = self.y - self.sy
-        pentagon.append(QPoint(self.sx + int(dist_x * 0.19), self.sy))
-        pentagon.append(QPoint(self.sx, self.sy + int(dist_y * 0.61)))
-        pentagon.append(QPoint(self.sx + dist_x // 2, self.y))
-        pentagon.append(QPoint(self.x, self.sy + int(dist_y * 0.61)))
-        pentagon.append(QPoint(self.sx + int(dist_x * 0.81), self.sy))
-        painter.drawPolygon(pentagon)
+    def read(self):
+        generation = self.latest()
+        if generation is None:
+            raise ValueError('Журнала автосохранения нет')
+        size, base, objects = readDocument(self.path('snapshot', generation))
+        entries = []
+        path = self.path('journal', generation)
+        if os.path.exists(path):
+            with open(path, mode='rb') as file:
+                data = file.read()
+            if len(data) >= JOURNAL_HEADER.size:
+                magic, version, number = JOURNAL_HEADER.unpack_from(data)
+                if magic != JOURNAL_MAGIC or version > JOURNAL_VERSION or number != generation:
+                    raise ValueError('Журнал автосохранения поврежден')
+                offset = JOURNAL_HEADER.size
+                while offset + JOURNAL_ENTRY.size <= len(data):
+                    kind, length, crc = JOURNAL_ENTRY.unpack_from(data, offset)
+                    offset += JOURNAL_ENTRY.size
+                    payload = data[offset:offset + length]
+                    if len(payload) != length or zlib.crc32(payload) != crc:
+                        break
+                    offset += length
+                    if kind == JOURNAL_OBJECT:
+                        entries.append((kind, unpackRecord(memoryview(payload), 0)[0]))
+                    elif kind == JOURNAL_SIZE:
+                        entries.append((kind, QSize(*JOURNAL_SIZE_RECORD.unpack(payload))))
+                    else:
+                        entries.append((kind, None))
+        return size, base, objects, entries
 
 
-class Hexagon:
+"""
+Функция orphanJournals. Ищет в папке folder журналы упавших сеансов - папки сеансов, чью блокировку удалось взять
+(процесс-владелец уже не работает). Пустые брошенные сеансы сразу удаляются. Возвращает журналы со снимками,
+заблокированные этим приложением, от старых к новым.
+"""
 
-    """
-    Класс Hexagon, он же Шестиугольник. Самодельный класс инструмента, призванный отвечать за прорисовку шестиугольника.
-    Реализовано через рисование многоугольника внутри области прямоугольника по следующему правилу
-    (начиная с нижней точки, по часовой стрелке): середина нижнего основания, 25% от длины левого края,
-    75% от длины левого края, середина верхнего основания, 75% от длины правого края и 25% от длины правого края.
-    Это может показаться странным, но именно так рисуется шестиугольник в MS Paint, проверено лично.
 
-    Параметры при инициализации экземпляра класса Hexagon:
-        sx - x точки начала
-        sy - y точки начала
-        x - x точки конца
-        y - y точки конца
-        to_fill - разрешение на заливку
-        size - толщина контура
-        color - цвет контура
-        color_2 - цвет заливки
+def orphanJournals(folder=JOURNAL_DIR):
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return []
+    sessions = {name[:-5] if name.endswith('.lock') else name for name in names if name.startswith('session-')}
+    orphans = []
+    for name in sessions:
+        journal = Journal(os.path.join(folder, name))
+        if not journal.locked:
+            continue
+        generation = journal.latest()
+        if generation is None:
+            journal.remove()
+            continue
+        try:
+            orphans.append((os.path.getmtime(journal.path('snapshot', generation)), journal))
+        except OSError:
+            journal.lock.unlock()
+    return [journal for _, journal in sorted(orphans, key=lambda orphan: orphan[0])]
+
+
+class SaveSignals(QObject):
+
+    """
+    Класс SaveSignals, он же Сигналы сохранения. QRunnable не умеет посылать сигналы, поэтому фоновое сохранение
+    посылает их через этот объект. Сигналы из рабочего потока доходят до окна через его цикл событий.
+        progress - сколько процентов работы сделано
+        finished - картинка записана, передается путь к файлу
+        failed - сохранить не удалось, передается текст ошибки
+        cancelled - сохранение отменено, файл не тронут
     """
 
-    def __init__(self, sx, sy, x, y, fill, size, color, color_2):
-        super(Hexagon, self).__init__()
-        self.sx = sx
-        self.sy = sy
-        self.x = x
-        self.y = y
-        self.to_fill = fill
-        self.size = size
-        self.color = color
-        self.color_2 = color_2
+    progress = pyqtSignal(int)
+    finished = pyqtSignal(str)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+
+class SaveTask(QRunnable):
 
     """
-    Ранее упомянутый метод draw. Задает ручку, а если еще и заливка разрешена, задает кисть (в противном случае, кисть
-    отменяется) и рисует многоугольник по точкам. Координаты точек задаются в соответствии с правилом построения
-    шестиугольника внутри прямоугольника.
+    Класс SaveTask, он же Фоновое сохранение. Собирает картинку из плиток холста и кодирует ее в файл в потоке из
+    QThreadPool, чтобы окно не замирало на больших картинках. Работает со снимком плиток (TileStore.copy), который
+    делается при создании задачи, поэтому рисовать во время сохранения можно: в файл попадет холст на момент
+    сохранения. Картинка сначала пишется во временный файл рядом с нужным и только в самом конце переименовывается,
+    поэтому отмена или ошибка не портят уже существующий файл. Картинка собирается в полном 32-битном цвете прямо из
+    плиток, объекты заново не рисуются. Кодировщики Qt принимают только картинку целиком, поэтому на время
+    сохранения память нужна на весь холст, а не только на закрашенные плитки.
+
+    Параметры при инициализации экземпляра класса SaveTask:
+        store - снимок плиток холста
+        file - куда сохранить картинку
+        format - формат картинки, берется по расширению файла
+        options - настройки кодирования по форматам (по умолчанию SAVE_OPTIONS)
+        signals - сигналы о ходе сохранения (см. класс SaveSignals)
+        stopped - попросили ли отменить сохранение
     """
 
-    def draw(self, painter):
-        painter.setPen(QPen(self.color, self.size))
-        if self.to_fill:
-            painter.setBrush(QBrush(self.color_2))
-        else:
-            painter.setBrush(QBrush(Qt.NoBrush))
-        hexagon = QPolygon()
-        dist_x = self.x - self.sx
-        dist_y = self.y - self.sy
-        hexagon.append(QPoint(self.sx + dist_x // 2, self.sy))
-        hexagon.append(QPoint(self.sx, self.sy + int(dist_y * 0.25)))
-        hexagon.append(QPoint(self.sx, self.sy + int(dist_y * 0.75)))
-        hexagon.append(QPoint(self.sx + dist_x // 2, self.y))
-        hexagon.append(QPoint(self.x, self.sy + int(dist_y * 0.75)))
-        hexagon.append(QPoint(self.x, self.sy + int(dist_y * 0.25)))
-        painter.drawPolygon(hexagon)
+    def __init__(self, store, file, options=None):
+        super(SaveTask, self).__init__()
+        self.store = store.copy()
+        self.file = file
+        self.format = os.path.splitext(file)[1][1:].lower().replace('jpeg', 'jpg')
+        self.options = SAVE_OPTIONS if options is None else options
+        self.signals = SaveSignals()
+        self.stopped = False
 
+    """
+    Метод cancel. Просит остановить сохранение. Вызывается из окна, а рабочий поток проверяет флаг между полосами
+    плиток и после кодирования.
+    """
 
-class Octagon:
+    def cancel(self):
+        self.stopped = True
 
     """
-    Класс Octagon, он же Восьмиугольник. Самодельный класс инструмента, призванный отвечать за прорисовку
-    восьмиугольника. Реализовано через рисование многоугольника внутри области прямоугольника по следующему правилу
-    (начиная с нижней левой точки, по часовой стрелке): 25% от длины нижнего основания, 25% от длины левого края,
-    75% от длины левого края, 25% от длины верхнего основания, 75% от длины верхнего основания,
-    75% от длины правого края, 25% от длины правого края и 75% от длины нижнего основания. Это может показаться
-    странным, но именно так рисуется восьмиугольник в MS Paint, проверено лично.
+    Методы run и save. Выполняются в рабочем потоке: собирают картинку (до 90%), кодируют ее во временный файл и
+    переименовывают его в нужный. run только замеряет save целиком (см. класс Profiler), сборка и кодирование
+    замеряются еще и по отдельности.
+    """
+
+    def run(self):
+        with PROFILER.span('SaveTask', 'save', {'format': self.format}):
+            self.save()
+
+    def save(self):
+        temp = self.file + '.part'
+        try:
+            with PROFILER.span('SaveTask.compose', 'save'):
+                image = self.compose()
+            if image is None:
+                self.signals.cancelled.emit()
+                return
+            writer = QImageWriter(temp, self.format.encode())
+            writer.setQuality(self.quality())
+            with PROFILER.span('SaveTask.encode', 'save'):
+                written = writer.write(image)
+            if not written:
+                raise OSError(writer.errorString())
+            if self.stopped:
+                os.remove(temp)
+                self.signals.cancelled.emit()
+                return
+            os.replace(temp, self.file)
+            self.signals.progress.emit(100)
+            self.signals.finished.emit(self.file)
+        except Exception as error:
+            if os.path.exists(temp):
+                os.remove(temp)
+            self.signals.failed.emit(str(error))
 
-    Параметры при инициализации экземпляра класса Octagon:
-        sx - x точки начала
-        sy - y точки начала
-        x - x точки конца
-        y - y точки конца
-        to_fill - разрешение на заливку
-        size - толщина контура
-        color - цвет контура
-        color_2 - цвет заливки
+    """
+    Метод compose. Переносит плитки снимка на одну картинку полосами высотой в плитку, после каждой полосы сообщает о
+    ходе работы. Возвращает картинку или None, если сохранение отменили.
     """
 
-    def __init__(self, sx, sy, x, y, fill, size, color, color_2):
-        super(Octagon, self).__init__()
-        self.sx = sx
-        self.sy = sy
-        self.x = x
-        self.y = y
-        self.to_fill = fill
-        self.size = size
-        self.color = color
-        self.color_2 = color_2
+    def compose(self):
+        image = QImage(self.store.size(), QImage.Format_RGB32)
+        painter = QPainter(image)
+        height = self.store.height
+        for top in range(0, height, TILE_SIZE):
+            if self.stopped:
+                painter.end()
+                return None
+            self.store.blit(painter, QRect(0, top, self.store.width, TILE_SIZE))
+            self.signals.progress.emit(min(top + TILE_SIZE, height) * 90 // height)
+        painter.end()
+        return image
 
     """
-    Ранее упомянутый метод draw. Задает ручку, а если еще и заливка разрешена, задает кисть (в противном случае, кисть
-    отменяется) и рисует многоугольник по точкам. Координаты точек задаются в соответствии с правилом построения
-    восьмиугольника внутри прямоугольника.
+    Метод quality. Переводит настройки кодирования формата в "качество" QImageWriter. Для PNG Qt считает степень сжатия
+    из качества как (100 - качество) * 9 / 91, поэтому степень сжатия переводится обратно с округлением вверх. Если
+    настроек для формата нет, возвращает -1 (настройки Qt по умолчанию).
     """
 
-    def draw(self, painter):
-        painter.setPen(QPen(self.color, self.size))
-        if self.to_fill:
-            painter.setBrush(QBrush(self.color_2))
-        else:
-            painter.setBrush(QBrush(Qt.NoBrush))
-        octagon = QPolygon()
-        dist_x = self.x - self.sx
-        dist_y = self.y - self.sy
-        octagon.append(QPoint(self.sx + int(dist_x * 0.25), self.sy))
-        octagon.append(QPoint(self.sx, self.sy + int(dist_y * 0.25)))
-        octagon.append(QPoint(self.sx, self.sy + int(dist_y * 0.75)))
-        octagon.append(QPoint(self.sx + int(dist_x * 0.25), self.y))
-        octagon.append(QPoint(self.sx + int(dist_x * 0.75), self.y))
-        octagon.append(QPoint(self.x, self.sy + int(dist_y * 0.75)))
-        octagon.append(QPoint(self.x, self.sy + int(dist_y * 0.25)))
-        octagon.append(QPoint(self.sx + int(dist_x * 0.75), self.sy))
-        painter.drawPolygon(octagon)
+    def quality(self):
+        options = self.options.get(self.format, {})
+        if 'compression' in options:
+            return 100 - (options['compression'] * 91 + 8) // 9
+        return options.get('quality', -1)
 
 
-class Fill:
+"""
+Функции чтения открываемых картинок:
+    readBitmap - если file - несжатый BMP (24 или 32 бита на пиксель), отображает файл в память (mmap) и возвращает
+    его пиксели как массив uint8 (строки x столбцы x каналы B, G, R и, у 32-битных, неиспользуемый) сверху вниз. Массив
+    смотрит прямо в файл: пиксели не копируются в Python, а система сама подгружает с диска только те страницы, к
+    которым обращаются. Для остальных файлов возвращает None
+    bitmapImage - копирует такой массив (или его часть) в новую картинку RGB32 размером size (по умолчанию - размером
+    массива), остальное заливает цветом color
+    imageFormat - переводит картинку в формат, который QPainter рисует быстрее всего: RGB32 для непрозрачных и
+    ARGB32_Premultiplied для прозрачных
+    imageTile - вырезает из картинки image, лежащей на холсте в точке origin, плитку с левым верхним углом (x, y).
+    Плитка целиком внутри непрозрачной картинки просто копируется, иначе картинка рисуется на плитку, залитую цветом
+    color (как ее нарисовал бы Image.draw)
+"""
 
-    """
-    Класс Fill, он же Заливка. Самодельный класс инструмента, призванный отвечать за заливку всего холста.
-    По сути, рисует прямоугольник с заливкой во весь холст.
+BITMAP_HEADER = struct.Struct('<2sIHHIIiiHHI')
 
-    Параметры при инициализации экземпляра класса Fill:
-        w - ширина
-        h - высота
-        color - цвет заливки
-    """
 
-    def __init__(self, w, h, color):
-        super(Fill, self).__init__()
-        self.w = w
-        self.h = h
-        self.color = color
+def readBitmap(file):
+    with open(file, mode='rb') as stream:
+        header = stream.read(BITMAP_HEADER.size)
+        if len(header) < BITMAP_HEADER.size:
+            return None
+        magic, _, _, _, offset, info, width, height, _, bits, compression = BITMAP_HEADER.unpack(header)
+        if magic != b'BM' or info < 40 or bits not in (24, 32) or compression != 0 or width <= 0 or height == 0:
+            return None
+        stride = (width * bits + 31) // 32 * 4
+        rows = abs(height)
+        if offset + stride * rows > os.fstat(stream.fileno()).st_size:
+            return None
+        memory = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+    pixels = numpy.frombuffer(memory, numpy.uint8, stride * rows, offset).reshape(rows, stride)
+    pixels = pixels[:, :width * bits // 8].reshape(rows, width, bits // 8)
+    return pixels[::-1] if height > 0 else pixels
+
+
+def bitmapImage(pixels, size=None, color=Qt.white):
+    height, width = pixels.shape[:2]
+    image = QImage(QSize(width, height) if size is None else size, QImage.Format_RGB32)
+    image.fill(color)
+    channels = imagePixels(image, True).view(numpy.uint8).reshape(image.height(), -1, 4)
+    channels[:height, :width, :3] = pixels[:image.height(), :image.width(), :3]
+    return image
+
+
+def imageFormat(image):
+    if image.hasAlphaChannel():
+        return image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+    return image.convertToFormat(QImage.Format_RGB32)
+
+
+def imageTile(image, origin, x, y, color):
+    rect = QRect(x, y, TILE_SIZE, TILE_SIZE).translated(-origin)
+    if not image.hasAlphaChannel() and image.rect().contains(rect):
+        return image.copy(rect)
+    tile = QImage(TILE_SIZE, TILE_SIZE, QImage.Format_RGB32)
+    tile.fill(color)
+    painter = QPainter(tile)
+    painter.drawImage(QPoint(0, 0), image, rect)
+    painter.end()
+    return tile
+
+
+class LoadSignals(QObject):
 
     """
-    Ранее упомянутый метод draw. Задает ручку и кисть одного и того же цвета и рисует прямоугольник от начала холста
-    до его конца.
+    Класс LoadSignals, он же Сигналы чтения. Через него фоновое чтение картинки (см. класс LoadTask) сообщает окну о
+    ходе работы.
+        preview - готова уменьшенная картинка
+        tiles - готовы плитки картинки в полном размере, передается словарь, как TileStore.tiles
+        progress - сколько процентов плиток готово
+        finished - картинка прочитана целиком, передается она сама (None, если она читалась из памяти по частям и
+        целиком не собиралась)
+        failed - прочитать не удалось, передается текст ошибки
     """
 
-    def draw(self, painter):
-        painter.setPen(QPen(self.color))
-        painter.setBrush(QBrush(self.color))
-        painter.drawRect(0, 0, self.w, self.h)
+    preview = pyqtSignal(QImage)
+    tiles = pyqtSignal(dict)
+    progress = pyqtSignal(int)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
 
 
-class Image:
+class LoadTask(QRunnable):
 
     """
-    Класс Image, он же Картинка. Самодельный класс инструмента, призванный отвечать за прорисовку загруженной
-    пользователем картинки. Класс открывает картинку в виде объекта QImage и рисует ее на холст в исходном размере в
-    верхний левый край.
-
-    Параметры при инициализации экземпляра класса Image:
+    Класс LoadTask, он же Фоновое чтение. Читает открываемую картинку в потоке из QThreadPool, чтобы окно не замирало
+    на огромных файлах, и отдает ее по частям, от быстрого к медленному:
+        - сначала уменьшенную копию со стороной не больше LOAD_PREVIEW. Если формат умеет уменьшать при чтении
+        (см. LOAD_PARTIAL_FORMATS), копия читается сразу уменьшенной и стоит долю полного чтения, иначе она
+        получается из полной картинки
+        - затем, если формат умеет читать часть картинки (clip rect), - плитки видимой части холста visible
+        - и, наконец, все остальные плитки в полном размере, по рядам сверху вниз
+    Несжатый BMP не читается через Qt вовсе: его пиксели берутся прямо из отображенного в память файла (см. функцию
+    readBitmap), уменьшенная копия - это каждый n-й пиксель, а плитки копируются из файла по одной.
+
+    Параметры при инициализации экземпляра класса LoadTask:
         file - файл с картинкой
+        size - размер картинки (из заголовка файла)
+        visible - видимая часть холста
+        background - цвет фона холста
+        signals - сигналы о ходе чтения (см. класс LoadSignals)
+        stopped - попросили ли отменить чтение
+        done - номера уже отданных плиток
     """
 
-    def __init__(self, file):
-        super(Image, self).__init__()
+    def __init__(self, file, size, visible, background):
+        super(LoadTask, self).__init__()
         self.file = file
+        self.size = size
+        self.visible = visible
+        self.background = QColor(background)
+        self.signals = LoadSignals()
+        self.stopped = False
+        self.done = set()
 
     """
-    Ранее упомянутый метод draw. Загружает выбранный файл в класс QImage и передает ее "рисовальшику".
+    Метод cancel. Просит остановить чтение. Рабочий поток проверяет флаг между рядами плиток и после каждого шага, а
+    после отмены никаких сигналов больше не посылает.
     """
 
-    def draw(self, painter):
-        image = QImage()
-        image.load(self.file)
-        painter.drawImage(image.rect(), image)
+    def cancel(self):
+        self.stopped = True
 
+    """
+    Метод run. Выполняется в рабочем потоке: выбирает способ чтения и сообщает о результате.
+    """
 
-class Save(Canvas):
+    def run(self):
+        try:
+            pixels = readBitmap(self.file)
+            with PROFILER.span('LoadTask', 'open', {'bitmap': pixels is not None}):
+                image = self.readImage() if pixels is None else self.readPixels(pixels)
+            if not self.stopped:
+                self.signals.finished.emit(image)
+        except Exception as error:
+            if not self.stopped:
+                self.signals.failed.emit(str(error))
 
     """
-    Класс Save, он же Сохранение. Самодельный служебный класс, призванный отвечать за сохранение разрисованного холста.
-    Зарисовывает весь холст на отдельную картинку и сохраняет ее. Класс наследован от Canvas из-за того, что
-    возможностью открыть окно сохранения обладает только класс QWidget, от которого и наследован Canvas.
+    Методы чтения:
+        readPixels - читает несжатый BMP из памяти: уменьшенная копия и плитки берутся прямо из массива пикселей
+        readImage - читает картинку через QImageReader: уменьшенная копия (при чтении, если формат это умеет, иначе из
+        полной картинки), видимая часть (если формат умеет читать часть) и вся картинка в полном размере
+        sendTiles - отдает по рядам все еще не отданные плитки внутри прямоугольника rect, которые строит функция
+        tile(x, y). Возвращает False, если чтение отменили
+    """
+
+    def readPixels(self, pixels):
+        step = -(-max(self.size.width(), self.size.height()) // LOAD_PREVIEW)
+        self.signals.preview.emit(bitmapImage(pixels[::step, ::step]))
+        size = QSize(TILE_SIZE, TILE_SIZE)
+        self.sendTiles(QRect(QPoint(0, 0), self.size),
+                       lambda x, y: bitmapImage(pixels[y:y + TILE_SIZE, x:x + TILE_SIZE], size, self.background))
+        return None
+
+    def readImage(self):
+        reader = QImageReader(self.file)
+        partial = bytes(reader.format()) in LOAD_PARTIAL_FORMATS
+        preview = self.size.scaled(LOAD_PREVIEW, LOAD_PREVIEW, Qt.KeepAspectRatio)
+        small = preview.width() < self.size.width() or preview.height() < self.size.height()
+        if small and partial and reader.supportsOption(QImageIOHandler.ScaledSize):
+            reader.setScaledSize(preview)
+            self.signals.preview.emit(reader.read())
+            reader = QImageReader(self.file)
+            small = False
+        whole = QRect(QPoint(0, 0), self.size)
+        visible = self.visible.intersected(whole)
+        if visible != whole and partial and reader.supportsOption(QImageIOHandler.ClipRect):
+            visible.setCoords(visible.left() // TILE_SIZE * TILE_SIZE, visible.top() // TILE_SIZE * TILE_SIZE,
+                              visible.right() // TILE_SIZE * TILE_SIZE + TILE_SIZE - 1,
+                              visible.bottom() // TILE_SIZE * TILE_SIZE + TILE_SIZE - 1)
+            visible = visible.intersected(whole)
+            reader.setClipRect(visible)
+            part = imageFormat(reader.read())
+            if not part.isNull():
+                if not self.sendTiles(visible, lambda x, y: imageTile(part, visible.topLeft(), x, y, self.background)):
+                    return None
+            reader = QImageReader(self.file)
+        image = reader.read()
+        if image.isNull():
+            raise OSError(reader.errorString())
+        if self.stopped:
+            return None
+        image = imageFormat(image)
+        if small:
+            self.signals.preview.emit(image.scaled(preview, Qt.IgnoreAspectRatio, Qt.FastTransformation))
+        if not self.sendTiles(whole, lambda x, y: imageTile(image, QPoint(0, 0), x, y, self.background)):
+            return None
+        return image
+
+    def sendTiles(self, rect, tile):
+        count = -(-self.size.height() // TILE_SIZE) * -(-self.size.width() // TILE_SIZE)
+        for ty in range(rect.top() // TILE_SIZE, rect.bottom() // TILE_SIZE + 1):
+            if self.stopped:
+                return False
+            tiles = {}
+            for tx in range(rect.left() // TILE_SIZE, rect.right() // TILE_SIZE + 1):
+                if (tx, ty) not in self.done:
+                    tiles[(tx, ty)] = tile(tx * TILE_SIZE, ty * TILE_SIZE)
+            self.done.update(tiles)
+            if tiles:
+                self.signals.tiles.emit(tiles)
+            self.signals.progress.emit(len(self.done) * 100 // count)
+        return True
+
+
+class StartupProfile(QObject):
 
-    Параметры при инициализации экземпляра класса Save:
-        size - размер (на деле, просто переданный размер холста)
+    """
+    Класс StartupProfile, он же Замер запуска. Включается ключом --profile-startup и записывает, сколько длилась
+    каждая фаза запуска: от начала выполнения модуля (STARTUP_TIME) до первой отрисовки холста. Фазы отмечаются
+    функцией markStartup в конце каждой фазы. Стартовое диалоговое окно ждет пользователя, поэтому его фаза
+    помечается как ожидание и в итог "без ожидания" не входит. Конец запуска - первая отрисовка холста: замер следит
+    за событиями холста, и когда приходит первое событие отрисовки, после него (когда кадр уже нарисован) отмечает
+    последнюю фазу и печатает таблицу.
+    Параметры инициализации:
+        start - момент начала отсчета (по time.perf_counter)
     """
 
-    def __init__(self, size):
-        super(Save, self).__init__()
-        self.file = None
-        self.image = QImage(size, QImage.Format_RGB16)
-        self.image.fill(Qt.white)
+    def __init__(self, start):
+        super(StartupProfile, self).__init__()
+        self.phases = []
+        self.last = start
+        self.start = start
 
     """
-    Метод save. Рисует на созданной картинке все объекты по очереди и спрашивает у пользователя, куда сохранить
-    картинку. Если пользователь дал файл, сохраняем, иначе игнорируем.
+    Методы замера:
+        mark - заканчивает фазу name: записывает, сколько прошло с конца прошлой фазы. waiting - фаза ждала
+        пользователя
+        watch - начинает ждать первой отрисовки виджета widget
+        eventFilter - встроенный метод QObject, получает события холста. На первом событии отрисовки перестает
+        следить за холстом и откладывает конец замера до следующего прохода цикла событий
+        finish - отмечает фазу первой отрисовки и печатает таблицу
+        report - возвращает таблицу фаз текстом: длительность каждой фазы в миллисекундах, общий итог и итог без
+        ожидания пользователя
     """
 
-    def save(self, objects):
-        painter = QPainter(self.image)
-        for obj in objects:
-            obj.draw(painter)
-        painter.end()
-        self.file = QFileDialog.getSaveFileName(self, 'Сохранение', 'C:/', '(*.png);;(*.jpg);;(*.bmp)')[0]
-        if self.file:
-            self.image.save(self.file)
+    def mark(self, name, waiting=False):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last, waiting))
+        self.last = now
+
+    def watch(self, widget):
+        widget.installEventFilter(self)
+
+    def eventFilter(self, widget, event):
+        if event.type() == QEvent.Paint:
+            widget.removeEventFilter(self)
+            QTimer.singleShot(0, self.finish)
+        return False
+
+    def finish(self):
+        self.mark('первая отрисовка')
+        print(self.report(), flush=True)
+
+    def report(self):
+        width = max(len(name) for name, _, _ in self.phases)
+        lines = ['Запуск до первой отрисовки:']
+        for name, seconds, waiting in self.phases:
+            note = ' (ожидание пользователя)' if waiting else ''
+            lines.append(f'    {name:<{width}} {seconds * 1000:9.1f} мс{note}')
+        total = self.last - self.start
+        busy = total - sum(seconds for _, seconds, waiting in self.phases if waiting)
+        lines.append(f'    {"всего":<{width}} {total * 1000:9.1f} мс, без ожидания {busy * 1000:.1f} мс')
+        return '\n'.join(lines)
+
+
+"""
+Функция markStartup. Заканчивает фазу запуска name, если включен режим --profile-startup (см. класс StartupProfile),
+иначе ничего не делает.
+"""
+
+
+def markStartup(name, waiting=False):
+    if STARTUP_PROFILE is not None:
+        STARTUP_PROFILE.mark(name, waiting)
 
 
 class Window(QMainWindow):
@@ -1006,13 +5495,18 @@ class Window(QMainWindow):
         значение по умолчанию
         - Подвязываем кнопки инструментов к действиям смены инструментов
         - Подвязываем кнопки переключения цветов и флажок заливки
-        - Подтягиваем служебные команды из разделов "Файл" и "Инфо" к приложению
+        - Подтягиваем служебные команды из разделов "Файл", "Правка", "Вид" и "Инфо" к приложению, а масштаб холста
+        и частоту движений мыши и кадров показываем в строке состояния. В разделе "Вид" также включаются панель
+        показателей производительности и запись трассировки
         - На конец, подключаем все кнопки цветов
+        - Если прошлый сеанс завершился аварийно, предлагаем восстановить рисунок из журнала автосохранения и начинаем
+        вести журнал заново
     """
 
     def __init__(self):
         super(Window, self).__init__()
         uic.loadUi(dir_ui, self)
+        markStartup('интерфейс (window.ui)')
 
         self.main_widget.setEnabled(False)
         self.setMouseTracking(True)
@@ -1024,7 +5518,9 @@ class Window(QMainWindow):
         self.message.setWindowTitle('Перед запуском')
         self.message.setText('Чтобы начать работу, создайте новый холст или откройте существующую картинку.')
         self.message.addButton('ОК', QMessageBox.YesRole)
+        markStartup('стартовое окно (создание)')
         self.message.exec()
+        markStartup('стартовое окно (показ)', waiting=True)
         self.menubar.setEnabled(True)
 
         self.canvas = Canvas()
@@ -1032,6 +5528,7 @@ class Window(QMainWindow):
         self.color_layout.addWidget(self.canvas.color_pix1, 0, 0)
         self.color_layout.addWidget(self.canvas.color_pix2, 0, 1)
         self.canvas.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        markStartup('холст')
 
         self.size_box.addItems(MAINSIZE_KEYS.keys())
         self.size_box.activated.connect(self.canvas.setSize)
@@ -1051,6 +5548,10 @@ class Window(QMainWindow):
         self.action_brush.triggered.connect(self.canvas.setBrush)
         self.action_pencil.triggered.connect(self.canvas.setPencil)
         self.action_fill.triggered.connect(self.canvas.setFill)
+        self.action_bucket.triggered.connect(self.canvas.setBucket)
+        self.action_tolerance.triggered.connect(self.askTolerance)
+        self.action_simplify.triggered.connect(self.askSimplify)
+        self.action_smoothing.toggled.connect(self.canvas.setSmoothing)
         self.action_eraser.triggered.connect(self.canvas.setEraser)
         self.action_line.triggered.connect(self.canvas.setLine)
         self.action_circle.triggered.connect(self.canvas.setCircle)
@@ -1067,11 +5568,36 @@ class Window(QMainWindow):
 
         self.action_open.triggered.connect(self.openFile)
         self.action_save.triggered.connect(self.saveFile)
+        self.action_opendoc.triggered.connect(self.openDocument)
+        self.action_savedoc.triggered.connect(self.saveDocument)
+        self.action_saveoptions.triggered.connect(self.saveOptions)
+        self.action_undo.triggered.connect(self.canvas.undo)
+        self.action_redo.triggered.connect(self.canvas.redo)
+        self.action_filters.triggered.connect(self.showFilters)
+        self.action_zoomin.triggered.connect(self.canvas.zoomIn)
+        self.action_zoomout.triggered.connect(self.canvas.zoomOut)
+        self.action_zoomreset.triggered.connect(self.canvas.zoomReset)
+        self.action_zoomfit.triggered.connect(self.canvas.zoomFit)
+        self.action_hud.toggled.connect(self.canvas.setHud)
+        self.action_trace.toggled.connect(self.recordTrace)
+        self.zoom_label = QLabel('100%')
+        self.input_label = QLabel()
+        self.statusbar.addPermanentWidget(self.input_label)
+        self.statusbar.addPermanentWidget(self.zoom_label)
+        self.canvas.zoomChanged.connect(self.showZoom)
+        self.canvas.inputRate.connect(self.showInputRate)
+        self.canvas.strokeSimplified.connect(self.showSimplified)
         self.action_create.triggered.connect(self.newCanvas)
         self.action_clear.triggered.connect(self.clearCanvas)
         self.action_aboutme.triggered.connect(self.aboutProgram)
         self.action_help.triggered.connect(self.helpMe)
 
+        self.save_task = None
+        self.save_progress = None
+        self.save_options = {fmt: dict(options) for fmt, options in SAVE_OPTIONS.items()}
+        self.load_task = None
+        self.load_loop = None
+
         self.red_button.setDefaultAction(self.action_red)
         self.red_button.setText('')
         self.orange_button.setDefaultAction(self.action_orange)
@@ -1115,32 +5641,385 @@ class Window(QMainWindow):
         self.action_brown.triggered.connect(self.canvas.setBrown)
         self.action_darkred.triggered.connect(self.canvas.setDarkRed)
         self.action_pink.triggered.connect(self.canvas.setPink)
+        markStartup('кнопки и сигналы')
+
+        self.journal = Journal()
+        orphans = orphanJournals()
+        self.recoverJournal(orphans)
+        self.canvas.journal = self.journal
+        self.canvas.snapshotJournal()
+        markStartup('журнал автосохранения', waiting=bool(orphans))
+
+    """
+    Метод recoverJournal. Если остались журналы упавших сеансов orphans (см. функцию orphanJournals), спрашивает
+    пользователя, восстановить ли рисунок из самого нового. Если да, холст открывает снимок из журнала и повторяет
+    поверх него записанные действия: объекты, отмены и рост холста. Восстановленный рисунок считается несохраненным, а
+    старый журнал удаляется, как только журнал этого сеанса запишет свой первый снимок. Если нет или восстановить не
+    удалось, старый журнал удаляется сразу. Остальные упавшие сеансы отпускаются и будут предложены при следующем
+    запуске.
+    """
+
+    def recoverJournal(self, orphans):
+        if not orphans:
+            return
+        orphan = orphans[-1]
+        for journal in orphans[:-1]:
+            journal.lock.unlock()
+        self.message = QMessageBox()
+        setIcon(self.message)
+        self.message.setIcon(QMessageBox.Warning)
+        self.message.setWindowTitle('Восстановление')
+        self.message.setText('Прошлый сеанс завершился аварийно.\nВосстановить несохраненный рисунок?\n')
+        self.message.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
+        btnyes = self.message.button(QMessageBox.Yes)
+        btnyes.setText('Да')
+        btnno = self.message.button(QMessageBox.No)
+        btnno.setText('Нет')
+        self.message.exec()
+        if self.message.clickedButton() != btnyes:
+            orphan.remove()
+            return
+        try:
+            size, base, objects, entries = orphan.read()
+            self.canvas.load(size, base, objects)
+            self.canvas.resetHistory()
+            for kind, value in entries:
+                if kind == JOURNAL_OBJECT:
+                    self.canvas.addObject(value)
+                elif kind == JOURNAL_UNDO:
+                    self.canvas.undo()
+                else:
+                    self.canvas.store.resize(self.canvas.store.size().expandedTo(value))
+        except (OSError, ValueError, struct.error, zlib.error) as error:
+            self.canvas.clear()
+            orphan.remove()
+            self.showError('Не удалось восстановить рисунок', str(error))
+            return
+        self.journal.replaced = orphan
+        self.canvas.saved = False
+        self.main_widget.setEnabled(True)
+        self.canvas.update()
 
     """
     Метод openFile. Работает с пользователем по открытию файла. Также привязан к окну, потому что при запуске окно
-    отключено, а чтобы его "разблокировать", нужно создать новый холст или открыть картинку.
+    отключено, а чтобы его "разблокировать", нужно создать новый холст или открыть картинку. Картинка читается в фоне
+    (см. класс LoadTask): сразу после выбора файла холст принимает размер картинки, вскоре на нем появляется ее
+    уменьшенная копия, а плитки в полном размере подменяют ее по мере чтения. Первыми читаются плитки видимой части
+    холста: видимая часть виджета переводится в координаты холста с учетом масштаба и сдвига. Ход чтения виден в
+    строке состояния.
     """
 
     def openFile(self):
         file = QFileDialog.getOpenFileName(self, 'Открытие', 'C:/', '(*.png);;(*.jpg);;(*.bmp)')[0]
         if file:
-            self.canvas.objects.clear()
-            self.canvas.objects.append(Image(file))
+            size = QImageReader(file).size()
+            if not size.isValid():
+                self.showError('Не удалось открыть картинку', QImageReader(file).errorString())
+                return
+            self.cancelLoad()
+            self.canvas.clear()
+            self.canvas.store.resize(self.canvas.store.size().expandedTo(size))
+            self.canvas.startLoad(Image(file))
+            visible = self.canvas.transform().inverted()[0].mapRect(self.canvas.visibleRegion().boundingRect())
+            self.load_task = LoadTask(file, size, visible, self.canvas.store.background)
+            self.load_task.signals.preview.connect(self.loadPreview)
+            self.load_task.signals.tiles.connect(self.loadTiles)
+            self.load_task.signals.progress.connect(self.loadProgress)
+            self.load_task.signals.finished.connect(self.loadFinished)
+            self.load_task.signals.failed.connect(self.loadFailed)
+            self.statusbar.showMessage('Чтение картинки...')
+            QThreadPool.globalInstance().start(self.load_task)
             if not self.main_widget.isEnabled():
                 self.main_widget.setEnabled(True)
 
     """
-    Метод saveFile. Работает над сохранением разрисованного холста. Если сохранение состоялось, кол-во сохраненных
-    объектов холста обновляется, а холст становится сохраненным
+    Методы фонового чтения картинки. Сигналы отмененного чтения могли успеть встать в очередь, поэтому каждый метод
+    сначала проверяет, что сигнал пришел от текущей задачи (метод ownLoad).
+        loadPreview - показывает на холсте уменьшенную копию картинки
+        loadTiles - кладет на холст готовые плитки
+        loadProgress - показывает ход чтения в строке состояния
+        loadFinished - картинка прочитана: она кладется в кэш картинок (чтобы ее не пришлось читать снова при
+        перерисовке холста), а история отмены начинается заново
+        loadFailed - прочитать не удалось: холст очищается, показывается ошибка
+        ownLoad - пришел ли сигнал от текущего чтения
+        cancelLoad - отменяет текущее чтение, если оно идет (холст при этом не трогается)
+        waitLoad - дожидается конца текущего чтения в отдельном цикле событий load_loop, который заканчивается по
+        сигналу конца или ошибки чтения (или по отмене, см. endLoad). Окно при этом перерисовывается и принимает
+        плитки, но нажатия мыши и клавиш не обрабатываются, а меню и холст отключены, чтобы посреди сохранения или
+        фильтра нельзя было открыть другой файл или начать еще одно сохранение. Нужен перед действиями, которым нужен
+        весь холст (сохранение, фильтры)
+        endLoad - забывает задачу, очищает строку состояния и заканчивает ожидание waitLoad, если оно идет
+    """
+
+    def loadPreview(self, image):
+        if self.ownLoad():
+            self.canvas.showPreview(image, QRect(QPoint(0, 0), self.load_task.size))
+
+    def loadTiles(self, tiles):
+        if self.ownLoad():
+            self.canvas.loadTiles(tiles)
+
+    def loadProgress(self, value):
+        if self.ownLoad():
+            self.statusbar.showMessage(f'Чтение картинки: {value}%')
+
+    def loadFinished(self, image):
+        if self.ownLoad():
+            if image is not None:
+                IMAGE_CACHE.put(self.load_task.file, image)
+            self.endLoad()
+            self.canvas.endLoad()
+
+    def loadFailed(self, error):
+        if self.ownLoad():
+            self.endLoad()
+            self.canvas.clear()
+            self.canvas.update()
+            self.showError('Не удалось открыть картинку', error)
+
+    def ownLoad(self):
+        return self.load_task is not None and self.sender() is self.load_task.signals
+
+    def cancelLoad(self):
+        if self.load_task is not None:
+            self.load_task.cancel()
+            self.endLoad()
+
+    def waitLoad(self):
+        if self.load_task is None:
+            return
+        self.load_loop = QEventLoop()
+        self.load_task.signals.finished.connect(self.load_loop.quit)
+        self.load_task.signals.failed.connect(self.load_loop.quit)
+        menubar, main_widget = self.menubar.isEnabled(), self.main_widget.isEnabled()
+        self.menubar.setEnabled(False)
+        self.main_widget.setEnabled(False)
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            self.load_loop.exec(QEventLoop.ExcludeUserInputEvents)
+        finally:
+            QApplication.restoreOverrideCursor()
+            self.menubar.setEnabled(menubar)
+            self.main_widget.setEnabled(main_widget)
+            self.load_loop = None
+
+    def endLoad(self):
+        self.load_task = None
+        self.statusbar.clearMessage()
+        if self.load_loop is not None:
+            self.load_loop.quit()
+
+    """
+    Метод saveFile. Работает над сохранением разрисованного холста. Картинка собирается и записывается в фоне (см.
+    класс SaveTask), а окно показывает ход сохранения с кнопкой отмены и продолжает работать. Кол-во сохраненных
+    объектов обновляется, а холст становится сохраненным, только когда файл действительно записан. Пока идет одно
+    сохранение, второе не начинается. С wait=True метод дожидается конца сохранения (окно при этом не замирает) -
+    так делают создание нового холста и закрытие окна, которым нужно знать, сохранился ли холст. Если открытая
+    картинка еще читается, сохранение сначала дожидается конца чтения.
+    """
+
+    def saveFile(self, wait=False):
+        if self.save_task is not None:
+            return
+        self.waitLoad()
+        file = QFileDialog.getSaveFileName(self, 'Сохранение', 'C:/', '(*.png);;(*.jpg);;(*.bmp)')[0]
+        if not file:
+            return
+        self.canvas.saving_objects = len(self.canvas.objects)
+        self.save_task = SaveTask(self.canvas.store, file, self.save_options)
+        self.save_progress = QProgressDialog('Сохранение картинки...', 'Отмена', 0, 100, self)
+        self.save_progress.setWindowTitle('Сохранение')
+        self.save_progress.setMinimumDuration(500)
+        self.save_progress.canceled.connect(self.save_task.cancel)
+        self.save_task.signals.progress.connect(self.save_progress.setValue)
+        self.save_task.signals.finished.connect(self.saveFinished)
+        self.save_task.signals.failed.connect(self.saveFailed)
+        self.save_task.signals.cancelled.connect(self.saveFailed)
+        if wait:
+            loop = QEventLoop()
+            self.save_task.signals.finished.connect(loop.quit)
+            self.save_task.signals.failed.connect(loop.quit)
+            self.save_task.signals.cancelled.connect(loop.quit)
+            QThreadPool.globalInstance().start(self.save_task)
+            loop.exec()
+        else:
+            QThreadPool.globalInstance().start(self.save_task)
+
+    """
+    Метод showFilters. Открывает окно фильтров и, если пользователь нажал "Применить", накладывает выбранный фильтр на
+    весь холст. Пока фильтр накладывается, курсор показывает ожидание. Если открытая картинка еще читается, окно
+    фильтров откроется, когда чтение закончится.
+    """
+
+    def showFilters(self):
+        self.waitLoad()
+        dialog = FilterDialog(self.canvas.store, self)
+        if dialog.exec():
+            QApplication.setOverrideCursor(Qt.WaitCursor)
+            try:
+                self.canvas.addObject(dialog.filter())
+            finally:
+                QApplication.restoreOverrideCursor()
+
+    """
+    Методы строки состояния:
+        showZoom - показывает масштаб холста в правом углу
+        showInputRate - показывает, сколько движений мыши в секунду присылает система и сколько кадров в секунду
+        рисует холст. Первое число может быть в разы больше второго: лишние движения не рисуются по отдельности, а
+        собираются в кадры
+        showSimplified - на несколько секунд показывает, сколько точек убрала обработка законченного мазка
+    """
+
+    def showZoom(self, zoom):
+        self.zoom_label.setText(f'{zoom * 100:.0f}%')
+
+    def showInputRate(self, events, frames):
+        self.input_label.setText(f'Мышь: {events:.0f} событий/с, {frames:.0f} кадров/с')
+
+    def showSimplified(self, before, after):
+        self.statusbar.showMessage(f'Мазок: {before} точек, после обработки {after} (убрано {before - after})', 3000)
+
+    """
+    Метод recordTrace. Начинает и заканчивает запись трассировки (см. класс Profiler). Когда запись заканчивается,
+    спрашивает, куда сохранить трассировку: файл открывается в chrome://tracing или Perfetto, где видно каждый кадр,
+    рисование объектов, сохранение и чтение. Пока идет запись, замеры включены, даже если панель показателей скрыта.
+    """
+
+    def recordTrace(self, record):
+        if record:
+            PROFILER.startTrace()
+            self.canvas.updateProfiler()
+            self.statusbar.showMessage('Идет запись трассировки', 3000)
+            return
+        PROFILER.stopTrace()
+        self.canvas.updateProfiler()
+        file = QFileDialog.getSaveFileName(self, 'Сохранение трассировки', 'C:/', '(*.json)')[0]
+        if file:
+            try:
+                PROFILER.dump(file)
+            except OSError as error:
+                self.showError('Не удалось сохранить трассировку', str(error))
+
+    """
+    Метод askTolerance. Спрашивает у пользователя допуск заливки области.
     """
 
-    def saveFile(self):
-        saver = Save(self.canvas.size())
-        saver.save(self.canvas.objects)
-        if saver.file:
+    def askTolerance(self):
+        tolerance, ok = QInputDialog.getInt(self, 'Допуск заливки', 'Допуск заливки области (0 - только точно такой '
+                                            'же цвет):', self.canvas.tolerance, 0, 255)
+        if ok:
+            self.canvas.setTolerance(tolerance)
+
+    """
+    Метод askSimplify. Спрашивает у пользователя допуск упрощения мазков в пикселях: точки, которые отходят от
+    упрощенной линии не дальше допуска, выбрасываются.
+    """
+
+    def askSimplify(self):
+        tolerance, ok = QInputDialog.getDouble(self, 'Упрощение мазков', 'Допуск упрощения мазков в пикселях '
+                                               '(0 - не упрощать):', self.canvas.simplify_tolerance, 0, 16, 1)
+        if ok:
+            self.canvas.setSimplify(tolerance)
+
+    """
+    Метод saveOptions. Спрашивает у пользователя настройки кодирования картинок: степень сжатия PNG и качество JPG.
+    Настройки действуют на все следующие сохранения до закрытия приложения.
+    """
+
+    def saveOptions(self):
+        png = self.save_options['png']
+        jpg = self.save_options['jpg']
+        compression, ok = QInputDialog.getInt(self, 'Параметры сохранения', 'Степень сжатия PNG (0 - быстрее, 9 - '
+                                              'меньше файл):', png['compression'], 0, 9)
+        if not ok:
+            return
+        quality, ok = QInputDialog.getInt(self, 'Параметры сохранения', 'Качество JPG (0-100):', jpg['quality'], 0,
+                                          100)
+        if not ok:
+            return
+        png['compression'] = compression
+        jpg['quality'] = quality
+
+    """
+    Методы завершения фонового сохранения:
+        saveFinished - файл записан: холст считается сохраненным на момент начала сохранения (если после этого на
+        холсте что-то нарисовали, он остается несохраненным)
+        saveFailed - файл не записан: показывает ошибку, если она была (при отмене ошибки нет)
+        endSave - убирает окно хода сохранения и забывает задачу и число объектов, с которым сохранение началось
+    """
+
+    def saveFinished(self, file):
+        count = self.canvas.saving_objects
+        self.endSave()
+        self.canvas.saved_objects = count
+        self.canvas.saved = len(self.canvas.objects) == count
+
+    def saveFailed(self, error=''):
+        self.endSave()
+        if error:
+            self.showError('Не удалось сохранить картинку', error)
+
+    def endSave(self):
+        self.save_progress.reset()
+        self.save_progress.deleteLater()
+        self.save_progress = None
+        self.save_task = None
+        self.canvas.saving_objects = None
+
+    """
+    Методы openDocument и saveDocument. Открывают и сохраняют документ в родном формате Qt Paint (.qtp). В отличие от
+    картинки, документ хранит все объекты по отдельности, поэтому после открытия с ними можно продолжить работу.
+    Документ читается потоком и рисуется прямо по ходу чтения. Сохраненный документ тоже считается сохранением холста.
+    Как и картинка (см. класс SaveTask), документ сначала пишется во временный файл рядом с нужным и только в конце
+    переименовывается, поэтому ошибка записи (папка только для чтения, нет места на диске) не портит уже
+    существующий документ, а только показывает сообщение об ошибке.
+    """
+
+    def openDocument(self):
+        file = QFileDialog.getOpenFileName(self, 'Открытие документа', 'C:/', '(*.qtp)')[0]
+        if file:
+            self.cancelLoad()
+            try:
+                with PROFILER.span('openDocument', 'document'), open(file, mode='rb') as stream:
+                    reader = DocumentReader(stream, os.path.dirname(file))
+                    self.canvas.load(reader.size, reader.base, reader)
+                    self.canvas.resetHistory()
+            except (OSError, ValueError, struct.error, zlib.error) as error:
+                self.canvas.clear()
+                self.showError('Не удалось открыть документ', str(error))
+                return
+            if not self.main_widget.isEnabled():
+                self.main_widget.setEnabled(True)
+
+    def saveDocument(self):
+        file = QFileDialog.getSaveFileName(self, 'Сохранение документа', 'C:/', '(*.qtp)')[0]
+        if file:
+            self.waitLoad()
+            temp = file + '.part'
+            try:
+                writeDocument(temp, self.canvas.store.size(), self.canvas.objects, self.canvas.base)
+                os.replace(temp, file)
+            except (OSError, ValueError, struct.error) as error:
+                if os.path.exists(temp):
+                    os.remove(temp)
+                self.showError('Не удалось сохранить документ', str(error))
+                return
             self.canvas.saved_objects = len(self.canvas.objects)
             self.canvas.saved = True
 
+    """
+    Метод showError. Создает диалоговое окно с ошибкой.
+    """
+
+    def showError(self, title, text):
+        self.message = QMessageBox()
+        setIcon(self.message)
+        self.message.setIcon(QMessageBox.Critical)
+        self.message.setWindowTitle(title)
+        self.message.setText(text)
+        self.message.addButton('ОК', QMessageBox.YesRole)
+        self.message.exec()
+
     """
     Метод newCanvas. Создает "новый" холст. Первостепенная задача этого метода - дать пользователю начать рисование,
     далее - стирать холст и обновлять его. При этом пользователь имеет выбор между опциями "Создать холст" и "Очистить
@@ -1170,7 +6049,7 @@ class Window(QMainWindow):
                 if self.message.clickedButton() == btnclose:
                     self.clearCanvas()
                 elif self.message.clickedButton() == btnsave:
-                    self.saveFile()
+                    self.saveFile(wait=True)
                     if not self.canvas.saved:
                         pass
                     else:
@@ -1186,9 +6065,10 @@ class Window(QMainWindow):
     """
 
     def clearCanvas(self):
-        self.canvas.objects.clear()
-        self.canvas.objects.append(Fill(self.canvas.width(), self.canvas.height(), Qt.white))
-        self.update()
+        self.cancelLoad()
+        self.canvas.clear()
+        self.canvas.addObject(Fill(self.canvas.store.width, self.canvas.store.height, Qt.white))
+        self.canvas.update()
 
     """
     Метод aboutProgram. Создает информационное диалоговое окно и выводит информацию о программе с заготовленного текста.
@@ -1199,7 +6079,7 @@ class Window(QMainWindow):
         setIcon(self.message)
         self.message.setIcon(QMessageBox.Information)
         self.message.setWindowTitle('Информация о проекте')
-        self.message.setText(INFO_TEXT)
+        self.message.setText(readText(dir_info))
         self.message.addButton('ОК', QMessageBox.YesRole)
         self.message.exec()
 
@@ -1212,7 +6092,7 @@ class Window(QMainWindow):
         setIcon(self.message)
         self.message.setIcon(QMessageBox.Information)
         self.message.setWindowTitle('Помощь')
-        self.message.setText(HELP_TEXT)
+        self.message.setText(readText(dir_help))
         self.message.addButton('ОК', QMessageBox.YesRole)
         self.message.exec()
 
@@ -1220,7 +6100,8 @@ class Window(QMainWindow):
     Встроенный метод класса QMainWindow, от которого унаследован Окно. Срабатывает, если ядро библиотеки 
     фиксирует закрытие приложения. Если окно так и не было "разблокировано", все в порядке. А если нет, проверяем, 
     сохранен ли холст, если нет, то предлагаем сохраниться. "Да" - сохраняем и выходим. "Нет" - сразу выходим.
-    "Отмена" - откладываем закрытие приложения, пока пользователь не решит.
+    "Отмена" - откладываем закрытие приложения, пока пользователь не решит. Если окно все-таки закрывается, а картинка
+    еще читается, чтение отменяется. Журнал автосохранения дописывается и удаляется: приложение закрыто как следует.
     """
 
     def closeEvent(self, event):
@@ -1242,25 +6123,38 @@ class Window(QMainWindow):
                 if self.message.clickedButton() == btnclose:
                     event.accept()
                 elif self.message.clickedButton() == btnsave:
-                    self.saveFile()
+                    self.saveFile(wait=True)
                     if not self.canvas.saved:
                         event.ignore()
                 else:
                     event.ignore()
+        if event.isAccepted():
+            self.cancelLoad()
+            self.journal.close()
 
 
 """
 Стандартная проверка самостоятельного запуска кода. Для зеленых в Python - эта часть кода запустится, только если
 файл был запущен самостоятельно, а не как часть другой программы (например, при импортировании). Ну а поскольку в этой
 части находится инициализация приложения и отслеживание его работы в системе, ВСЁ приложение не заработает как
-импортированная библиотека.
+импортированная библиотека. С ключом --profile-startup приложение печатает, сколько длилась каждая фаза запуска до
+первой отрисовки холста (см. класс StartupProfile).
 """
 
 
 def main():
+    global STARTUP_PROFILE
+    if '--profile-startup' in sys.argv:
+        STARTUP_PROFILE = StartupProfile(STARTUP_TIME)
+        sys.argv.remove('--profile-startup')
+    markStartup('загрузка модуля')
     app = QApplication(sys.argv)
+    markStartup('QApplication')
     wnd = Window()
+    if STARTUP_PROFILE is not None:
+        STARTUP_PROFILE.watch(wnd.canvas)
     wnd.showMaximized()
+    markStartup('показ окна')
     sys.exit(app.exec())
 
 
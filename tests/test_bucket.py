@@ -0,0 +1,128 @@
+from collections import deque
+
+import numpy
+from PyQt5.QtCore import QRect
+from PyQt5.QtGui import QColor, QImage
+
+from main import TILE_SIZE, Bucket, TileStore, imagePixels
+
+WHITE, BLACK, GREEN = 0xFFFFFF, 0x000000, 0x00FF00
+
+
+def storeFrom(pixels):
+    height, width = pixels.shape
+    store = TileStore(width, height)
+    for key in store.keys(store.rect()):
+        x, y = key[0] * TILE_SIZE, key[1] * TILE_SIZE
+        block = pixels[y:y + TILE_SIZE, x:x + TILE_SIZE]
+        if (block != WHITE).any():
+            tile = imagePixels(store.tile(key), True)
+            tile[:block.shape[0], :block.shape[1]] = block | 0xFF000000
+    return store
+
+
+def canvasPixels(store):
+    image = store.toImage().convertToFormat(QImage.Format_RGB32)
+    return imagePixels(image)[:store.height, :store.width] & 0xFFFFFF
+
+
+def expectedFill(pixels, x, y, color, tolerance):
+    channels = pixels.view(numpy.uint8).reshape(pixels.shape + (4,))[..., :3].astype(int)
+    similar = (numpy.abs(channels - channels[y, x]) <= tolerance).all(axis=-1)
+    result = pixels.copy()
+    seen = numpy.zeros(pixels.shape, bool)
+    seen[y, x] = True
+    queue = deque([(x, y)])
+    while queue:
+        px, py = queue.popleft()
+        result[py, px] = color
+        for nx, ny in ((px - 1, py), (px + 1, py), (px, py - 1), (px, py + 1)):
+            if 0 <= nx < pixels.shape[1] and 0 <= ny < pixels.shape[0] and similar[ny, nx] and not seen[ny, nx]:
+                seen[ny, nx] = True
+                queue.append((nx, ny))
+    return result
+
+
+def bucketFill(pixels, x, y, tolerance):
+    store = storeFrom(pixels)
+    bucket = Bucket(x, y, QColor(GREEN), tolerance)
+    store.commit(bucket)
+    return store, bucket
+
+
+def test_fill_stops_at_line(app):
+    pixels = numpy.full((300, 600), WHITE, numpy.uint32)
+    pixels[:, 300:303] = BLACK
+    store, bucket = bucketFill(pixels, 10, 10, 0)
+
+    result = canvasPixels(store)
+
+    assert (result[:, :300] == GREEN).all()
+    assert (result[:, 300:303] == BLACK).all()
+    assert (result[:, 303:] == WHITE).all()
+    assert bucket.boundingRect() == QRect(0, 0, 300, 300)
+
+
+def test_fill_does_not_leak_through_diagonal(app):
+    pixels = numpy.full((300, 300), WHITE, numpy.uint32)
+    pixels[numpy.arange(300), numpy.arange(300)] = BLACK
+    store, _ = bucketFill(pixels, 200, 10, 0)
+
+    result = canvasPixels(store)
+    above = numpy.triu(numpy.ones((300, 300), bool), 1)
+
+    assert (result[above] == GREEN).all()
+    assert (result[numpy.tril(numpy.ones((300, 300), bool), -1)] == WHITE).all()
+    assert (numpy.diagonal(result) == BLACK).all()
+
+
+def test_fill_from_canvas_edge(app):
+    rng = numpy.random.default_rng(1)
+    pixels = numpy.where(rng.random((300, 530)) < 0.3, BLACK, WHITE).astype(numpy.uint32)
+    for x, y in ((529, 299), (0, 299), (529, 0), (256, 299)):
+        pixels[y, x] = WHITE
+        store, _ = bucketFill(pixels, x, y, 0)
+        assert (canvasPixels(store) == expectedFill(pixels, x, y, GREEN, 0)).all()
+
+
+def test_fill_tolerance(app):
+    pixels = numpy.full((300, 300), WHITE, numpy.uint32)
+    pixels[100:200, 100:200] = 0xF0F0F0
+    pixels[140:160, 140:160] = WHITE
+
+    strict, _ = bucketFill(pixels, 0, 0, 0)
+    loose, _ = bucketFill(pixels, 0, 0, 16)
+
+    assert (canvasPixels(strict)[100:200, 100:200] == pixels[100:200, 100:200]).all()
+    assert (canvasPixels(strict)[:100] == GREEN).all()
+    assert (canvasPixels(loose) == GREEN).all()
+
+
+def test_fill_keeps_unreached_spans_of_mostly_filled_tile(app):
+    pixels = numpy.full((200, 200), WHITE, numpy.uint32)
+    pixels[50:60, 50:150] = BLACK
+    pixels[140:150, 50:150] = BLACK
+    pixels[50:150, 50:60] = BLACK
+    pixels[50:150, 140:150] = BLACK
+    store, bucket = bucketFill(pixels, 0, 0, 0)
+
+    result = canvasPixels(store)
+
+    assert (result[60:140, 60:140] == WHITE).all()
+    assert (result == expectedFill(pixels, 0, 0, GREEN, 0)).all()
+    assert bucket.boundingRect() == QRect(0, 0, 200, 200)
+
+
+def test_fill_matches_reference(app):
+    rng = numpy.random.default_rng(7)
+    for tolerance in (0, 40):
+        pixels = numpy.full((400, 700), WHITE, numpy.uint32)
+        for _ in range(60):
+            x, y = rng.integers(0, 700), rng.integers(0, 400)
+            width, height = rng.integers(1, 200), rng.integers(1, 8)
+            if rng.random() < 0.5:
+                width, height = height, width
+            pixels[y:y + height, x:x + width] = rng.choice([BLACK, 0xE0E0E0, 0xF8F8F8])
+        pixels[0, 0] = WHITE
+        store, _ = bucketFill(pixels, 0, 0, tolerance)
+        assert (canvasPixels(store) == expectedFill(pixels, 0, 0, GREEN, tolerance)).all()
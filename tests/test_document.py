@@ -0,0 +1,51 @@
+from PyQt5.QtCore import QPoint, QSize, Qt
+from PyQt5.QtGui import QColor, QPolygon
+
+from main import (Brush, Bucket, Circle, Eraser, Fill, Filter, Line, Pencil, Rectangle, TileStore, Triangle,
+                  readDocument, writeDocument)
+
+
+def sampleObjects():
+    brush = Brush(QPoint(10, 10), 5, QColor(Qt.red))
+    brush.points = QPolygon([QPoint(10, 10), QPoint(40, 25), QPoint(90, 70)])
+    pencil = Pencil(QPoint(5, 5), QColor(Qt.blue))
+    pencil.points = QPolygon([QPoint(5, 5), QPoint(6, 9)])
+    eraser = Eraser(QPoint(50, 50), 8)
+    eraser.points = QPolygon([QPoint(50, 50), QPoint(120, 60)])
+    return [Fill(300, 200, QColor(Qt.white)),
+            brush,
+            pencil,
+            eraser,
+            Line(0, 0, 299, 199, 3, QColor(Qt.black)),
+            Line(-40000, 5, 40000, 5, 2, QColor(Qt.green)),
+            Circle(20, 20, 80, 60, True, 3, QColor(Qt.black), QColor(Qt.yellow)),
+            Rectangle(100, 100, 180, 150, False, 2, QColor(Qt.darkRed), QColor(Qt.white)),
+            Triangle(150, 20, 250, 90, True, 4, QColor(Qt.magenta), QColor(Qt.cyan)),
+            Bucket(200, 180, QColor(Qt.gray), 16),
+            Filter('blur', 2)]
+
+
+def test_document_round_trip(app, tmp_path):
+    objects = sampleObjects()
+    base = TileStore(300, 200)
+    base.commitAll(objects[:3])
+    path = str(tmp_path / 'drawing.qtp')
+    writeDocument(path, QSize(300, 200), objects, base)
+
+    size, restored_base, restored = readDocument(path)
+
+    assert size == QSize(300, 200)
+    assert [obj.toDict() for obj in restored] == [obj.toDict() for obj in objects]
+    assert restored_base.toImage() == base.toImage()
+
+
+def test_uncompressed_document_round_trip(app, tmp_path):
+    objects = sampleObjects()
+    path = str(tmp_path / 'drawing.qtp')
+    writeDocument(path, QSize(300, 200), objects, compress=False)
+
+    size, base, restored = readDocument(path)
+
+    assert size == QSize(300, 200)
+    assert base is None
+    assert [obj.toDict() for obj in restored] == [obj.toDict() for obj in objects]
@@ -0,0 +1,76 @@
+import random
+
+import pytest
+from PyQt5.QtCore import QPoint, QSize
+from PyQt5.QtGui import QColor
+
+from main import (CHECKPOINT_INTERVAL, COMPACT_LIMIT, HISTORY_BUDGET, TILE_SIZE, Brush, Bucket, Canvas, Circle, Fill,
+                  Filter, Hexagon, History, Line, Rectangle, Triangle)
+
+WIDTH, HEIGHT = 700, 500
+
+
+def randomObject(rng):
+    x, y = rng.randrange(WIDTH), rng.randrange(HEIGHT)
+    color = QColor(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+    kind = rng.random()
+    if kind < 0.3:
+        stroke = Brush(QPoint(x, y), rng.choice((2, 5, 8)), color)
+        for _ in range(20):
+            x, y = x + rng.randint(-15, 15), y + rng.randint(-15, 15)
+            stroke.points.append(QPoint(x, y))
+        return stroke
+    if kind < 0.45:
+        return Line(x, y, rng.randrange(WIDTH), rng.randrange(HEIGHT), rng.choice((1, 3, 5)), color)
+    if kind < 0.65:
+        shape = rng.choice((Circle, Rectangle, Triangle, Hexagon))
+        fill = QColor(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        return shape(x, y, x + rng.randint(-200, 200), y + rng.randint(-200, 200), rng.random() < 0.5, 3, color, fill)
+    if kind < 0.8:
+        return Bucket(x, y, color, rng.choice((0, 24)))
+    if kind < 0.9:
+        return rng.choice((Filter('invert'), Filter('blur', rng.randint(1, 3)), Filter('sharpen', 100),
+                           Filter('level', 20, 10)))
+    if kind < 0.95:
+        return Fill(rng.randint(50, WIDTH), rng.randint(50, HEIGHT), color)
+    return Fill(WIDTH, HEIGHT, color)
+
+
+def newCanvas(compact_limit, history):
+    canvas = Canvas()
+    canvas.store.resize(QSize(WIDTH, HEIGHT))
+    canvas.compact_limit = compact_limit
+    canvas.history = history
+    canvas.resetHistory()
+    return canvas
+
+
+@pytest.mark.parametrize('compact_limit, interval, budget', [
+    (COMPACT_LIMIT, CHECKPOINT_INTERVAL, HISTORY_BUDGET),
+    (5, 4, HISTORY_BUDGET),
+    (5, 3, 12 * TILE_SIZE * TILE_SIZE * 4),
+])
+def test_undo_redo_restores_every_state(app, compact_limit, interval, budget):
+    rng = random.Random(compact_limit + interval)
+    canvas = newCanvas(compact_limit, History(interval, budget))
+    states = [canvas.store.toImage()]
+
+    for _ in range(80):
+        if rng.random() < 0.15 and canvas.history.canUndo():
+            canvas.undo()
+            assert canvas.store.toImage() == states[canvas.history.position]
+        else:
+            canvas.addObject(randomObject(rng))
+            del states[canvas.history.position:]
+            states.append(canvas.store.toImage())
+
+    while canvas.history.canUndo():
+        canvas.undo()
+        assert canvas.store.toImage() == states[canvas.history.position]
+    first = canvas.history.position
+    while canvas.history.canRedo():
+        canvas.redo()
+        assert canvas.store.toImage() == states[canvas.history.position]
+    assert canvas.history.position == len(states) - 1
+    if budget < HISTORY_BUDGET:
+        assert first > 0
@@ -0,0 +1,101 @@
+import random
+
+from PyQt5.QtCore import QPoint, QRect
+from PyQt5.QtGui import QColor
+
+from main import Brush, Canvas, Circle, Hexagon, Line, PrimitiveStore, Rectangle, Triangle
+
+
+def randomObject(rng):
+    x, y = rng.randint(-600, 1500), rng.randint(-600, 1200)
+    color = QColor(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+    kind = rng.random()
+    if kind < 0.2:
+        stroke = Brush(QPoint(x, y), 5, color)
+        for _ in range(10):
+            x, y = x + rng.randint(-80, 80), y + rng.randint(-80, 80)
+            stroke.points.append(QPoint(x, y))
+        return stroke
+    if kind < 0.4:
+        return Line(x, y, x + rng.randint(-1200, 1200), y + rng.randint(-1200, 1200), rng.choice((1, 3, 9)), color)
+    shape = rng.choice((Circle, Rectangle, Triangle, Hexagon))
+    span = rng.choice((20, 300, 1200))
+    return shape(x, y, x + rng.randint(-span, span), y + rng.randint(-span, span), rng.random() < 0.5, 3, color, color)
+
+
+def randomRect(rng):
+    x, y = rng.randint(-800, 1600), rng.randint(-800, 1300)
+    return QRect(x, y, rng.randint(1, 900), rng.randint(1, 900))
+
+
+def bruteQuery(objects, rect):
+    return [index for index, obj in enumerate(objects) if obj.boundingRect().intersects(rect)]
+
+
+def bruteObjectAt(objects, point):
+    for index in reversed(range(len(objects))):
+        obj = objects[index]
+        if obj.boundingRect().contains(point) and hasattr(obj, 'contains') and obj.contains(point):
+            return index
+    return None
+
+
+def assertMatches(canvas, objects, rng):
+    for _ in range(40):
+        rect = randomRect(rng)
+        assert canvas.objects.query(rect) == bruteQuery(objects, rect)
+        point = QPoint(rng.randint(-700, 1600), rng.randint(-700, 1300))
+        assert list(canvas.objects.at(point)) == bruteQuery(objects, QRect(point, point))[::-1]
+        assert canvas.objectAt(point) == bruteObjectAt(objects, point)
+
+
+def newCanvas(rng, count):
+    canvas = Canvas()
+    objects = [randomObject(rng) for _ in range(count)]
+    canvas.objects = PrimitiveStore(objects, indexed=True)
+    return canvas, objects
+
+
+def test_index_matches_linear_scan(app):
+    rng = random.Random(1)
+    canvas, objects = newCanvas(rng, 300)
+
+    assertMatches(canvas, objects, rng)
+
+
+def test_index_after_removing_objects(app):
+    rng = random.Random(2)
+    canvas, objects = newCanvas(rng, 200)
+
+    canvas.dropObjects(37)
+    del objects[:37]
+    assertMatches(canvas, objects, rng)
+    for obj in [randomObject(rng) for _ in range(50)]:
+        canvas.objects.append(obj)
+        objects.append(obj)
+    canvas.dropObjects(80)
+    del objects[:80]
+    assertMatches(canvas, objects, rng)
+    del canvas.objects[-20:]
+    del objects[-20:]
+    assertMatches(canvas, objects, rng)
+    del canvas.objects[10:30]
+    del objects[10:30]
+    assertMatches(canvas, objects, rng)
+
+
+def test_index_follows_dragged_shape(app):
+    rng = random.Random(3)
+    canvas, objects = newCanvas(rng, 100)
+    shape = Rectangle(-300, -200, -290, -190, True, 5, QColor(0, 0, 0), QColor(255, 0, 0))
+    canvas.objects.append(shape, live=True)
+    objects.append(shape)
+
+    for step in range(1, 12):
+        shape.setEnd(-290 + step * 150, -190 + step * 110)
+        canvas.objects.touch()
+        assertMatches(canvas, objects, rng)
+    shape.setEnd(-100, -50)
+    canvas.objects.touch()
+    canvas.objects.seal()
+    assertMatches(canvas, objects, rng)
@@ -0,0 +1,38 @@
+import os
+
+from PyQt5.QtCore import QSize
+
+from main import JOURNAL_OBJECT, Journal, orphanJournals
+from test_document import sampleObjects
+
+
+def test_journal_recovers_truncated_tail(app, tmp_path):
+    objects = sampleObjects()
+    journal = Journal(str(tmp_path / 'session-crashed'), delay=0)
+    journal.rollover(QSize(300, 200), None, objects[:2], 0)
+    for obj in objects[2:6]:
+        journal.append(obj, QSize(300, 200))
+    journal.close(discard=False)
+    path = journal.path('journal', journal.generation)
+    os.truncate(path, os.path.getsize(path) - 3)
+
+    orphans = orphanJournals(str(tmp_path))
+
+    assert len(orphans) == 1
+    size, base, restored, entries = orphans[0].read()
+    assert size == QSize(300, 200)
+    assert base is None
+    assert [obj.toDict() for obj in restored] == [obj.toDict() for obj in objects[:2]]
+    assert [kind for kind, _ in entries] == [JOURNAL_OBJECT] * 3
+    assert [obj.toDict() for _, obj in entries] == [obj.toDict() for obj in objects[2:5]]
+    orphans[0].remove()
+    assert os.listdir(tmp_path) == []
+
+
+def test_running_journal_is_not_recovered(app, tmp_path):
+    journal = Journal(str(tmp_path / 'session-running'), delay=0)
+    journal.rollover(QSize(300, 200), None, sampleObjects(), 0)
+
+    assert orphanJournals(str(tmp_path)) == []
+    journal.close()
+    assert os.listdir(tmp_path) == []
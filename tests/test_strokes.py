@@ -0,0 +1,70 @@
+import numpy
+import pytest
+from PyQt5.QtCore import QPoint
+from PyQt5.QtGui import QColor
+
+from main import Brush, simplifyPoints
+
+
+def polylineDistance(points, polyline):
+    start, end = polyline[:-1], polyline[1:]
+    direction = end - start
+    length = numpy.einsum('ij,ij->i', direction, direction)
+    offset = points[:, None, :] - start[None, :, :]
+    along = numpy.einsum('pij,ij->pi', offset, direction) / numpy.where(length, length, 1)
+    offset -= numpy.clip(along, 0, 1)[:, :, None] * direction[None, :, :]
+    return numpy.sqrt(numpy.einsum('pij,pij->pi', offset, offset).min(axis=1))
+
+
+def randomWalk(rng, count):
+    steps = rng.normal(0, 4, (count, 2)) + rng.normal(0, 2, 2)
+    return numpy.cumsum(steps, axis=0)
+
+
+def strokeFrom(points):
+    stroke = Brush(QPoint(*points[0]), 3, QColor(0, 0, 0))
+    for x, y in points[1:]:
+        stroke.points.append(QPoint(x, y))
+    return stroke
+
+
+@pytest.mark.parametrize('tolerance', [0.5, 2, 10])
+def test_simplified_polyline_stays_within_tolerance(tolerance):
+    rng = numpy.random.default_rng(int(tolerance * 10))
+    for _ in range(20):
+        points = randomWalk(rng, rng.integers(3, 300))
+        keep = simplifyPoints(points, tolerance)
+
+        assert keep[0] and keep[-1]
+        assert (polylineDistance(points, points[keep]) <= tolerance + 1e-9).all()
+
+
+def test_simplify_keeps_turning_points():
+    points = numpy.array([(x, 0) for x in range(0, 101, 5)] + [(x, 0) for x in range(95, 39, -5)] +
+                         [(40, y) for y in range(5, 51, 5)] + [(40, y) for y in range(45, -1, -5)], float)
+
+    back = numpy.array([(x, 0) for x in range(0, 101, 5)] + [(x, 0) for x in range(95, 19, -5)], float)
+
+    assert points[simplifyPoints(points, 1)].tolist() == [[0, 0], [100, 0], [40, 0], [40, 50], [40, 0]]
+    assert back[simplifyPoints(back, 1)].tolist() == [[0, 0], [100, 0], [20, 0]]
+
+
+def test_stroke_simplify_drops_points_within_tolerance(app):
+    rng = numpy.random.default_rng(5)
+    points = numpy.rint(randomWalk(rng, 200)).astype(int)
+    stroke = strokeFrom(points.tolist())
+
+    removed = stroke.simplify(2)
+    kept = numpy.frombuffer(stroke.coords(), numpy.int32).reshape(-1, 2)
+
+    assert removed == len(points) - len(kept) > 0
+    assert kept[0].tolist() == points[0].tolist() and kept[-1].tolist() == points[-1].tolist()
+    assert (polylineDistance(points.astype(float), kept.astype(float)) <= 2 + 1e-9).all()
+
+
+@pytest.mark.parametrize('points', [[(10, 10)], [(10, 10), (40, 25)]])
+def test_short_strokes_are_unchanged(app, points):
+    stroke = strokeFrom(points)
+
+    assert stroke.simplify(5, smooth=True) == 0
+    assert numpy.frombuffer(stroke.coords(), numpy.int32).reshape(-1, 2).tolist() == [list(p) for p in points]